@@ -1,4 +1,5 @@
 import os
+import dj_database_url
 import django_on_heroku
 
 # BASE_DIR refers to the root directory of the Django project.
@@ -35,12 +36,22 @@ INSTALLED_APPS = [
 
 # MIDDLEWARE is a list of middleware to be used in the request/response lifecycle.
 MIDDLEWARE = [
+    # Profiles a sample of the requests (SQL queries, repeated queries, template time);
+    # first, so that the queries of the other middleware are counted too.
+    'store.instrumentation.QueryInstrumentationMiddleware',
+    # Pins visitors who just wrote to the primary database; before SessionMiddleware, so
+    # that session writes count.
+    'store.replicas.ReplicaMiddleware',
     # Various Django middleware for security, session management, etc.
     'django.middleware.security.SecurityMiddleware',
+    # Serves the collected static files, with far-future cache headers for the hashed ones.
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Sends the cookies of carts kept outside the database (see STORE_CART_STORAGE).
+    'store.cart_storage.CartStorageMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -51,7 +62,8 @@ ROOT_URLCONF = 'ecommerce_project.urls'
 # TEMPLATES configuration, including the template engines to be used.
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's template backend, timing the renders of profiled requests (see store.instrumentation).
+        'BACKEND': 'store.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],  # Directories to search for templates.
         'APP_DIRS': True,  # Whether to look for templates inside installed apps.
         'OPTIONS': {
@@ -81,6 +93,24 @@ DATABASES = {
     }
 }
 
+# Read replicas of the database, as a comma-separated list of database URLs in
+# STORE_REPLICA_URLS (e.g. "postgres://replica1/store,postgres://replica2/store"; to try it
+# locally, "sqlite:////path/to/replica.sqlite3" with a copy of db.sqlite3). The catalog
+# pages read from them (see store.replicas); everything else, and every write, uses
+# 'default'. Tests run against the default database only.
+STORE_REPLICA_URLS = [url.strip() for url in os.environ.get('STORE_REPLICA_URLS', '').split(',') if url.strip()]
+STORE_REPLICA_DATABASES = ['replica%d' % number for number in range(1, len(STORE_REPLICA_URLS) + 1)]
+DATABASES.update({
+    alias: dict(dj_database_url.parse(url), TEST={'MIRROR': 'default'})
+    for alias, url in zip(STORE_REPLICA_DATABASES, STORE_REPLICA_URLS)
+})
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+# The longest replication delay allowed for, in seconds. A visitor whose request wrote reads
+# from the primary for this long afterwards (through a cookie of this name), and pages and
+# menus built from a replica within this long of a catalog change aren't cached for good.
+STORE_REPLICA_LAG_SECONDS = 10
+STORE_REPLICA_COOKIE_NAME = 'store_primary'
+
 # AUTH_PASSWORD_VALIDATORS are used for password validation in the auth system.
 AUTH_PASSWORD_VALIDATORS = [
     # Various validators for password characteristics.
@@ -105,20 +135,142 @@ USE_I18N = True  # Internationalization
 USE_L10N = True  # Localization
 USE_TZ = True  # Timezone support
 
+# CACHES configures Django's cache framework, used for the catalog page cache, the menu and
+# the version stamps that invalidate them. It must be shared by every process (the web
+# workers, the payment worker and management commands), so an invalidation made by one is
+# seen by all; a per-process cache such as LocMemCache is refused while the page cache is on
+# (see store.checks). The database cache needs its table, created by
+# "manage.py createcachetable" (run by the release phase in the Procfile); memcached or
+# Redis can replace it here.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'store_cache',
+        'OPTIONS': {
+            # Cached pages, menus and tag stamps: keep plenty before culling the oldest.
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# Full-page cache for anonymous visitors of the catalog (home, category and product pages).
+# Entries are purged by signals when the catalog changes; the timeout is only a safety net.
+STORE_PAGE_CACHE_ENABLED = True
+STORE_PAGE_CACHE_TIMEOUT = 60 * 60
+# Identifies the deployed release in the ETags of the catalog pages, so browsers and CDNs
+# don't keep pages rendered by older templates (Heroku sets it with runtime dyno metadata).
+STORE_RELEASE = os.environ.get('HEROKU_RELEASE_VERSION', '')
+
+# Product listings: number of products per page, and how pages are found. 'offset' numbers
+# the pages (COUNT(*) plus OFFSET, slower the deeper the page); 'cursor' seeks to the page
+# from the last product shown, ordered by (name, id), with next/previous links only.
+STORE_PAGE_SIZE = 24
+STORE_LISTING_PAGINATION = os.environ.get('STORE_LISTING_PAGINATION', 'offset')
+
+# Number of reviews shown on a product page, and loaded at a time by its "More reviews" button.
+STORE_REVIEWS_PAGE_SIZE = 10
+
+# Number of orders per page of a customer's order history.
+STORE_ORDER_HISTORY_PAGE_SIZE = 20
+
+# The staff sales dashboard covers the last STORE_SALES_DASHBOARD_DAYS days by default, and
+# lists the STORE_SALES_DASHBOARD_TOP best-selling products.
+STORE_SALES_DASHBOARD_DAYS = 30
+STORE_SALES_DASHBOARD_TOP = 20
+
+# Where anonymous shoppers' carts are kept until checkout or sign-in, when they move to the
+# database: 'database' (Cart and CartItem rows, under an ID kept in the session), 'cookie' (a
+# signed cookie listing the products, for carts of up to STORE_CART_COOKIE_MAX_LINES products)
+# or 'cache' (the default cache, under an ID kept in a cookie). With 'cookie', or 'cache' on
+# memcached or Redis, browsing and filling a cart write nothing to the store's tables.
+STORE_CART_STORAGE = os.environ.get('STORE_CART_STORAGE', 'database')
+STORE_CART_COOKIE_NAME = 'cart'
+STORE_CART_COOKIE_MAX_LINES = 20
+
+# Admin changelists of tables with more rows than this show the database's row estimate
+# instead of running COUNT(*) over the whole table.
+STORE_ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Housekeeping: carts whose items haven't changed for STORE_ABANDONED_CART_DAYS days are deleted
+# with their items, and expired sessions too, by manage.py purge_carts or, every
+# STORE_PURGE_INTERVAL seconds (0 disables it), by a background thread of each web process.
+# Rows are deleted STORE_PURGE_BATCH_SIZE at a time, pausing STORE_PURGE_PAUSE seconds between batches.
+# Carts kept in a cookie or the cache expire after STORE_ABANDONED_CART_DAYS days as well.
+STORE_ABANDONED_CART_DAYS = 30
+STORE_PURGE_INTERVAL = int(os.environ.get('STORE_PURGE_INTERVAL', '0'))
+STORE_PURGE_BATCH_SIZE = 500
+STORE_PURGE_PAUSE = 0.1
+
+# "Customers also bought" recommendations, rebuilt from the order history by
+# manage.py build_recommendations: STORE_RECOMMENDATIONS_COUNT per product, leaving out
+# orders of more than STORE_RECOMMENDATIONS_MAX_ORDER_SIZE products.
+STORE_RECOMMENDATIONS_COUNT = 8
+STORE_RECOMMENDATIONS_MAX_ORDER_SIZE = 50
+
+# The category menu of the navbar is kept in each process and rebuilt when its version stamp
+# moves on; changes made by other processes are looked for every STORE_MENU_CHECK_INTERVAL
+# seconds, so most renders read nothing from the shared cache for the menu.
+STORE_MENU_CHECK_INTERVAL = 2
+
+# Type-ahead search suggestions, answered from an in-memory index of product names.
+# The index holds at most STORE_SUGGEST_MAX_NAMES names (bounding its memory use), and
+# changes made by other processes are looked for every STORE_SUGGEST_CHECK_INTERVAL seconds
+# and picked up by rebuilding the index in the background, off the request path.
+STORE_SUGGEST_MAX_NAMES = 500000
+STORE_SUGGEST_CHECK_INTERVAL = 5
+STORE_SUGGEST_LIMIT = 10
+
+# Product and category images are served as thumbnails of these widths (in pixels), in WebP
+# and JPEG, generated by STORE_THUMBNAIL_WORKERS background threads when an image is uploaded
+# (and by manage.py generate_thumbnails for existing images).
+STORE_THUMBNAIL_WIDTHS = [100, 250, 500, 1000]
+STORE_THUMBNAIL_WORKERS = 2
+
 # Static files (CSS, JavaScript, Images) configuration.
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-STATICFILES = [os.path.join(BASE_DIR, 'static')]
+# The static files are those of the apps (store/static); the project's static/ folder only
+# holds the uploaded media (MEDIA_ROOT), which collectstatic leaves alone.
+# collectstatic writes each file under a content-hashed name (css/store.3f2a….css) listed in a
+# manifest, plus pre-compressed .gz and .br (with the Brotli package) copies. WhiteNoise serves
+# them with the compressed copy the browser accepts and, since a changed file gets a new name,
+# a Cache-Control header letting browsers keep them for ten years without revalidating. In DEBUG
+# the plain names are used, so development doesn't need collectstatic.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'static', 'media')
 
 # Stripe API keys for payment processing.
 STRIPE_PUBLISHABLE_KEY = 'pk_test_51OJeLnIQcgxBnKzp3IfQaCLKbXQ2VGjbx6Q3CvGEWtX1Ch7SOQX4nf4zOoozRf9lgUKjDH7XTzQR6QbNhlIPvT3a003m8JajEM'
 STRIPE_SECRET_KEY = 'sk_test_51OJeLnIQcgxBnKzpHd5Ae8Q8eYT4TS3yElOxstRDXrOENkR12bfMuFvLP0SFP2qeOD2rjOq0zHbBlZszhTwcHHLt00I7YxHaND'
+# Base URL of the Stripe API; point it at a local stand-in (manage.py fake_stripe) to work offline.
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+# When True, checkout records a pending order and the payment worker (manage.py process_payments)
+# performs the Stripe calls, so web workers aren't held up by Stripe round-trips.
+STORE_ASYNC_CHECKOUT = os.environ.get('STORE_ASYNC_CHECKOUT', '') == '1'
+
+# Request instrumentation (store.instrumentation): the fraction of the requests profiled,
+# from 0 (off) to 1 (every request), and how many executions of the same query shape in a
+# request are reported as a likely N+1 query pattern. Off unless enabled in the environment:
+# e.g. STORE_INSTRUMENTATION_SAMPLE_RATE=1 to profile every request while developing, or
+# 0.01 to sample 1% of the production traffic.
+STORE_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('STORE_INSTRUMENTATION_SAMPLE_RATE', '0'))
+STORE_INSTRUMENTATION_DUPLICATE_THRESHOLD = 3
 
 # Crispy forms configuration.
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 # Automatically configure Django settings for deployment on Heroku.
-django_on_heroku.settings(locals())
+# Static files are configured above, so its own WhiteNoise set-up is turned off.
+django_on_heroku.settings(locals(), staticfiles=False)
+
+# Request profiles logged by store.instrumentation, one JSON line per sampled request.
+LOGGING['loggers']['store.instrumentation'] = {'handlers': ['console'], 'level': 'INFO', 'propagate': False}
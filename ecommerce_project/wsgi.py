@@ -5,3 +5,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_project.settings')
 
 application = get_wsgi_application()
+
+# Purge abandoned carts and expired sessions periodically, when STORE_PURGE_INTERVAL is set.
+from store.housekeeping import start_scheduler  # noqa: E402
+
+start_scheduler()
@@ -0,0 +1,11 @@
+# Gunicorn configuration, picked up automatically from the working directory.
+
+
+def post_worker_init(worker):
+    # Warm the in-process category menu and search suggestion index as soon as a worker has
+    # loaded the application, so freshly booted workers don't all query the database on
+    # their first requests.
+    from store.menu import warm_menu
+    from store.suggest import warm_index
+    warm_menu()
+    warm_index()
@@ -1,5 +1,133 @@
-from django.contrib import admin
+import datetime
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Max, Min, Q, QuerySet
+from django.db.models.functions import Greatest, Round
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .cache import MENU_TAG, PRODUCTS_TAG, SUGGESTIONS_TAG, bump_tags
+from .catalog_feed import batches
 from .models import Category, Product, Order, Review
+from .order_export import FORMATS, export_rows, order_lines, render_rows
+from .search import index_products, rebuild_index
+
+
+def estimated_count(model, using):
+    """
+    Estimate the number of rows of a model's table without counting them.
+
+    PostgreSQL keeps an estimate in its statistics (refreshed by VACUUM and ANALYZE); on
+    SQLite, the largest rowid is read from the end of the table's b-tree, which overcounts
+    by the number of rows deleted.
+
+    Returns:
+    int or None: The estimate, or None when the database has none.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute('SELECT MAX(rowid) FROM %s' % table)
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed.
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for changelists of large tables: an unfiltered list is counted from the
+    database's estimate rather than with COUNT(*), which reads the whole table.
+
+    Filtered lists, and tables estimated below STORE_ADMIN_EXACT_COUNT_LIMIT rows, are
+    counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.STORE_ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # Changelist options for tables with millions of rows.
+    paginator = EstimatedCountPaginator
+    # Don't run a second COUNT(*) of the whole table to show next to the filtered count.
+    show_full_result_count = False
+
+
+class DateHierarchyQuerySet(QuerySet):
+    """
+    QuerySet for changelists with a date_hierarchy on a large table.
+
+    The drill-down links list the years, months or days that have rows. Django finds them
+    with a SELECT DISTINCT of every row's date truncated to the period, reading the whole
+    table; here each period between the first and last dates is probed with an EXISTS
+    query on an index of the date instead: a few dozen index lookups at most.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, is_dst=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        tz = tzinfo or timezone.get_current_timezone()
+        first, last = timezone.localtime(bounds['first'], tz), timezone.localtime(bounds['last'], tz)
+
+        periods = []
+        start = datetime.datetime(first.year, first.month if kind != 'year' else 1, first.day if kind == 'day' else 1)
+        while start <= last.replace(tzinfo=None):
+            if kind == 'year':
+                end = start.replace(year=start.year + 1)
+            elif kind == 'month':
+                end = (start + datetime.timedelta(days=32)).replace(day=1)
+            else:
+                end = start + datetime.timedelta(days=1)
+            period = {field_name + '__gte': timezone.make_aware(start, tz),
+                      field_name + '__lt': timezone.make_aware(end, tz)}
+            if self.filter(**period).exists():
+                periods.append(timezone.make_aware(start, tz))
+            start = end
+        return periods[::-1] if order == 'DESC' else periods
+
+
+class CatalogActionForm(helpers.ActionForm):
+    # The amount the adjust actions apply, entered next to the action menu.
+    amount = forms.DecimalField(required=False, help_text='Units of stock, or percent of the price.')
+
+
+class OrderExportForm(forms.Form):
+    # Which orders the export includes; all of them when left blank.
+    start = forms.DateField(required=False, label='From', help_text='YYYY-MM-DD')
+    end = forms.DateField(required=False, label='To (inclusive)', help_text='YYYY-MM-DD')
+    country = forms.CharField(required=False, label='Shipping country')
+    status = forms.ChoiceField(required=False, choices=[('', 'Any')] + Order.STATUS_CHOICES)
+    format = forms.ChoiceField(choices=[(format, format.upper()) for format in FORMATS])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['start'] > cleaned_data['end']:
+            raise forms.ValidationError('The first day is after the last one.')
+        return cleaned_data
+
 
 # CategoryAdmin class extends admin.ModelAdmin.
 # This class customizes how the Category model is displayed in the Django admin.
@@ -12,21 +140,148 @@ class CategoryAdmin(admin.ModelAdmin):
 # This tells Django: "Use the CategoryAdmin class to represent the Category model in the admin interface."
 admin.site.register(Category, CategoryAdmin)
 
-# ProductAdmin class extends admin.ModelAdmin.
+# ProductAdmin class extends LargeTableAdmin.
 # This class customizes the display of the Product model in the Django admin.
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     # Fields to display in the list view of the admin interface.
-    list_display = ['name', 'price', 'stock', 'available', 'created', 'updated']
+    list_display = ['name', 'category', 'price', 'stock', 'available', 'created', 'updated']
     # Includes essential product details like name, price, stock, and timestamps.
+    # The category of every product on the page is joined into the list query.
+    list_select_related = ['category']
+    list_filter = ['available', 'category']
+    # Searched by get_search_results() below, on indexed columns only.
+    search_fields = ['name']
+    search_help_text = 'Beginning of the product name (case-sensitive), exact slug or ID.'
+    action_form = CatalogActionForm
+    actions = ['make_available', 'make_unavailable', 'adjust_stock', 'adjust_price']
+
+    def get_search_results(self, request, queryset, search_term):
+        # A name prefix as a range of the unique name index, rather than a LIKE '%term%' that
+        # reads every row; or an exact slug or ID.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        match = Q(name__gte=term, name__lt=term + '\U0010ffff') | Q(slug=term)
+        if term.isdigit():
+            match |= Q(pk=int(term))
+        return queryset.filter(match), False
+
+    def bulk_update(self, request, queryset, **values):
+        # Apply the change to every selected product in one UPDATE statement. update() sends no
+        # signals, so purge the cached pages (all of them render the menu) once afterwards.
+        count = queryset.update(updated=timezone.now(), **values)
+        bump_tags(MENU_TAG, PRODUCTS_TAG)
+        return count
+
+    def action_amount(self, request):
+        # The amount entered in the action form, or None (with an error shown) if missing.
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if form.is_valid() and form.cleaned_data['amount'] is not None:
+            return form.cleaned_data['amount']
+        self.message_user(request, 'Enter the amount to apply next to the action.', messages.ERROR)
+        return None
+
+    def set_availability(self, request, queryset, available):
+        # The IDs of the products ticked on the page, read before the update changes which
+        # products the queryset (and its filters) matches; None when all were selected.
+        product_ids = None
+        if request.POST.get('select_across') != '1':
+            product_ids = list(queryset.values_list('pk', flat=True))
+        count = self.bulk_update(request, queryset, available=available)
+        # Only available products are suggested in the search box.
+        bump_tags(SUGGESTIONS_TAG)
+        # Only available products are in the search index.
+        if product_ids is None:
+            rebuild_index()
+        else:
+            for batch in batches(product_ids, 500):
+                index_products(batch)
+        self.message_user(request, '%d products made %s.' % (count, 'available' if available else 'unavailable'))
+
+    @admin.action(description='Make selected products available')
+    def make_available(self, request, queryset):
+        self.set_availability(request, queryset, True)
+
+    @admin.action(description='Make selected products unavailable')
+    def make_unavailable(self, request, queryset):
+        self.set_availability(request, queryset, False)
+
+    @admin.action(description='Adjust stock of selected products by the amount')
+    def adjust_stock(self, request, queryset):
+        amount = self.action_amount(request)
+        if amount is not None:
+            # Stock never goes below zero.
+            count = self.bulk_update(request, queryset, stock=Greatest(F('stock') + int(amount), 0))
+            self.message_user(request, 'Stock of %d products adjusted by %d.' % (count, int(amount)))
+
+    @admin.action(description='Adjust price of selected products by the amount, in percent')
+    def adjust_price(self, request, queryset):
+        amount = self.action_amount(request)
+        if amount is None:
+            return
+        if amount <= -100:
+            self.message_user(request, 'A price can be reduced by less than 100%.', messages.ERROR)
+            return
+        count = self.bulk_update(request, queryset, price=Round(F('price') * (100 + amount) / 100, 2))
+        self.message_user(request, 'Price of %d products adjusted by %s%%.' % (count, amount))
 
 # Registers the Product model with the ProductAdmin class to the admin site.
 admin.site.register(Product, ProductAdmin)
 
 # OrderAdmin class for customizing the Order model's display in the admin.
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     # Fields to display in the list view of the admin interface for orders.
-    list_display = ['id', 'billingName', 'emailAddress', 'created']
-    # Shows the order ID, billing name, email address, and creation date.
+    list_display = ['id', 'billingName', 'emailAddress', 'status', 'total', 'created']
+    # Shows the order ID, billing name, email address, payment state, total and creation date.
+    list_filter = ['status']
+    date_hierarchy = 'created'
+    # Searched by get_search_results() below, on indexed columns only.
+    search_fields = ['emailAddress']
+    search_help_text = 'Exact email address or order ID.'
+    # Adds a link to the export page (export_view() below) above the list.
+    change_list_template = 'admin/store/order/change_list.html'
+
+    def get_urls(self):
+        export = path('export/', self.admin_site.admin_view(self.export_view), name='store_order_export')
+        return [export] + super().get_urls()
+
+    def export_view(self, request):
+        """
+        Export the order lines of a date range as CSV or JSONL, streamed as they are read.
+
+        The export is sent with a StreamingHttpResponse, so neither the rows nor the file are
+        ever held in memory, however many orders it covers; see store.order_export.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        form = OrderExportForm(request.GET or None)
+        if form.is_bound and form.is_valid():
+            data = form.cleaned_data
+            lines = order_lines(data['start'], data['end'], data['country'].strip(), data['status'])
+            response = StreamingHttpResponse(
+                render_rows(data['format'], export_rows(lines)),
+                content_type='text/csv' if data['format'] == 'csv' else 'application/jsonl')
+            response['Content-Disposition'] = 'attachment; filename="orders-%s.%s"' % (
+                timezone.localdate().isoformat(), data['format'])
+            return response
+        context = dict(self.admin_site.each_context(request), title='Export orders', form=form,
+                       opts=self.model._meta)
+        return TemplateResponse(request, 'admin/store/order/export.html', context)
+
+    def get_queryset(self, request):
+        # Drill down the date hierarchy with index lookups (see DateHierarchyQuerySet).
+        queryset = super().get_queryset(request)
+        return DateHierarchyQuerySet(queryset.model, query=queryset.query, using=queryset.db)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        match = Q(emailAddress=term)
+        if term.isdigit():
+            match |= Q(pk=int(term))
+        return queryset.filter(match), False
 
 # Registers the Order model with the OrderAdmin class to the admin site.
 admin.site.register(Order, OrderAdmin)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class StoreConfig(AppConfig):
     name = 'store'
+
+    def ready(self):
+        # Connect the signal handlers that keep the store's caches in sync with the catalog,
+        # and register the store's system checks.
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,209 @@
+from functools import wraps
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from .replicas import reading_from_replica
+
+# Tag shared by every page that renders the category menu in the navbar.
+MENU_TAG = 'menu'
+# Tag shared by every listing that shows products from all categories.
+PRODUCTS_TAG = 'products'
+# Tag shared by every product page, which shows the product's precomputed recommendations.
+RECOMMENDATIONS_TAG = 'recommendations'
+# Tag of the type-ahead index of product names (store.suggest): only changes to the names,
+# URLs or availability of products bump it, not every product change.
+SUGGESTIONS_TAG = 'suggestions'
+
+# Prefixes for the keys stored in Django's cache framework.
+TAG_KEY_PREFIX = 'store:tag:'
+PAGE_KEY_PREFIX = 'store:page:'
+
+# The version stamp this process last gave each tag, so readers that only look at the
+# shared stamps now and then (see store.menu) notice this process' own changes at once.
+_local_versions = {}
+
+
+def category_tag(category_id):
+    # Tag for pages that depend on a single category (and the products in it).
+    return 'category:%s' % category_id
+
+
+def product_tag(product_id):
+    # Tag for pages that depend on a single product.
+    return 'product:%s' % product_id
+
+
+def tag_versions(tags):
+    """
+    Return the current version stamp of each tag.
+
+    Args:
+    tags (iterable): Tag names, e.g. 'menu' or 'product:3'.
+
+    Returns:
+    dict: Mapping of tag name to version stamp.
+    """
+    keys = {TAG_KEY_PREFIX + tag: tag for tag in tags}
+    versions = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+
+    # Tags that have never been bumped (or were evicted) get a fresh, time based stamp,
+    # so an entry recorded against an evicted tag can never be mistaken for a current one.
+    missing = {key: time.time_ns() for key, tag in keys.items() if tag not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update({keys[key]: value for key, value in missing.items()})
+    return versions
+
+
+def bump_tags(*tags):
+    """
+    Invalidate everything cached against the given tags by moving their version stamps on.
+
+    The new stamp is the time of the change, so readers can tell how recent a change is
+    (see recently_changed()); it always moves forward, even within the clock's resolution.
+    """
+    keys = [TAG_KEY_PREFIX + tag for tag in tags]
+    current = cache.get_many(keys)
+    now = time.time_ns()
+    versions = {key: max(now, current.get(key, 0) + 1) for key in keys}
+    cache.set_many(versions, timeout=None)
+    _local_versions.update({tag: versions[TAG_KEY_PREFIX + tag] for tag in tags})
+
+
+def bumped_locally(tag):
+    # The version stamp this process last gave the tag, or None if it never bumped it.
+    return _local_versions.get(tag)
+
+
+def recently_changed(versions):
+    """
+    Whether any of the tags changed within STORE_REPLICA_LAG_SECONDS, i.e. recently enough
+    for a replica not to have the change yet.
+
+    Args:
+    versions (dict): Mapping of tag name to version stamp, as returned by tag_versions().
+    """
+    horizon = time.time_ns() - settings.STORE_REPLICA_LAG_SECONDS * 10 ** 9
+    return any(version > horizon for version in versions.values())
+
+
+def tag_page(request, *tags):
+    """
+    Record the tags the page being rendered depends on.
+
+    The tag versions are captured right away, before the view runs its queries, so a
+    change that lands while the page is rendering invalidates the entry immediately.
+    """
+    if hasattr(request, '_page_cache_tags'):
+        request._page_cache_tags.update(tag_versions(tags))
+
+
+def conditional_page(request, *validators):
+    """
+    Answer a conditional GET of a catalog page before the page is built.
+
+    The page's ETag is derived from cheap validators of its content, given by the view
+    (e.g. the latest 'updated' time of the products listed), from the version of the
+    menu tag, which every catalog page renders, and from the release: a deploy changes
+    the templates and the hashed names of the static files the page links to. It is
+    remembered on the request and sent with the page by cache_catalog_page.
+
+    Args:
+    request (HttpRequest): The request for the page.
+    *validators: Values that change whenever the page's content changes, including who is viewing it.
+
+    Returns:
+    HttpResponse or None: A 304 Not Modified response if the client's copy is current, otherwise None.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    release = (settings.STORE_RELEASE, getattr(staticfiles_storage, 'manifest_hash', ''))
+    digest = hashlib.md5(repr((validators, tag_versions([MENU_TAG])[MENU_TAG], release)).encode('utf-8')).hexdigest()
+    # A weak validator: the pages are equivalent, though not byte for byte (e.g. CSRF tokens).
+    request._page_etag = 'W/"%s"' % digest
+    return get_conditional_response(request, etag=request._page_etag)
+
+
+def _add_etag(request, response):
+    # Send the ETag computed by conditional_page() with a complete page.
+    etag = getattr(request, '_page_etag', None)
+    if etag and response.status_code == 200 and not response.has_header('ETag'):
+        response['ETag'] = etag
+    return response
+
+
+def _is_cacheable(request):
+    # Only anonymous GET/HEAD requests without a session or a cart cookie are served from the
+    # page cache: such visitors have no cart and no personalised navbar, so they all see the
+    # same HTML. Checking the cookies rather than request.user avoids loading the session.
+    return (
+        settings.STORE_PAGE_CACHE_ENABLED
+        and request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and settings.STORE_CART_COOKIE_NAME not in request.COOKIES
+    )
+
+
+def _page_key(request):
+    # Pages are keyed by path and page number (or keyset cursor); other query parameters
+    # don't change the output.
+    raw = '%s?page=%s&after=%s&before=%s' % (
+        request.path, request.GET.get('page', ''), request.GET.get('after', ''), request.GET.get('before', ''))
+    return PAGE_KEY_PREFIX + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def cache_catalog_page(view):
+    """
+    Decorator caching the full rendered page of a catalog view for anonymous visitors.
+
+    The view calls tag_page() with the tags its output depends on. A cached page is only
+    served while every one of those tags still has the version it was stored with, so the
+    signal handlers in store.signals can purge exactly the affected pages with bump_tags().
+    Cached pages keep the ETag they were sent with, so conditional requests for them are
+    answered with a 304 straight from the cache as well.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _is_cacheable(request):
+            return _add_etag(request, view(request, *args, **kwargs))
+
+        key = _page_key(request)
+        entry = cache.get(key)
+        if entry is not None and tag_versions(entry['tags']) == entry['tags']:
+            # Cache hit: every tag is still current, so the stored HTML (and its ETag) is up to date.
+            response = None
+            etag = entry.get('etag')
+            if etag:
+                response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(entry['content'], content_type=entry['content_type'])
+                if etag:
+                    response['ETag'] = etag
+            response['X-Page-Cache'] = 'hit'
+            return response
+
+        request._page_cache_tags = {}
+        response = _add_etag(request, view(request, *args, **kwargs))
+
+        # Only store complete 200 responses that set no cookies, from views that declared their tags.
+        # A page read from a replica just after one of its tags changed may predate the change
+        # (the replica lags): it is served, but rebuilt by the following requests until it can't.
+        if response.status_code == 200 and not response.streaming and not response.cookies \
+                and request._page_cache_tags \
+                and not (reading_from_replica() and recently_changed(request._page_cache_tags)):
+            cache.set(key, {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': response.get('ETag'),
+                'tags': request._page_cache_tags,
+            }, settings.STORE_PAGE_CACHE_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    return wrapper
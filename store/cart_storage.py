@@ -0,0 +1,412 @@
+from abc import ABC, abstractmethod
+from decimal import Decimal
+import re
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from .models import Cart, CartItem, CartSummary, Product
+
+# Session keys holding the visitor's cart ID and the number of items in that cart.
+CART_ID_SESSION_KEY = 'cart_id'
+CART_COUNT_SESSION_KEY = 'cart_item_count'
+
+
+class DatabaseCartStorage:
+    """
+    Cart kept in the Cart and CartItem tables, under an ID remembered in the session.
+
+    Used for signed-in customers and for carts that were moved to the database at checkout,
+    and for every visitor when STORE_CART_STORAGE is 'database'.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        _register(request, self)
+
+    def cart_id(self, create=True):
+        # Attempt to retrieve the cart ID remembered in the current session.
+        cart = self.request.session.get(CART_ID_SESSION_KEY)
+        if cart:
+            return cart
+
+        # Carts created before the ID was remembered in the session are keyed by the session key.
+        cart = self.request.session.session_key
+
+        # Read-only callers pass create=False, so visitors who never touched the cart
+        # (including crawlers) never get a session row created for them.
+        if not create:
+            return cart
+
+        # Check if the cart variable is empty, indicating that there is no session key.
+        if not cart:
+            # Since there is no session key, create a new session.
+            # This will generate a new session key.
+            self.request.session.create()
+            cart = self.request.session.session_key
+            # A brand new session has an empty cart.
+            self.request.session[CART_COUNT_SESSION_KEY] = 0
+        else:
+            # Take the item count of an existing cart before the caller modifies it.
+            self.count()
+
+        # Remember the cart ID in the session, so the cart survives the session key
+        # being rotated when the visitor signs in.
+        self.request.session[CART_ID_SESSION_KEY] = cart
+
+        # Return the cart ID, which is either retrieved or newly created.
+        return cart
+
+    def count(self):
+        # Sessions that don't carry the item count yet (created before it was tracked) get it
+        # computed once from the database; afterwards it is maintained by the cart views.
+        session = self.request.session
+        if CART_COUNT_SESSION_KEY not in session and session.session_key:
+            count = CartItem.objects.filter(cart__cart_id=self.cart_id(create=False), active=True) \
+                .aggregate(count=Sum('quantity'))['count'] or 0
+            session[CART_COUNT_SESSION_KEY] = count
+
+        # Without a session this doesn't touch the database and creates nothing.
+        return session.get(CART_COUNT_SESSION_KEY, 0)
+
+    def set_count(self, count):
+        # Only writes to the session when the count differs.
+        if self.count() != count:
+            self.request.session[CART_COUNT_SESSION_KEY] = count
+
+    def _adjust_count(self, delta):
+        # Keep the item count shown in the navbar in step with the cart, without rescanning it.
+        if delta:
+            self.request.session[CART_COUNT_SESSION_KEY] = max(self.count() + delta, 0)
+
+    def db_cart(self, create=False):
+        # The visitor's Cart row, or None if they have none (and 'create' is false).
+        if create:
+            return Cart.objects.get_or_create(cart_id=self.cart_id())[0]
+        cart_id = self.cart_id(create=False)
+        return Cart.objects.filter(cart_id=cart_id).first() if cart_id else None
+
+    def _touch(self, **lookup):
+        # Record activity on the cart, so it isn't purged as abandoned (see store.housekeeping).
+        Cart.objects.filter(**lookup).update(updated=timezone.now())
+
+    def add(self, product):
+        cart = self.db_cart(create=True)
+        self._touch(pk=cart.pk)
+
+        try:
+            # Attempt to retrieve the cart item for the current product and cart.
+            cart_item = CartItem.objects.get(product=product, cart=cart)
+
+            # Check if adding another product does not exceed the stock.
+            if cart_item.quantity < product.stock:
+                # Increment the quantity of the product in the cart.
+                cart_item.quantity += 1
+                self._adjust_count(1)
+            cart_item.save()
+        except CartItem.DoesNotExist:
+            # If the cart item does not exist, create a new cart item with a quantity of 1.
+            CartItem.objects.create(product=product, quantity=1, cart=cart)
+            self._adjust_count(1)
+
+    def remove(self, product):
+        cart_item = CartItem.objects.get(product=product, cart__cart_id=self.cart_id())
+
+        # Decrease the quantity by one, or remove the cart item entirely at one.
+        if cart_item.quantity > 1:
+            cart_item.quantity -= 1
+            cart_item.save()
+        else:
+            cart_item.delete()
+        self._touch(pk=cart_item.cart_id)
+        self._adjust_count(-1)
+
+    def remove_product(self, product):
+        cart_item = CartItem.objects.get(product=product, cart__cart_id=self.cart_id())
+        cart_item.delete()
+        self._touch(pk=cart_item.cart_id)
+        self._adjust_count(-cart_item.quantity)
+
+    def merge(self, quantities):
+        """
+        Add the products of a cart kept elsewhere (cookie or cache) to this cart.
+
+        Args:
+        quantities (dict): Mapping of product ID to quantity.
+        """
+        if not quantities:
+            return
+        cart = self.db_cart(create=True)
+        self._touch(pk=cart.pk)
+        existing = {item.product_id: item for item in CartItem.objects.filter(cart=cart, product__in=quantities)}
+        for item in existing.values():
+            item.quantity += quantities[item.product_id]
+        CartItem.objects.bulk_update(existing.values(), ['quantity'])
+        # Products deleted since they were put in the cart are left out.
+        products = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+            if product_id not in existing and product_id in products
+        ])
+        # Count the merged cart again on the next read.
+        self.request.session.pop(CART_COUNT_SESSION_KEY, None)
+
+    def summary(self):
+        cart = self.db_cart()
+        # Fetch all active items in the cart with their products, and let the database
+        # calculate the total price and item count.
+        summary = cart.summary() if cart is not None else Cart.empty_summary()
+
+        # Resynchronise the navbar item count with the cart, in case it drifted (e.g. an item
+        # was removed from the cart elsewhere).
+        self.set_count(summary.count)
+        return summary
+
+    def update(self, response):
+        # The session middleware saves the session.
+        pass
+
+
+class _GuestCartStorage(ABC):
+    """
+    Cart of an anonymous shopper kept outside the database, as a mapping of product ID to
+    quantity, until checkout or sign-in move it there (see persist_cart()).
+
+    Subclasses load and save the mapping, and send their cookie in update(), which
+    CartStorageMiddleware calls.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.modified = False
+        self._quantities = None
+        _register(request, self)
+
+    @abstractmethod
+    def load(self):
+        # The mapping of product ID to quantity the shopper's cart holds ({} if none).
+        pass
+
+    @abstractmethod
+    def update(self, response):
+        # Send the cookie of a cart changed by the request.
+        pass
+
+    def save(self, quantities):
+        self._quantities = quantities
+        self.modified = True
+
+    def quantities(self):
+        if self._quantities is None:
+            self._quantities = self.load()
+        return self._quantities
+
+    def count(self):
+        return sum(self.quantities().values())
+
+    def add(self, product):
+        quantities = dict(self.quantities())
+        quantity = quantities.get(product.pk, 0)
+        # As with database carts, a new line starts at 1 and later units stop at the stock.
+        if not quantity or quantity < product.stock:
+            quantities[product.pk] = quantity + 1
+            self.save(quantities)
+
+    def remove(self, product):
+        quantities = dict(self.quantities())
+        if product.pk in quantities:
+            quantities[product.pk] -= 1
+            if not quantities[product.pk]:
+                del quantities[product.pk]
+            self.save(quantities)
+
+    def remove_product(self, product):
+        quantities = dict(self.quantities())
+        if quantities.pop(product.pk, None) is not None:
+            self.save(quantities)
+
+    def clear(self):
+        if self.quantities():
+            self.save({})
+
+    def summary(self):
+        # The same summary as Cart.summary(), from unsaved cart items: one query loads the products.
+        quantities = self.quantities()
+        products = Product.objects.select_related('category').in_bulk(list(quantities))
+        items = []
+        for product_id, quantity in quantities.items():
+            if product_id in products:
+                item = CartItem(product=products[product_id], quantity=quantity)
+                item.line_total = products[product_id].price * quantity
+                items.append(item)
+        if len(items) != len(quantities):
+            # Forget the products deleted since they were added.
+            self.save({item.product_id: item.quantity for item in items})
+
+        subtotal = sum((item.line_total for item in items), Decimal('0')).quantize(Decimal('0.01'))
+        return CartSummary(items, subtotal, subtotal, sum(item.quantity for item in items))
+
+    def _set_cookie(self, response, value):
+        response.set_cookie(
+            settings.STORE_CART_COOKIE_NAME, value, max_age=settings.STORE_ABANDONED_CART_DAYS * 24 * 60 * 60,
+            secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+        )
+
+
+class CookieCartStorage(_GuestCartStorage):
+    """
+    Cart kept in a signed cookie listing its products and quantities, e.g. '12:1,40:2'.
+
+    Signing stops shoppers from editing the cookie; prices and stock always come from the
+    database. A cart growing past STORE_CART_COOKIE_MAX_LINES products (staying well within
+    the 4 KB cookies are limited to) is moved to the database instead.
+    """
+
+    salt = 'store.cart'
+
+    def load(self):
+        try:
+            value = signing.get_cookie_signer(salt=self.salt).unsign(
+                self.request.COOKIES[settings.STORE_CART_COOKIE_NAME])
+            return {int(product_id): int(quantity)
+                    for product_id, quantity in (line.split(':') for line in value.split(',') if line)}
+        except (KeyError, ValueError, signing.BadSignature):
+            return {}
+
+    def add(self, product):
+        if product.pk not in self.quantities() and len(self.quantities()) >= settings.STORE_CART_COOKIE_MAX_LINES:
+            persist_cart(self.request).add(product)
+        else:
+            super().add(product)
+
+    def update(self, response):
+        if not self.modified:
+            return
+        if self._quantities:
+            value = ','.join('%d:%d' % line for line in self._quantities.items())
+            self._set_cookie(response, signing.get_cookie_signer(salt=self.salt).sign(value))
+        else:
+            response.delete_cookie(settings.STORE_CART_COOKIE_NAME, samesite='Lax')
+
+
+class CacheCartStorage(_GuestCartStorage):
+    """
+    Cart kept in the default cache, under a random ID sent to the shopper in a cookie.
+
+    The cache must be shared by every worker (e.g. memcached or Redis, see CACHES) and
+    should not evict entries early, or carts are lost.
+    """
+
+    CART_ID_PATTERN = re.compile(r'^[\w-]{20,40}$')
+
+    def __init__(self, request):
+        super().__init__(request)
+        cart_id = request.COOKIES.get(settings.STORE_CART_COOKIE_NAME, '')
+        self.cart_id = cart_id if self.CART_ID_PATTERN.match(cart_id) else None
+
+    def key(self):
+        return 'store:cart:%s' % self.cart_id
+
+    def load(self):
+        return cache.get(self.key(), {}) if self.cart_id else {}
+
+    def save(self, quantities):
+        super().save(quantities)
+        if quantities:
+            if self.cart_id is None:
+                self.cart_id = secrets.token_urlsafe(24)
+            cache.set(self.key(), quantities, settings.STORE_ABANDONED_CART_DAYS * 24 * 60 * 60)
+        elif self.cart_id:
+            cache.delete(self.key())
+
+    def update(self, response):
+        if not self.modified:
+            return
+        if self._quantities:
+            # Sent again on every change, so the cookie lives as long as the cache entry.
+            self._set_cookie(response, self.cart_id)
+        else:
+            response.delete_cookie(settings.STORE_CART_COOKIE_NAME, samesite='Lax')
+
+
+# Values of STORE_CART_STORAGE.
+CART_STORAGES = {
+    'database': DatabaseCartStorage,
+    'cookie': CookieCartStorage,
+    'cache': CacheCartStorage,
+}
+
+
+def _register(request, storage):
+    # Every storage used by the request gets to update the response (see CartStorageMiddleware).
+    request.__dict__.setdefault('_cart_storages', []).append(storage)
+
+
+def get_cart(request):
+    """
+    Return the storage holding the visitor's cart.
+
+    Anonymous shoppers without a session get the storage chosen by STORE_CART_STORAGE, so
+    browsing and filling a cart writes nothing to the database. Signed-in customers, and
+    visitors with a session (whose cart may already be in the database), use the database.
+
+    Args:
+    request (HttpRequest): The HttpRequest object.
+
+    Returns:
+    DatabaseCartStorage, CookieCartStorage or CacheCartStorage: The cart.
+    """
+    if not hasattr(request, '_cart'):
+        storage = CART_STORAGES[settings.STORE_CART_STORAGE]
+        # Checking the cookie rather than request.user avoids loading the session.
+        if settings.SESSION_COOKIE_NAME in request.COOKIES or request.user.is_authenticated:
+            storage = DatabaseCartStorage
+        request._cart = storage(request)
+    return request._cart
+
+
+def persist_cart(request):
+    """
+    Move the cart of an anonymous shopper from the cookie or the cache to the database,
+    at checkout or when they sign in, and make it the request's cart.
+
+    Returns:
+    DatabaseCartStorage: The visitor's database cart.
+    """
+    database = getattr(request, '_cart', None)
+    if not isinstance(database, DatabaseCartStorage):
+        database = DatabaseCartStorage(request)
+    storage = CART_STORAGES[settings.STORE_CART_STORAGE]
+    if storage is not DatabaseCartStorage:
+        guest = getattr(request, '_cart', None)
+        if not isinstance(guest, storage):
+            guest = storage(request)
+        database.merge(guest.quantities())
+        guest.clear()
+    request._cart = database
+    return database
+
+
+class CartStorageMiddleware:
+    """
+    Send the cookies of the cart storages used by the view (and the templates it rendered).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        storages = getattr(request, '_cart_storages', [])
+        for storage in storages:
+            storage.update(response)
+        if storages:
+            # The page shows the cart, which depends on the visitor's cookies.
+            patch_vary_headers(response, ('Cookie',))
+        return response
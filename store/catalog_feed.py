@@ -0,0 +1,235 @@
+import csv
+import itertools
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Category, Product
+
+# Columns of the feeds, in the order they are exported. Rows are matched on 'slug'; a
+# product's 'category' is the slug of its category.
+FIELDS = {
+    'categories': ['slug', 'name', 'description', 'image'],
+    'products': ['slug', 'name', 'category', 'description', 'price', 'stock', 'available', 'image'],
+}
+
+# Columns a new row must have; the others default as in the admin.
+REQUIRED = {
+    'categories': ['slug', 'name'],
+    'products': ['slug', 'name', 'category', 'price', 'stock'],
+}
+
+FORMATS = ('csv', 'jsonl')
+
+
+class FeedError(Exception):
+    """
+    Raised for a row of a feed that can't be imported; the row is skipped.
+    """
+
+
+def feed_format(path, format=None):
+    # The format given, or the one named by the file extension.
+    format = format or path.rsplit('.', 1)[-1].lower()
+    if format not in FORMATS:
+        raise ValueError('Unknown feed format %r; use one of %s.' % (format, ', '.join(FORMATS)))
+    return format
+
+
+def read_rows(stream, format):
+    """
+    Yield the rows of a feed one at a time, as dicts of column name to value.
+
+    CSV values are strings; JSONL values keep their JSON type. Blank lines are skipped.
+    """
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def batches(rows, size):
+    # Group an iterable into lists of 'size' items, without reading ahead any further.
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in ('1', 'true', 'yes', 't', 'y'):
+        return True
+    if normalized in ('0', 'false', 'no', 'f', 'n', ''):
+        return False
+    raise FeedError('not a boolean: %r' % value)
+
+
+class CatalogImporter:
+    """
+    Upsert categories or products from the rows of a feed, matching them by slug.
+
+    Rows are written in batches: one query loads the existing rows of a batch, then
+    bulk_update() writes those that changed and bulk_create() inserts the new ones, in
+    one transaction per batch. Only one batch is held in memory at a time (plus the map of
+    category slugs, for products). Rows that didn't change keep their 'updated' time, so
+    the conditional GETs of their pages keep answering 304.
+
+    Like bulk_create() and bulk_update(), the importer sends no model signals: the caller
+    refreshes the page caches and the search index once the whole feed is in.
+    """
+
+    def __init__(self, kind, batch_size=1000):
+        self.kind = kind
+        self.model = Category if kind == 'categories' else Product
+        self.batch_size = batch_size
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        self.errors = []
+        self.category_ids = None
+        if kind == 'products':
+            self.category_ids = dict(Category.objects.values_list('slug', 'pk'))
+
+    def clean(self, row):
+        """
+        Convert a feed row into model field values (by attribute name), checking them.
+
+        Raises:
+        FeedError: If the row is missing a column or has an invalid value.
+        """
+        values = {}
+        for name in FIELDS[self.kind]:
+            value = row.get(name)
+            if value is None:
+                continue
+            if name == 'category':
+                if value not in self.category_ids:
+                    raise FeedError('unknown category %r' % value)
+                values['category_id'] = self.category_ids[value]
+            elif name == 'available':
+                values['available'] = _parse_bool(value)
+            else:
+                field = self.model._meta.get_field(name)
+                if isinstance(value, str) and name in ('price', 'stock'):
+                    value = value.strip()
+                try:
+                    value = field.to_python(value)
+                    if name != 'image':
+                        field.run_validators(value)
+                except ValidationError as e:
+                    raise FeedError('%s: %s' % (name, '; '.join(e.messages)))
+                values[name] = str(value) if name == 'image' else value
+        if not values.get('slug'):
+            raise FeedError('no slug')
+        return values
+
+    def import_batch(self, rows, first_line=1):
+        # Clean the rows; a slug repeated within the batch keeps its last row.
+        cleaned = {}
+        for line, row in enumerate(rows, first_line):
+            try:
+                values = self.clean(row)
+            except FeedError as e:
+                self.skip(line, str(e))
+                continue
+            cleaned[values['slug']] = (line, values)
+
+        try:
+            with transaction.atomic():
+                results = self.write(cleaned)
+        except IntegrityError:
+            # A row clashes with another (e.g. a name already taken): write the rows one by one
+            # to find it, keeping the others.
+            results = []
+            for slug, (line, values) in cleaned.items():
+                try:
+                    with transaction.atomic():
+                        results.extend(self.write({slug: (line, values)}))
+                except IntegrityError as e:
+                    results.append((line, 'skipped', str(e)))
+
+        for line, outcome, reason in results:
+            if outcome == 'skipped':
+                self.skip(line, reason)
+            else:
+                self.counts[outcome] += 1
+
+    def write(self, cleaned):
+        # Write the cleaned rows of a batch; returns (line, outcome, reason) for each row.
+        # Only the feed's columns are loaded and compared.
+        columns = [name + '_id' if name == 'category' else name for name in FIELDS[self.kind]]
+        existing = {obj.slug: obj for obj in self.model.objects.filter(slug__in=list(cleaned)).only(*columns)}
+        results, created, changed, fields = [], [], [], set()
+        for slug, (line, values) in cleaned.items():
+            obj = existing.get(slug)
+            if obj is None:
+                missing = [name for name in REQUIRED[self.kind]
+                           if (name + '_id' if name == 'category' else name) not in values]
+                if missing:
+                    results.append((line, 'skipped', 'new %s without %s' % (self.kind[:-1], ', '.join(missing))))
+                else:
+                    created.append(self.model(**values))
+                    results.append((line, 'created', None))
+                continue
+            updates = {name: value for name, value in values.items() if getattr(obj, name) != value}
+            if updates:
+                for name, value in updates.items():
+                    setattr(obj, name, value)
+                fields.update(updates)
+                changed.append(obj)
+                results.append((line, 'updated', None))
+            else:
+                results.append((line, 'unchanged', None))
+
+        if changed and self.model is Product:
+            # bulk_update() doesn't apply auto_now; a changed product is still a product change.
+            now = timezone.now()
+            for obj in changed:
+                obj.updated = now
+            fields.add('updated')
+        if changed:
+            self.model.objects.bulk_update(changed, sorted(fields))
+        if created:
+            self.model.objects.bulk_create(created)
+        return results
+
+    def skip(self, line, reason):
+        self.counts['skipped'] += 1
+        # Keep the first errors only, so a broken feed can't exhaust memory.
+        if len(self.errors) < 100:
+            self.errors.append('row %d: %s' % (line, reason))
+
+
+def export_rows(kind, chunk_size=2000):
+    """
+    Yield every category or product as a feed row, streaming them from the database.
+
+    Returns:
+    generator: Dicts of column name to value, in the columns of FIELDS[kind], ordered by slug.
+    """
+    fields = ['category__slug' if name == 'category' else name for name in FIELDS[kind]]
+    model = Category if kind == 'categories' else Product
+    for values in model.objects.order_by('slug').values_list(*fields).iterator(chunk_size=chunk_size):
+        yield dict(zip(FIELDS[kind], values))
+
+
+def write_rows(stream, format, kind, rows):
+    # Write feed rows in the given format; returns the number of rows written.
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=FIELDS[kind])
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+    else:
+        for count, row in enumerate(rows, 1):
+            # Prices are written as strings, so they keep their exact decimal value.
+            stream.write(json.dumps(row, default=str, ensure_ascii=False) + '\n')
+    return count
@@ -0,0 +1,171 @@
+from django.core import signing
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+from .cache import bump_tags, product_tag
+from .models import CartItem, Order, OrderItem, Product
+from .sales import roll_up_after_payment
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when a product in the cart no longer has enough stock to fulfil the order.
+    """
+
+    def __init__(self, products=()):
+        # Names of the products that could not be reserved, when known.
+        self.products = list(products)
+        super().__init__('Not enough stock for: %s' % ', '.join(self.products) if self.products
+                         else 'Not enough stock')
+
+
+def reserve_stock(quantities):
+    """
+    Decrement the stock of several products in one conditional UPDATE statement.
+
+    Each product is only decremented if it still has enough stock, so concurrent buyers
+    can never drive the stock below zero. Must be called inside a transaction: if any
+    product falls short, InsufficientStock is raised and the whole checkout rolls back.
+
+    Args:
+    quantities (dict): Mapping of product ID to the quantity being bought.
+    """
+    if not quantities:
+        return
+
+    # Only rows that still have enough stock match the WHERE clause...
+    enough_stock = Q()
+    for product_id, quantity in quantities.items():
+        enough_stock |= Q(pk=product_id, stock__gte=quantity)
+
+    # ...and each of them is decremented by its own quantity.
+    updated = Product.objects.filter(enough_stock).update(
+        stock=Case(
+            *[When(pk=product_id, then=F('stock') - quantity) for product_id, quantity in quantities.items()],
+            default=F('stock'),
+        ),
+        # update() bypasses auto_now, but a stock change is a product change.
+        updated=timezone.now(),
+    )
+
+    if updated != len(quantities):
+        # The caller's transaction must roll back the rows that were decremented
+        # before the products that fell short can be told apart.
+        raise InsufficientStock()
+
+
+def short_of_stock(quantities):
+    """
+    Return the names of the products that don't have enough stock for the given quantities.
+    """
+    names = []
+    for product in Product.objects.filter(pk__in=quantities).only('name', 'stock'):
+        if product.stock < quantities[product.pk]:
+            names.append(product.name)
+    return names
+
+
+def place_order(cart, summary, **order_fields):
+    """
+    Turn the cart into an order in a single transaction.
+
+    The order and all of its items are inserted with one bulk insert, the stock of every
+    product is reserved with one conditional UPDATE and the cart is cleared with one
+    DELETE, so the cost of checking out barely grows with the size of the cart.
+
+    Args:
+    cart (Cart): The cart being checked out.
+    summary (CartSummary): The cart's items and totals, from Cart.summary().
+    **order_fields: Payment, billing and shipping fields of the Order.
+
+    Returns:
+    Order: The newly created order.
+    """
+    # Add up the quantity bought of each product.
+    quantities = {}
+    for cart_item in summary.items:
+        quantities[cart_item.product_id] = quantities.get(cart_item.product_id, 0) + cart_item.quantity
+
+    try:
+        with transaction.atomic():
+            order = _create_order(cart, summary, quantities, order_fields)
+    except InsufficientStock:
+        # Now that the partial stock updates are rolled back, name the products that fell short.
+        raise InsufficientStock(short_of_stock(quantities))
+
+    return order
+
+
+def _create_order(cart, summary, quantities, order_fields):
+    # The writes of place_order(), run inside its transaction.
+    order = Order.objects.create(total=summary.total, **order_fields)
+
+    # Creating all order items in one statement.
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            product=cart_item.product.name,
+            catalog_product_id=cart_item.product_id,
+            quantity=cart_item.quantity,
+            price=cart_item.product.price,
+            order=order,
+        )
+        for cart_item in summary.items
+    ])
+
+    # Reduce the stock of the ordered products, failing cleanly on oversell.
+    reserve_stock(quantities)
+
+    # Clear the items that were ordered from the cart.
+    CartItem.objects.filter(cart=cart, pk__in=[cart_item.pk for cart_item in summary.items]).delete()
+
+    # Stock is shown on the product pages, so purge their cached copies once committed.
+    transaction.on_commit(lambda: bump_tags(*[product_tag(product_id) for product_id in quantities]))
+
+    # An order paid at checkout goes into the sales rollups straight away.
+    if order.status == Order.PAID:
+        roll_up_after_payment(order.pk)
+
+    return order
+
+
+def release_stock(order):
+    """
+    Give back the stock reserved by an order whose payment failed, in one UPDATE statement.
+
+    The products are matched by the ID recorded on the order items, so a product renamed
+    since the order gets its units back too; lines of products deleted since are skipped.
+    """
+    quantities = {}
+    for product_id, quantity in order.orderitem_set.filter(catalog_product__isnull=False) \
+            .values_list('catalog_product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        return
+
+    Product.objects.filter(pk__in=quantities).update(
+        stock=Case(
+            *[When(pk=product_id, then=F('stock') + quantity) for product_id, quantity in quantities.items()],
+            default=F('stock'),
+        ),
+        updated=timezone.now(),
+    )
+    transaction.on_commit(lambda: bump_tags(*[product_tag(product_id) for product_id in quantities]))
+
+
+def order_token(order_id):
+    """
+    Token proving its holder placed an order, for guests who have no account to show it.
+
+    It is added to the thank you page's URL when the order is placed, and signed with
+    SECRET_KEY, so an order can't be looked at by guessing its ID.
+    """
+    return signing.Signer(salt='store.order').signature(str(order_id))
+
+
+def may_view_order(request, order):
+    # Whether the visitor placed the order: signed in as its customer, or holding its token.
+    if order.user_id is not None and order.user_id == request.user.pk:
+        return True
+    return constant_time_compare(request.GET.get('token', ''), order_token(order.pk))
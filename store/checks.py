@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Cache backends private to each process.
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Refuse a per-process cache while the page cache is on.
+
+    The version stamps that purge cached pages live in the cache: with a per-process one, the
+    changes made by other processes (another web worker, the payment worker, a management
+    command) would never reach the pages a worker has cached.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.STORE_PAGE_CACHE_ENABLED and backend in PER_PROCESS_CACHES:
+        return [Error(
+            'The catalog page cache needs a cache shared by all processes, not %s.' % backend,
+            hint='Use the database cache, memcached or Redis in CACHES, or set STORE_PAGE_CACHE_ENABLED = False.',
+            id='store.E001',
+        )]
+    return []
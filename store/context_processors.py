@@ -1,37 +1,28 @@
 # Importing necessary models and views
-from .models import Category, Cart, CartItem
-from .views import _cart_id
+from .cart_storage import get_cart
+from .menu import get_menu
 
 def counter(request):
     """
     Context processor for counting items in the cart.
 
+    The count comes from the visitor's cart storage: database carts keep it in the session,
+    updated as items are added and removed, and carts kept in a cookie carry it themselves,
+    so reading it costs no query, and visitors without a session don't get one.
+
     Args:
     request (HttpRequest): The HttpRequest object.
 
     Returns:
     dict: Dictionary containing 'item_count' which represents the number of items in the cart.
     """
-    # Initialize item_count to 0
-    item_count = 0
-
     # Check if the current request is for an admin page
     if 'admin' in request.path:
         # If it's an admin page, return an empty dictionary as admin pages don't need cart item count
         return {}
-    else:
-        try:
-            # Try to retrieve the cart using the _cart_id helper function
-            cart = Cart.objects.filter(cart_id=_cart_id(request))
-            # Get all cart items for the first cart object
-            cart_items = CartItem.objects.all().filter(cart=cart[:1])
-
-            # Iterate over each cart item and sum their quantities
-            for cart_item in cart_items:
-                item_count += cart_item.quantity
-        except Cart.DoesNotExist:
-            # If the Cart does not exist, set item_count to 0
-            item_count = 0
+
+    # Read the item count kept alongside the cart
+    item_count = get_cart(request).count()
 
     # Return a dictionary with the total item count
     return dict(item_count=item_count)
@@ -44,10 +35,12 @@ def menu_links(request):
     request (HttpRequest): The HttpRequest object.
 
     Returns:
-    dict: Dictionary containing 'links' which is a QuerySet of all Category objects.
+    dict: Dictionary containing 'links', the cached list of MenuLink entries (name, slug,
+    url and number of available products of each category).
     """
-    # Retrieve all Category objects from the database
-    links = Category.objects.all()
+    # Retrieve the category menu from the in-process cache; it is only rebuilt from the
+    # database after a Category or Product change has bumped its version stamp.
+    links = get_menu()
 
-    # Return a dictionary containing these category objects
+    # Return a dictionary containing the menu entries
     return dict(links=links)
@@ -0,0 +1,100 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import threading
+from urllib.parse import parse_qs
+
+# Card token that the stand-in declines, like Stripe's own test token of the same name.
+DECLINED_TOKEN = 'tok_chargeDeclined'
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    """
+    Answers the handful of Stripe API calls the store makes, the way Stripe does.
+    """
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        key = self.headers.get('Idempotency-Key')
+
+        with self.server.lock:
+            # Replaying a request with the same idempotency key returns the original response.
+            if key and key in self.server.idempotent_responses:
+                status, body = self.server.idempotent_responses[key]
+            else:
+                status, body = self.server.handle_api_call(self.path, params)
+                if key:
+                    self.server.idempotent_responses[key] = (status, body)
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Keep test output quiet.
+        pass
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    A small local stand-in for the Stripe API, for tests and development without network.
+
+    Point settings.STRIPE_API_BASE at base_url to use it. Every customer, charge and
+    refund it creates is kept in memory so tests can inspect them.
+    """
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, FakeStripeHandler)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.customers = {}
+        self.charges = {}
+        self.refunds = {}
+        self.idempotent_responses = {}
+
+    @property
+    def base_url(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def start(self):
+        # Serve from a daemon thread; returns the server so it can be used as a one-liner.
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_api_call(self, path, params):
+        if path == '/v1/customers':
+            customer = {'id': 'cus_%d' % next(self.ids), 'object': 'customer',
+                        'email': params.get('email'), 'source': params.get('source')}
+            self.customers[customer['id']] = customer
+            return 200, customer
+
+        if path == '/v1/charges':
+            customer = self.customers.get(params.get('customer'))
+            if customer is None:
+                return 400, {'error': {'type': 'invalid_request_error', 'message': 'No such customer'}}
+            if customer['source'] == DECLINED_TOKEN:
+                return 402, {'error': {'type': 'card_error', 'code': 'card_declined',
+                                       'message': 'Your card was declined.'}}
+            charge = {'id': 'ch_%d' % next(self.ids), 'object': 'charge', 'paid': True,
+                      'amount': int(params['amount']), 'currency': params.get('currency'),
+                      'customer': customer['id'], 'description': params.get('description')}
+            self.charges[charge['id']] = charge
+            return 200, charge
+
+        if path == '/v1/refunds':
+            if params.get('charge') not in self.charges:
+                return 400, {'error': {'type': 'invalid_request_error', 'message': 'No such charge'}}
+            refund = {'id': 're_%d' % next(self.ids), 'object': 'refund', 'charge': params['charge'],
+                      'amount': self.charges[params['charge']]['amount']}
+            self.refunds[refund['id']] = refund
+            return 200, refund
+
+        return 404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL'}}
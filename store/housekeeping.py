@@ -0,0 +1,117 @@
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Cart
+
+logger = logging.getLogger(__name__)
+
+
+def purge_in_batches(queryset, batch_size, pause):
+    """
+    Delete the rows of a queryset in small batches of consecutive primary keys.
+
+    Each batch is deleted in its own short transaction, so locks are only held for one
+    batch at a time, and only the primary keys of one batch are ever held in memory.
+    The queryset's conditions are applied again when deleting, so a row that stopped
+    matching them since its batch was picked (e.g. a cart that was just used) is kept.
+
+    Args:
+    queryset (QuerySet): The rows to delete.
+    batch_size (int): Number of rows per batch.
+    pause (float): Seconds to sleep between batches, leaving the database to other work.
+
+    Returns:
+    dict: Number of rows deleted per model label, including those deleted in cascade.
+    """
+    deleted = {}
+    last_pk = None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(batch.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            _, counts = queryset.filter(pk__gte=pks[0], pk__lte=pks[-1]).delete()
+        for label, count in counts.items():
+            deleted[label] = deleted.get(label, 0) + count
+        last_pk = pks[-1]
+        if len(pks) < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def abandoned_carts(days):
+    # Carts whose items haven't changed for more than 'days' days. A cart still keyed by the
+    # session that created it is kept while that session is live (the key changes when the
+    # visitor signs in, so carts of signed-in customers are only protected by their activity).
+    live_sessions = Session.objects.filter(session_key=OuterRef('cart_id'), expire_date__gt=timezone.now())
+    return Cart.objects.filter(updated__lt=timezone.now() - timedelta(days=days)).exclude(Exists(live_sessions))
+
+
+def expired_sessions():
+    # Sessions past their expiry date; Django never reads them again.
+    return Session.objects.filter(expire_date__lt=timezone.now())
+
+
+def purge(days=None, batch_size=None, pause=None):
+    """
+    Delete abandoned carts with their items, then expired sessions.
+
+    Args:
+    days (int): Days without activity after which a cart is abandoned (STORE_ABANDONED_CART_DAYS by default).
+    batch_size (int): Rows deleted per batch (STORE_PURGE_BATCH_SIZE by default).
+    pause (float): Seconds to sleep between batches (STORE_PURGE_PAUSE by default).
+
+    Returns:
+    tuple: Number of rows deleted per model label, and the seconds the purge took.
+    """
+    days = settings.STORE_ABANDONED_CART_DAYS if days is None else days
+    batch_size = batch_size or settings.STORE_PURGE_BATCH_SIZE
+    pause = settings.STORE_PURGE_PAUSE if pause is None else pause
+
+    started = time.perf_counter()
+    deleted = purge_in_batches(abandoned_carts(days), batch_size, pause)
+    deleted.update(purge_in_batches(expired_sessions(), batch_size, pause))
+    return deleted, time.perf_counter() - started
+
+
+def _run_scheduler(interval):
+    while True:
+        # Spread the runs of the workers that each start a scheduler.
+        time.sleep(interval * random.uniform(0.9, 1.1))
+        try:
+            deleted, seconds = purge()
+            logger.info('Purged %d rows in %.1fs: %s', sum(deleted.values()), seconds, deleted)
+        except DatabaseError:
+            logger.exception('Purging abandoned carts and expired sessions failed')
+        finally:
+            # This thread's connection is not closed by any request cycle.
+            close_old_connections()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler():
+    """
+    Purge abandoned carts and expired sessions every STORE_PURGE_INTERVAL seconds, in a
+    background thread of this process. Does nothing when the interval is 0 (the default),
+    e.g. when manage.py purge_carts is run by a scheduler outside the web processes.
+    """
+    global _scheduler
+    interval = settings.STORE_PURGE_INTERVAL
+    with _scheduler_lock:
+        if interval and _scheduler is None:
+            _scheduler = threading.Thread(target=_run_scheduler, args=(interval,), name='housekeeping', daemon=True)
+            _scheduler.start()
+    return _scheduler
@@ -0,0 +1,164 @@
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+# Profile of the request being handled by this thread or task, when it is sampled.
+_current_profile = ContextVar('store_request_profile', default=None)
+
+# Literals and parameter lists that vary between executions of the same query.
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_VALUE_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+
+
+def fingerprint(sql):
+    """
+    Reduce a SQL statement to its shape, so that executions differing only in their
+    parameters (the signature of an N+1 query pattern) share a fingerprint.
+    """
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _VALUE_LIST.sub('(...)', sql)
+
+
+class RequestProfile:
+    """
+    Query count, database time, repeated queries and template render time of one request.
+
+    Installed as an execute wrapper on every database connection for the duration of the request.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        # Query shapes run at least 'threshold' times, most repeated first.
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+class TimedTemplate(django_backend.Template):
+    """
+    Template adding its render time to the profile of the current request, if it is sampled.
+
+    Only top-level renders go through it (the templates they extend or include don't), so
+    nothing is counted twice; queries run lazily by the template count towards both times.
+    """
+
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(django_backend.DjangoTemplates):
+    """
+    The Django template backend, returning templates whose renders are timed for
+    QueryInstrumentationMiddleware. Set as the BACKEND of the TEMPLATES setting.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Profile a sample of the requests: the number of SQL queries and the time spent in them,
+    repeated query shapes (N+1 patterns) and the template render time.
+
+    Sampled responses carry the figures in a Server-Timing header (shown by the browser's
+    developer tools) and each sampled request is logged as one JSON line on the
+    'store.instrumentation' logger, at WARNING level when repeated queries were found.
+    Only STORE_INSTRUMENTATION_SAMPLE_RATE of the requests are profiled, so the cost is
+    bounded in production; the other requests only pay for one random() call.
+
+    Template render times are only measured with the InstrumentedDjangoTemplates backend.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.STORE_INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total_seconds = time.perf_counter() - started
+
+        duplicates = profile.duplicates(settings.STORE_INSTRUMENTATION_DUPLICATE_THRESHOLD)
+        self.add_server_timing(response, profile, duplicates, total_seconds)
+        self.log(request, response, profile, duplicates, total_seconds)
+        return response
+
+    def add_server_timing(self, response, profile, duplicates, total_seconds):
+        metrics = [
+            'db;dur=%.1f;desc="%d queries"' % (profile.db_seconds * 1000, profile.queries),
+            'tpl;dur=%.1f;desc="Templates"' % (profile.template_seconds * 1000),
+            'app;dur=%.1f;desc="Total"' % (total_seconds * 1000),
+        ]
+        if duplicates:
+            metrics.append('dupes;desc="%d repeated queries"' % sum(count for _, count in duplicates))
+        # Keep any metrics set by the view or other middleware.
+        if response.has_header('Server-Timing'):
+            metrics.insert(0, response['Server-Timing'])
+        response['Server-Timing'] = ', '.join(metrics)
+
+    def log(self, request, response, profile, duplicates, total_seconds):
+        level = logging.WARNING if duplicates else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        match = request.resolver_match
+        logger.log(level, json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(total_seconds * 1000, 2),
+            'queries': profile.queries,
+            'db_ms': round(profile.db_seconds * 1000, 2),
+            'template_ms': round(profile.template_seconds * 1000, 2),
+            'duplicates': [
+                {'fingerprint': hashlib.md5(sql.encode()).hexdigest()[:12], 'count': count, 'sql': sql[:300]}
+                for sql, count in duplicates
+            ],
+        }))
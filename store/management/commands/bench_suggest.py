@@ -0,0 +1,57 @@
+import json
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from store.suggest import PrefixIndex
+
+# Words the synthetic product names are made of.
+WORDS = ['galaxy', 'iphone', 'pro', 'max', 'ultra', 'mini', 'phone', 'tablet', 'laptop', 'watch',
+         'sony', 'samsung', 'apple', 'intel', 'windows', 'core', 'edge', 'fold', 'flip', 'plus']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the type-ahead suggestion index on synthetic product names (no database needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=100000, help='Number of product names to index.')
+        parser.add_argument('--queries', type=int, default=20000, help='Number of prefix queries to time.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        products = [
+            (pk, '%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), pk),
+             '/category/c%d/p%d' % (pk % 50, pk))
+            for pk in range(1, options['names'] + 1)
+        ]
+
+        # Build the index, measuring its memory footprint.
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = PrefixIndex(products)
+        build_seconds = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # Time prefix queries of 1 to 8 characters taken from indexed names.
+        latencies = []
+        for _ in range(options['queries']):
+            name = rng.choice(products)[1]
+            prefix = name[:rng.randint(1, 8)]
+            started = time.perf_counter()
+            index.search(prefix)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+
+        def percentile(p):
+            return round(latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)] * 1e6, 1)
+
+        self.stdout.write(json.dumps({
+            'names': len(index),
+            'build_ms': round(build_seconds * 1000, 1),
+            'memory_mb': round(memory / 2 ** 20, 1),
+            'query_us': {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99)},
+        }, indent=2))
@@ -0,0 +1,167 @@
+import contextlib
+import json
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store import urls
+from store.models import Category, Order, Product
+
+# Views that change data or end the session; they are left out so every run measures the same state.
+WRITE_VIEWS = {'add_cart', 'cart_remove', 'cart_remove_product', 'signout'}
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a sorted list.
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting the queries run and the time spent in them.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the store views through the Django test client against the current database '
+            '(see generate_catalog) and print latency percentiles and SQL cost per view as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per view.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per view before timing.')
+        parser.add_argument('--views', nargs='*', help='Only benchmark these URL names.')
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Disable the catalog page cache, to measure the views themselves.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if options['no_page_cache']:
+            overrides['STORE_PAGE_CACHE_ENABLED'] = False
+
+        with override_settings(**overrides):
+            cases = self.cases()
+            names = [pattern.name for pattern in urls.urlpatterns]
+            if options['views']:
+                unknown = set(options['views']) - set(names)
+                if unknown:
+                    raise CommandError('Unknown URL names: %s' % ', '.join(sorted(unknown)))
+                names = [name for name in names if name in options['views']]
+
+            views = {}
+            for name in names:
+                if name in cases:
+                    client, path = cases[name]
+                    views[name] = self.measure(client, path, options['warmup'], options['requests'])
+                    self.stderr.write('%s: p50 %.1f ms' % (name, views[name]['p50_ms']))
+
+        report = {
+            'commit': self.commit(),
+            'database': connection.vendor,
+            'replicas': settings.STORE_REPLICA_DATABASES,
+            'debug': settings.DEBUG,
+            'page_cache': settings.STORE_PAGE_CACHE_ENABLED and not options['no_page_cache'],
+            'products': Product.objects.count(),
+            'orders': Order.objects.count(),
+            'requests': options['requests'],
+            'views': views,
+            'skipped': [name for name in names if name not in cases],
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def cases(self):
+        # The client and path each URL is requested with, using rows of the current database.
+        product = Product.objects.filter(available=True).select_related('category').order_by('pk').first()
+        order = Order.objects.filter(user__isnull=False).select_related('user').order_by('-pk').first()
+        if product is None or order is None:
+            raise CommandError('The database needs products and customer orders; run generate_catalog first.')
+        category = Category.objects.get(pk=product.category_id)
+
+        anonymous = Client()
+        # A signed-in customer with orders and a few products in the cart.
+        customer = Client()
+        customer.force_login(order.user)
+        for cart_product in Product.objects.filter(available=True, stock__gt=0).order_by('pk')[:3]:
+            customer.get(reverse('add_cart', args=[cart_product.pk]))
+
+        word = product.name.split()[0]
+        return {
+            'home': (anonymous, reverse('home')),
+            'products_by_category': (anonymous, category.get_url()),
+            'product_detail': (anonymous, product.get_url()),
+            'cart_detail': (customer, reverse('cart_detail')),
+            'thanks_page': (customer, reverse('thanks_page', args=[order.pk])),
+            'order_status': (customer, reverse('order_status', args=[order.pk])),
+            'signup': (anonymous, reverse('signup')),
+            'signin': (anonymous, reverse('signin')),
+            'order_history': (customer, reverse('order_history')),
+            'order_detail': (customer, reverse('order_detail', args=[order.pk])),
+            'search': (anonymous, '%s?title=%s' % (reverse('search'), word)),
+            'search_suggest': (anonymous, '%s?q=%s' % (reverse('search_suggest'), word[:2])),
+        }
+
+    def measure(self, client, path, warmup, requests):
+        # Request the path repeatedly, timing each request and the SQL it runs.
+        for _ in range(warmup):
+            client.get(path)
+
+        latencies, queries, primary_queries, sql_times = [], [], [], []
+        for _ in range(requests):
+            # One timer per database, so the queries sent to the replicas are told apart.
+            timers = {alias: QueryTimer() for alias in settings.DATABASES}
+            with contextlib.ExitStack() as stack:
+                for alias, timer in timers.items():
+                    stack.enter_context(connections[alias].execute_wrapper(timer))
+                started = time.perf_counter()
+                response = client.get(path)
+                latencies.append(time.perf_counter() - started)
+            queries.append(sum(timer.queries for timer in timers.values()))
+            primary_queries.append(timers[DEFAULT_DB_ALIAS].queries)
+            sql_times.append(sum(timer.seconds for timer in timers.values()))
+        latencies.sort()
+        sql_times.sort()
+
+        def ms(seconds):
+            return round(seconds * 1000, 2)
+
+        return {
+            'path': path,
+            'status': response.status_code,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'queries': max(queries),
+            # Of those, the queries run on the primary database, the rest going to the replicas.
+            'primary_queries': max(primary_queries),
+            'sql_p50_ms': ms(percentile(sql_times, 50)),
+        }
+
+    def commit(self):
+        # Commit being benchmarked, so reports of different runs can be told apart.
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
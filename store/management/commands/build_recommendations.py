@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.recommendations import build
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the "Customers also bought" recommendations of every product from the products '
+            'bought together in paid orders.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=settings.STORE_RECOMMENDATIONS_COUNT,
+                            help='Recommendations kept per product.')
+        parser.add_argument('--max-order-size', type=int, default=settings.STORE_RECOMMENDATIONS_MAX_ORDER_SIZE,
+                            help='Orders of more distinct products than this are left out.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        lines, written = build(options['top'], options['max_order_size'])
+        self.stdout.write(self.style.SUCCESS('Wrote %d recommendations from %d order lines in %.1fs.'
+                                             % (written, lines, time.perf_counter() - started)))
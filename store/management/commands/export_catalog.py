@@ -0,0 +1,33 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_feed import FIELDS, export_rows, feed_format, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Write every category or product to a CSV or JSONL feed that import_catalog reads back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(FIELDS))
+        parser.add_argument('path', help='The feed file, or - to write it to standard output.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        try:
+            format = feed_format(options['path'], options['format'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        stream = sys.stdout if options['path'] == '-' else open(options['path'], 'w', newline='', encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            rows = write_rows(stream, format, options['kind'], export_rows(options['kind'], options['chunk_size']))
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        seconds = time.perf_counter() - started
+        self.stderr.write('%d %s exported in %.1fs (%.0f rows/s).'
+                          % (rows, options['kind'], seconds, rows / seconds if seconds else 0))
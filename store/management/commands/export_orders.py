@@ -0,0 +1,40 @@
+import datetime
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.models import Order
+from store.order_export import FORMATS, export_rows, order_lines, render_rows
+
+
+class Command(BaseCommand):
+    help = 'Write the order lines of a date range, with their orders, to a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The export file, or - to write it to standard output.')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--from', dest='start', type=datetime.date.fromisoformat,
+                            help='First day of the orders to export (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='end', type=datetime.date.fromisoformat,
+                            help='Last day of the orders to export, inclusive (YYYY-MM-DD).')
+        parser.add_argument('--country', help='Shipping country of the orders to export.')
+        parser.add_argument('--status', choices=[status for status, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        lines = order_lines(options['start'], options['end'], options['country'], options['status'])
+        stream = sys.stdout if options['path'] == '-' else open(options['path'], 'w', newline='', encoding='utf-8')
+        started = time.perf_counter()
+        # render_rows() yields one text per row, after the CSV header.
+        count = -1 if options['format'] == 'csv' else 0
+        try:
+            for text in render_rows(options['format'], export_rows(lines, options['chunk_size'])):
+                stream.write(text)
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        seconds = time.perf_counter() - started
+        self.stderr.write('%d order lines exported in %.1fs (%.0f rows/s).'
+                          % (count, seconds, count / seconds if seconds else 0))
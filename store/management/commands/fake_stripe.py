@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from store.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the Stripe API (set STRIPE_API_BASE to its address).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111, help='Port to listen on.')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(('127.0.0.1', options['port']))
+        self.stdout.write('Fake Stripe API listening on %s' % server.base_url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,226 @@
+from collections import Counter
+from decimal import Decimal
+import os
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from store.cache import MENU_TAG, PRODUCTS_TAG, SUGGESTIONS_TAG, bump_tags
+from store.models import Cart, CartItem, Category, Order, OrderItem, Product, Review
+from store.search import rebuild_index
+
+# Words the synthetic names and descriptions are made of.
+WORDS = ['galaxy', 'iphone', 'pro', 'max', 'ultra', 'mini', 'phone', 'tablet', 'laptop', 'watch',
+         'sony', 'samsung', 'apple', 'intel', 'windows', 'core', 'edge', 'fold', 'flip', 'plus']
+
+# Prefix of the unique keys (slugs, cart IDs, ...) of generated rows.
+KEY_PREFIX = 'gen-'
+
+
+def product_name(number):
+    # Names and prices are pure functions of the product number, so order items can be
+    # generated for millions of products without keeping every product in memory.
+    return '%s %s %d' % (WORDS[number % len(WORDS)].title(), WORDS[number // len(WORDS) % len(WORDS)], number)
+
+
+def product_price(number):
+    return Decimal(499 + number * 7919 % 200000) / 100
+
+
+def media_files(folder):
+    # Images shipped with the store, reused by the generated rows so pages render real images.
+    path = os.path.join(settings.MEDIA_ROOT, folder)
+    files = sorted(os.listdir(path)) if os.path.isdir(path) else []
+    return ['%s/%s' % (folder, name) for name in files] or ['']
+
+
+def insert_rows(model, fields, rows):
+    """
+    Insert rows into a model's table with one executemany() call.
+
+    At millions of rows, the per-field work bulk_create() does for every row dominates the
+    run time, so the rows are given as tuples of database-ready values instead. Fields not
+    listed get their default value.
+
+    Args:
+    model (Model): The model whose table is filled.
+    fields (list): Names of the model fields given in each row.
+    rows (list): Tuples of values, in the order of 'fields'.
+    """
+    if not rows:
+        return
+    given = [model._meta.get_field(name) for name in fields]
+    defaults = [field for field in model._meta.concrete_fields if field not in given and not field.primary_key]
+    default_values = tuple(field.get_db_prep_save(field.get_default(), connection) for field in defaults)
+
+    quote_name = connection.ops.quote_name
+    columns = [quote_name(field.column) for field in given + defaults]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO %s (%s) VALUES (%s)'
+            % (quote_name(model._meta.db_table), ', '.join(columns), ', '.join(['%s'] * len(columns))),
+            [row + default_values for row in rows]
+        )
+
+
+def primary_keys(model, field, keys):
+    # Primary keys of the rows just inserted, looked up by a unique field, in the order of 'keys'.
+    pks = dict(model.objects.filter(**{field + '__in': keys}).values_list(field, 'pk'))
+    return [pks[key] for key in keys]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a deterministic synthetic catalog, customers, carts and orders for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--reviews', type=int, default=200000)
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--lines', type=int, default=5, help='Maximum number of lines per cart and per order.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per insert statement batch.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if Category.objects.filter(slug__startswith=KEY_PREFIX).exists():
+            raise CommandError('A synthetic catalog was already generated in this database; '
+                               'run "manage.py flush" first to start from scratch.')
+        if options['products'] < 1 or options['categories'] < 1 or options['users'] < 1:
+            raise CommandError('At least one category, product and user are needed.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.max_lines = max(options['lines'], 1)
+        # Timestamps of the generated rows, in the form the database stores them.
+        self.now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        category_ids = self.generate('categories', options['categories'], self.categories)
+        product_ids = self.generate('products', options['products'], lambda start, stop: self.products(
+            start, stop, category_ids))
+        user_ids = self.generate('users', options['users'], self.users)
+        self.generate('reviews', options['reviews'], lambda start, stop: self.reviews(
+            start, stop, product_ids, user_ids))
+        self.generate('carts', options['carts'], lambda start, stop: self.carts(start, stop, product_ids))
+        self.generate('orders', options['orders'], lambda start, stop: self.orders(
+            start, stop, product_ids, user_ids))
+
+        # Raw inserts don't send the signals that keep the search index and caches current.
+        started = time.perf_counter()
+        rebuild_index()
+        bump_tags(MENU_TAG, PRODUCTS_TAG, SUGGESTIONS_TAG)
+        self.stdout.write('Search index rebuilt in %.1fs.' % (time.perf_counter() - started))
+        self.stdout.write(self.style.SUCCESS('Synthetic catalog generated.'))
+
+    def generate(self, label, count, insert_batch):
+        # Insert 'count' rows of one table, batch by batch, in a single transaction.
+        # Returns the primary keys of the new rows, when the batches return them.
+        started = time.perf_counter()
+        ids = []
+        with transaction.atomic():
+            for start in range(0, count, self.batch_size):
+                ids.extend(insert_batch(start, min(start + self.batch_size, count)) or [])
+        self.stdout.write('%d %s in %.1fs.' % (count, label, time.perf_counter() - started))
+        return ids
+
+    def lines(self, product_count):
+        # Distinct product numbers for the lines of one cart or order.
+        return self.rng.sample(range(product_count), min(self.rng.randint(1, self.max_lines), product_count))
+
+    def categories(self, start, stop):
+        images = media_files('category')
+        slugs = ['%scategory-%d' % (KEY_PREFIX, number) for number in range(start, stop)]
+        insert_rows(Category, ['name', 'slug', 'description', 'image'], [
+            ('Category %d' % number, slug, 'Synthetic category %d.' % number, images[number % len(images)])
+            for number, slug in zip(range(start, stop), slugs)
+        ])
+        return primary_keys(Category, 'slug', slugs)
+
+    def products(self, start, stop, category_ids):
+        rng = self.rng
+        images = media_files('product')
+        slugs = ['%sproduct-%d' % (KEY_PREFIX, number) for number in range(start, stop)]
+        insert_rows(Product, ['name', 'slug', 'description', 'category', 'price', 'image', 'stock', 'available',
+                              'created', 'updated'], [
+            (
+                product_name(number),
+                slug,
+                ' '.join(rng.choice(WORDS) for _ in range(20)),
+                category_ids[number % len(category_ids)],
+                product_price(number),
+                images[number % len(images)],
+                rng.randint(0, 100),
+                # A few products are unpublished, as in a real catalog.
+                rng.random() > 0.05,
+                self.now,
+                self.now,
+            )
+            for number, slug in zip(range(start, stop), slugs)
+        ])
+        return primary_keys(Product, 'slug', slugs)
+
+    def users(self, start, stop):
+        # Generated customers can't sign in with a password; benchmarks log them in directly.
+        password = make_password(None)
+        usernames = ['%sshopper%d' % (KEY_PREFIX, number) for number in range(start, stop)]
+        insert_rows(User, ['username', 'email', 'password', 'date_joined'], [
+            (username, '%s@example.com' % username, password, self.now) for username in usernames
+        ])
+        return primary_keys(User, 'username', usernames)
+
+    def reviews(self, start, stop, product_ids, user_ids):
+        rng = self.rng
+        reviewed = [rng.choice(product_ids) for _ in range(start, stop)]
+        insert_rows(Review, ['product', 'user', 'content'], [
+            (product_id, rng.choice(user_ids), ' '.join(rng.choice(WORDS) for _ in range(12)))
+            for product_id in reviewed
+        ])
+        # Raw inserts send no signals: add the reviews to the products' counts, with one
+        # UPDATE per number of reviews a product got in this batch.
+        by_count = {}
+        for product_id, count in Counter(reviewed).items():
+            by_count.setdefault(count, []).append(product_id)
+        for count, ids in by_count.items():
+            Product.objects.filter(pk__in=ids).update(review_count=F('review_count') + count)
+
+    def carts(self, start, stop, product_ids):
+        rng = self.rng
+        cart_keys = ['%scart-%d' % (KEY_PREFIX, number) for number in range(start, stop)]
+        today = connection.ops.adapt_datefield_value(timezone.now().date())
+        insert_rows(Cart, ['cart_id', 'date_added', 'updated'], [(cart_key, today, self.now) for cart_key in cart_keys])
+        insert_rows(CartItem, ['cart', 'product', 'quantity'], [
+            (cart_pk, product_ids[number], rng.randint(1, 3))
+            for cart_pk in primary_keys(Cart, 'cart_id', cart_keys)
+            for number in self.lines(len(product_ids))
+        ])
+
+    def orders(self, start, stop, product_ids, user_ids):
+        rng = self.rng
+        order_keys, order_rows, order_lines = [], [], []
+        for number in range(start, stop):
+            user_number = rng.randrange(len(user_ids))
+            email = '%sshopper%d@example.com' % (KEY_PREFIX, user_number)
+            lines = [(product_number, rng.randint(1, 3)) for product_number in self.lines(len(product_ids))]
+            order_keys.append('%sorder-%d' % (KEY_PREFIX, number))
+            order_lines.append(lines)
+            order_rows.append((
+                'tok_visa', Order.PAID, order_keys[-1], 'ch_%s%d' % (KEY_PREFIX, number),
+                sum(product_price(product_number) * quantity for product_number, quantity in lines),
+                email, user_ids[user_number], self.now, 'Shopper %d' % user_number, 'Shopper %d' % user_number,
+            ))
+        insert_rows(Order, ['token', 'status', 'idempotency_key', 'charge_id', 'total', 'emailAddress', 'user',
+                            'created', 'billingName', 'shippingName'], order_rows)
+        insert_rows(OrderItem, ['order', 'product', 'catalog_product', 'price', 'quantity'], [
+            (order_pk, product_name(product_number), product_ids[product_number], product_price(product_number),
+             quantity)
+            for order_pk, lines in zip(primary_keys(Order, 'idempotency_key', order_keys), order_lines)
+            for product_number, quantity in lines
+        ])
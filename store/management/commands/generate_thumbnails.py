@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import MENU_TAG, bump_tags
+from store.models import Category, Product
+from store.thumbnails import generate_thumbnails, record_thumbnails, thumbnails_ready
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing thumbnails of the existing product and category images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate thumbnails that exist already.')
+
+    def handle(self, *args, **options):
+        images = written = recorded = 0
+        for model in (Category, Product):
+            storage = model._meta.get_field('image').storage
+            # Many products can share an image; each is resized once.
+            names = model.objects.exclude(image='').order_by().values_list('image', flat=True).distinct()
+            for name in names.iterator():
+                images += 1
+                written += generate_thumbnails(name, storage, force=options['force'])
+                # Record the thumbnails on the rows, including those written before.
+                if thumbnails_ready(name, storage):
+                    recorded += record_thumbnails(model, name)
+
+        if written or recorded:
+            # Every catalog page depends on the menu, so this purges all of their cached copies,
+            # in every web worker through the shared cache (see store.checks).
+            bump_tags(MENU_TAG)
+        self.stdout.write(self.style.SUCCESS('%d images checked, %d thumbnails written, %d rows updated.'
+                                             % (images, written, recorded)))
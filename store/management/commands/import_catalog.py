@@ -0,0 +1,59 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.cache import MENU_TAG, PRODUCTS_TAG, SUGGESTIONS_TAG, bump_tags
+from store.catalog_feed import FIELDS, CatalogImporter, batches, feed_format, read_rows
+from store.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Create or update categories or products, matched by slug, from a CSV or JSONL feed '
+            '(see store.catalog_feed.FIELDS for the columns), streaming it in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(FIELDS))
+        parser.add_argument('path', help='The feed file, or - to read it from standard input.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            format = feed_format(options['path'], options['format'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        importer = CatalogImporter(options['kind'], options['batch_size'])
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        started = time.perf_counter()
+        rows = 0
+        try:
+            for number, batch in enumerate(batches(read_rows(stream, format), options['batch_size'])):
+                importer.import_batch(batch, first_line=rows + 1)
+                rows += len(batch)
+                if number % 10 == 9:
+                    self.stderr.write('%d rows, %.0f rows/s' % (rows, rows / (time.perf_counter() - started)))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        imported = time.perf_counter() - started
+
+        for error in importer.errors:
+            self.stderr.write(error)
+        counts = importer.counts
+        self.stdout.write('%(created)d created, %(updated)d updated, %(unchanged)d unchanged, '
+                          '%(skipped)d skipped' % counts)
+        self.stdout.write('%d rows in %.1fs (%.0f rows/s).' % (rows, imported, rows / imported if imported else 0))
+
+        if counts['created'] or counts['updated']:
+            # The bulk writes sent no signals: refresh the caches and the search index once,
+            # for the whole feed. Every catalog page renders the menu, so bumping its tag
+            # purges all of them (and changes their ETags), in every web worker: the tag
+            # versions live in the shared cache, which the store.E001 check insists on.
+            started = time.perf_counter()
+            bump_tags(MENU_TAG, PRODUCTS_TAG, SUGGESTIONS_TAG)
+            if get_backend() is not None:
+                rebuild_index()
+            self.stdout.write('Caches purged and search index rebuilt in %.1fs.' % (time.perf_counter() - started))
+        self.stdout.write(self.style.SUCCESS('Catalog imported.'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.payments import process_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'Charge pending orders placed through the asynchronous checkout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the pending orders once and exit.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when there is nothing to process.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Orders to process per batch.')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_orders(limit=options['batch_size'])
+            if any(processed.values()):
+                self.stdout.write('Paid: %(paid)d, failed: %(failed)d' % processed)
+            if options['once']:
+                break
+            if not any(processed.values()):
+                time.sleep(options['interval'])
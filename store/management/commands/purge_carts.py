@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.housekeeping import purge
+
+
+class Command(BaseCommand):
+    help = ('Delete carts unused for STORE_ABANDONED_CART_DAYS days together with their items, and expired '
+            'sessions, in small batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.STORE_ABANDONED_CART_DAYS,
+                            help='Days without activity after which a cart is abandoned.')
+        parser.add_argument('--batch-size', type=int, default=settings.STORE_PURGE_BATCH_SIZE,
+                            help='Rows deleted per batch (and per transaction).')
+        parser.add_argument('--pause', type=float, default=settings.STORE_PURGE_PAUSE,
+                            help='Seconds to sleep between batches.')
+        parser.add_argument('--every', type=float,
+                            help='Keep running, purging again every this many seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, seconds = purge(options['days'], options['batch_size'], options['pause'])
+            total = sum(deleted.values())
+            for label, count in sorted(deleted.items()):
+                self.stdout.write('%s: %d' % (label, count))
+            self.stdout.write(self.style.SUCCESS('Deleted %d rows in %.1fs (%.0f rows/s).'
+                                                 % (total, seconds, total / seconds if seconds else 0)))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the product table.'
+
+    def handle(self, *args, **options):
+        if get_backend() is None:
+            self.stdout.write('This database has no full-text search backend; nothing to do.')
+            return
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
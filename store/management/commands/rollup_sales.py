@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.sales import catch_up
+
+
+class Command(BaseCommand):
+    help = ('Add the paid orders that are not in the daily sales rollups yet (e.g. orders placed before '
+            'the rollups existed, or whose roll-up at payment time failed).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Orders added per batch (and per transaction).')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        added = catch_up(options['batch_size'])
+        seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS('Added %d orders to the sales rollups in %.1fs (%.0f orders/s).'
+                                             % (added, seconds, added / seconds if seconds else 0)))
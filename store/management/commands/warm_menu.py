@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.menu import warm_menu
+
+
+class Command(BaseCommand):
+    help = 'Build the category menu and store it in the shared cache so workers start warm.'
+
+    def handle(self, *args, **options):
+        links = warm_menu()
+        self.stdout.write(self.style.SUCCESS('Menu warmed with %d categories.' % len(links)))
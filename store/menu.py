@@ -0,0 +1,94 @@
+from collections import namedtuple
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .cache import MENU_TAG, bumped_locally, recently_changed, tag_versions
+from .models import Category
+from .replicas import reading_from_replica, reading_replicas
+
+# One entry of the category menu shown in the navbar.
+MenuLink = namedtuple('MenuLink', ['name', 'slug', 'url', 'product_count'])
+
+# Key of the copy of the menu shared between processes through Django's cache.
+SHARED_MENU_KEY = 'store:menu'
+
+# The menu held by this process, together with the MENU_TAG version it was built for and,
+# if it was built from a replica that may lag behind, the time until which it is kept; and
+# when that version was last checked, with the stamp this process had given MENU_TAG then.
+_menu = {'version': None, 'links': (), 'until': None, 'checked': 0.0, 'local': None}
+_lock = threading.Lock()
+
+
+def build_menu():
+    """
+    Build the category menu from the database with a single query.
+
+    Returns:
+    tuple: MenuLink entries ordered by category name.
+    """
+    categories = Category.objects.annotate(
+        product_count=Count('product', filter=Q(product__available=True)),
+    ).order_by('name')
+    return tuple(
+        MenuLink(category.name, category.slug, category.get_url(), category.product_count)
+        for category in categories
+    )
+
+
+def get_menu():
+    """
+    Return the category menu, rebuilding it only when its version stamp has moved on.
+
+    The version stamp is the MENU_TAG version, which the signal handlers in store.signals
+    bump whenever a Category is saved or a Product is added, removed, moved to another
+    category or changes availability. The stamp is kept in the shared cache, which may be
+    a database table, so it is only read once every STORE_MENU_CHECK_INTERVAL seconds:
+    renders in between cost no query. Changes made by this process are noticed at once.
+
+    The menu is read from a replica. One built within STORE_REPLICA_LAG_SECONDS of the
+    change that bumped the stamp may miss that change, so it is only kept until that lag
+    has passed, then built once more.
+    """
+    now = time.monotonic()
+    local = bumped_locally(MENU_TAG)
+    if (_menu['version'] is not None and now - _menu['checked'] < settings.STORE_MENU_CHECK_INTERVAL
+            and local == _menu['local'] and _is_current(_menu, _menu['version'])):
+        return _menu['links']
+
+    version = tag_versions([MENU_TAG])[MENU_TAG]
+    if _is_current(_menu, version):
+        _menu.update(checked=now, local=local)
+        return _menu['links']
+
+    with _lock:
+        # Another thread may have rebuilt the menu while this one was waiting for the lock.
+        if not _is_current(_menu, version):
+            # Prefer the copy another process already built for this version over the database.
+            shared = cache.get(SHARED_MENU_KEY)
+            if not (shared is not None and _is_current(shared, version)):
+                with reading_replicas():
+                    links = build_menu()
+                    until = None
+                    if reading_from_replica() and recently_changed({MENU_TAG: version}):
+                        until = version + settings.STORE_REPLICA_LAG_SECONDS * 10 ** 9
+                shared = {'version': version, 'links': links, 'until': until}
+                cache.set(SHARED_MENU_KEY, shared, timeout=None)
+            _menu.update(shared)
+        _menu.update(checked=now, local=local)
+    return _menu['links']
+
+
+def _is_current(menu, version):
+    # Whether a built menu is the one for the version stamp, and not a provisional one past its time.
+    return menu['version'] == version and (menu.get('until') is None or time.time_ns() < menu['until'])
+
+
+def warm_menu():
+    """
+    Load the menu into this process (and the shared cache) ahead of the first request.
+    """
+    return get_menu()
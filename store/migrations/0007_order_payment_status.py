@@ -0,0 +1,40 @@
+
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_alter_order_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='charge_id',
+            field=models.CharField(blank=True, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        # Orders placed before payment states existed were all paid at checkout.
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('paid', 'Complete'), ('failed', 'Payment failed')], default='paid', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('paid', 'Complete'), ('failed', 'Payment failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,55 @@
+
+
+from django.db import migrations
+
+# The full-text index is vendor specific (FTS5 on SQLite, tsvector + GIN on PostgreSQL), so
+# it is created with raw SQL rather than as a model. The statements are written out here,
+# as they stood when the index was added, so later changes to store.search can't alter
+# what this migration does.
+CREATE_INDEX = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts USING fts5("
+        "name, description, category, tokenize = 'unicode61 remove_diacritics 2')",
+        "INSERT INTO store_product_fts (rowid, name, description, category) "
+        "SELECT p.id, p.name, p.description, c.name FROM store_product p "
+        "INNER JOIN store_category c ON c.id = p.category_id WHERE p.available",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS store_product_search ("
+        "product_id integer PRIMARY KEY REFERENCES store_product (id) ON DELETE CASCADE "
+        "DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS store_product_search_document ON store_product_search USING GIN (document)",
+        "INSERT INTO store_product_search (product_id, document) SELECT p.id, "
+        "setweight(to_tsvector('english', p.name), 'A') || "
+        "setweight(to_tsvector('english', c.name), 'B') || "
+        "setweight(to_tsvector('english', p.description), 'C') "
+        "FROM store_product p INNER JOIN store_category c ON c.id = p.category_id WHERE p.available",
+    ],
+}
+
+DROP_INDEX = {
+    'sqlite': ['DROP TABLE IF EXISTS store_product_fts'],
+    'postgresql': ['DROP TABLE IF EXISTS store_product_search'],
+}
+
+
+def run(statements):
+    # A RunPython function running the statements of the database's vendor, if it has any;
+    # other databases have no index and search with a LIKE.
+    def operation(apps, schema_editor):
+        with schema_editor.connection.cursor() as cursor:
+            for statement in statements.get(schema_editor.connection.vendor, []):
+                cursor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_order_payment_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_INDEX), run(DROP_INDEX)),
+    ]
@@ -0,0 +1,40 @@
+
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    # Before cart_id and (cart, product) can be made unique, fold any duplicates together.
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+
+    # Move the items of duplicate carts into the oldest cart with the same ID.
+    duplicate_ids = (Cart.objects.values('cart_id').annotate(carts=Count('id')).filter(carts__gt=1)
+                     .values_list('cart_id', flat=True))
+    for cart_id in duplicate_ids:
+        carts = list(Cart.objects.filter(cart_id=cart_id).order_by('date_added', 'id'))
+        CartItem.objects.filter(cart__in=carts[1:]).update(cart=carts[0])
+        Cart.objects.filter(pk__in=[cart.pk for cart in carts[1:]]).delete()
+
+    # Merge the lines of a cart holding the same product, adding up their quantities.
+    duplicate_lines = (CartItem.objects.values('cart', 'product').annotate(lines=Count('id'))
+                       .filter(lines__gt=1))
+    for line in duplicate_lines:
+        items = list(CartItem.objects.filter(cart=line['cart'], product=line['product']).order_by('id'))
+        items[0].quantity = sum(item.quantity for item in items)
+        items[0].save(update_fields=['quantity'])
+        CartItem.objects.filter(pk__in=[item.pk for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+    # A data migration of its own, so it commits before 0010_store_indexes alters the tables
+    # (PostgreSQL won't ALTER a table with pending trigger events from the same transaction).
+
+    dependencies = [
+        ('store', '0008_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
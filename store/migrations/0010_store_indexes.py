@@ -0,0 +1,34 @@
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_merge_duplicate_carts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='cart_id',
+            field=models.CharField(blank=True, max_length=250, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['emailAddress', '-created'], name='order_email_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('available', True)), fields=['category', 'name', 'id'], name='product_category_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('available', True)), fields=['name', 'id'], name='product_listing_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_unique_product'),
+        ),
+    ]
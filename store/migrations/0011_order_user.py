@@ -0,0 +1,39 @@
+
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def link_orders_to_users(apps, schema_editor):
+    # The order history used to list the orders placed with the account's email address.
+    # Keep showing the orders placed until now by linking them to that account, in one
+    # UPDATE; orders placed from now on are linked to the account that places them, and
+    # never by email address, which isn't verified at sign-up.
+    # update() leaves the auto_now 'created' date of the orders alone.
+    Order = apps.get_model('store', 'Order')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    accounts = User.objects.filter(email=OuterRef('emailAddress')).order_by('pk').values('pk')[:1]
+    Order.objects.filter(user__isnull=True).exclude(emailAddress='').update(user=Subquery(accounts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_store_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created'], name='order_user_created_idx'),
+        ),
+        migrations.RunPython(link_orders_to_users, migrations.RunPython.noop),
+    ]
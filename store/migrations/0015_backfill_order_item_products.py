@@ -0,0 +1,29 @@
+
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def link_order_items(apps, schema_editor):
+    # Order items recorded their product by name only; names are unique, so the name finds
+    # the product unless it was renamed or deleted since. Linked 10000 items per UPDATE, each
+    # committed on its own, so the table is never locked for long.
+    OrderItem = apps.get_model('store', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+    product_id = Subquery(Product.objects.filter(name=OuterRef('product')).values('pk')[:1])
+    last_pk = OrderItem.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_pk, 10000):
+        OrderItem.objects.filter(pk__gt=start, pk__lte=start + 10000, catalog_product__isnull=True) \
+            .update(catalog_product=product_id)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('store', '0014_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_order_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_reviews(apps, schema_editor):
+    # Count the existing reviews of each product, 10000 products per UPDATE, each committed
+    # on its own, so the table is never locked for long.
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+    review_count = Subquery(Review.objects.filter(product=OuterRef('pk')).order_by()
+                            .values('product').annotate(count=Count('pk')).values('count'))
+    last_pk = Product.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_pk, 10000):
+        Product.objects.filter(pk__gt=start, pk__lte=start + 10000).update(review_count=Coalesce(review_count, 0))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('store', '0017_product_review_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_backfill_product_review_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='thumbnailed_image',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnailed_image',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,26 @@
+
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_thumbnailed_image'),
+    ]
+
+    operations = [
+        # Existing carts count as used when the migration runs, so none is purged before
+        # STORE_ABANDONED_CART_DAYS have passed without activity.
+        migrations.AddField(
+            model_name='cart',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated'], name='cart_updated_idx'),
+        ),
+    ]
@@ -1,13 +1,29 @@
+from collections import namedtuple
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import F, Q, Sum, ExpressionWrapper
 from django.urls import reverse
 from django.contrib.auth.models import User
 
+# Items of a cart (with their products loaded) and the totals computed by the database.
+CartSummary = namedtuple('CartSummary', ['items', 'subtotal', 'total', 'count'])
+
+# Price of one cart line (quantity x unit price), evaluated by the database.
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('product__price'),
+    output_field=models.DecimalField(max_digits=12, decimal_places=2),
+)
+
 class Category(models.Model):
     # Fields for category details
     name = models.CharField(max_length=250, unique=True)
     slug = models.SlugField(max_length=250, unique=True)  # Used in URLs
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='category', blank=True)
+    # The image whose thumbnails exist, recorded once they are written (see store.thumbnails),
+    # so pages tell whether to offer them without asking the storage. Differs from 'image' until then.
+    thumbnailed_image = models.CharField(max_length=100, blank=True, editable=False)
 
     class Meta:
         ordering = ('name',)  # Default ordering by category name
@@ -30,8 +46,14 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)  # Link to Category
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='product', blank=True)
+    # The image whose thumbnails exist, recorded once they are written (see store.thumbnails),
+    # so pages tell whether to offer them without asking the storage. Differs from 'image' until then.
+    thumbnailed_image = models.CharField(max_length=100, blank=True, editable=False)
     stock = models.IntegerField()
     available = models.BooleanField(default=True)  # Whether the product is available for sale
+    # Number of reviews of the product, kept up to date by store.signals as reviews are added
+    # and deleted, so listings and the product page show it without counting the reviews
+    review_count = models.PositiveIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)  # Automatically set when object is created
     updated = models.DateTimeField(auto_now=True)  # Automatically set on each save
 
@@ -39,6 +61,19 @@ class Product(models.Model):
         ordering = ('name',)  # Default ordering by product name
         verbose_name = 'product'
         verbose_name_plural = 'products'
+        indexes = [
+            # Listing of a category's available products, ordered by name (home view).
+            # Partial indexes, as Django filters booleans with a bare column reference that
+            # SQLite can't match against an indexed column, but can against the index condition.
+            models.Index(fields=['category', 'name', 'id'], condition=Q(available=True),
+                         name='product_category_listing_idx'),
+            # Listing of all available products, ordered by name (home view)
+            models.Index(fields=['name', 'id'], condition=Q(available=True), name='product_listing_idx'),
+            # Latest change to a category's products, or to any product: validators of the
+            # ETags of the listing pages, read with one index lookup.
+            models.Index(fields=['category', 'updated'], name='product_category_updated_idx'),
+            models.Index(fields=['updated'], name='product_updated_idx'),
+        ]
 
     def get_url(self):
         # Returns the URL for a product. Used in templates for linking to a product page.
@@ -49,19 +84,58 @@ class Product(models.Model):
         return self.name
 
 class Cart(models.Model):
-    # Unique identifier for the cart
-    cart_id = models.CharField(max_length=250, blank=True)
+    # Unique identifier for the cart, looked up on every cart request
+    cart_id = models.CharField(max_length=250, blank=True, unique=True)
     # Date when the cart was created, set automatically
     date_added = models.DateField(auto_now_add=True)
+    # When items were last added to or removed from the cart (see DatabaseCartStorage)
+    updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'Cart'  # Custom database table name
         ordering = ['date_added']  # Default ordering by the date added
+        indexes = [
+            # Carts unused for a while (purge of abandoned carts)
+            models.Index(fields=['updated'], name='cart_updated_idx'),
+        ]
 
     def __str__(self):
         # String representation showing the cart's ID
         return self.cart_id
 
+    def summary(self):
+        """
+        Return the active items of the cart together with its totals.
+
+        The items are loaded with their product (and its category, for product URLs) joined
+        in, each annotated with its line_total, and the subtotal, total and item count are
+        computed by the database in one aggregate query, so the number of queries doesn't
+        grow with the number of lines in the cart.
+
+        Returns:
+        CartSummary: items (list of CartItem), subtotal, total (Decimal) and count (int).
+        """
+        active_items = self.cartitem_set.filter(active=True)
+
+        # Load every line with its product in a single query.
+        items = list(
+            active_items.select_related('product', 'product__category')
+            .annotate(line_total=LINE_TOTAL)
+            .order_by('id')
+        )
+
+        # Let the database add up the lines.
+        totals = active_items.aggregate(subtotal=Sum(LINE_TOTAL), count=Sum('quantity'))
+        subtotal = (totals['subtotal'] or Decimal('0')).quantize(Decimal('0.01'))
+
+        # There are no taxes or shipping costs yet, so the total is the subtotal.
+        return CartSummary(items, subtotal, subtotal, totals['count'] or 0)
+
+    @staticmethod
+    def empty_summary():
+        # Summary used when the visitor has no cart yet.
+        return CartSummary([], Decimal('0.00'), Decimal('0.00'), 0)
+
 class CartItem(models.Model):
     # Foreign key relation to the Product model
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -72,9 +146,16 @@ class CartItem(models.Model):
 
     class Meta:
         db_table = 'CartItem'  # Custom database table name
+        constraints = [
+            # A product appears at most once per cart; also indexes the (cart, product) lookups
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_unique_product'),
+        ]
 
     def sub_total(self):
-        # Calculate the subtotal for this cart item
+        # Calculate the subtotal for this cart item, using the value computed by the
+        # database when the item was loaded through Cart.summary()
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.product.price * self.quantity
 
     def __str__(self):
@@ -82,13 +163,35 @@ class CartItem(models.Model):
         return str(self.product)
 
 class Order(models.Model):
+    # Payment states of an order
+    PENDING = 'pending'  # Recorded, stock reserved, payment not processed yet
+    PAID = 'paid'  # Payment succeeded
+    FAILED = 'failed'  # Payment was declined; the reserved stock has been released
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PAID, 'Complete'),
+        (FAILED, 'Payment failed'),
+    ]
+
     # Unique token for the order
     token = models.CharField(max_length=250, blank=True)
+    # Payment state of the order
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    # Key identifying the checkout attempt, so a retried submission or payment can't create
+    # a second order or a second charge
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Stripe charge ID, and the reason the payment failed if it did
+    charge_id = models.CharField(max_length=250, blank=True)
+    payment_error = models.CharField(max_length=500, blank=True)
     total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='USD Order Total')
     # Email address for the order
     emailAddress = models.EmailField(max_length=250, blank=True, verbose_name='Email Address')
+    # Customer account that placed the order (empty for guest checkouts)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     # Date and time when the order was created or updated, set automatically
     created = models.DateTimeField(auto_now=True)
+    # Whether the order, once paid, has been added to the daily sales rollups (store.sales)
+    rolled_up = models.BooleanField(default=False)
     # Billing details
     billingName = models.CharField(max_length=250, blank=True)
     billingAddress1 = models.CharField(max_length=250, blank=True)
@@ -105,14 +208,28 @@ class Order(models.Model):
     class Meta:
         db_table = 'Order'  # Custom database table name
         ordering = ['-created']  # Default ordering by creation date, newest first
+        indexes = [
+            # Orders placed with an email address, newest first (admin search)
+            models.Index(fields=['emailAddress', '-created'], name='order_email_created_idx'),
+            # A customer account's orders, newest first (order history)
+            models.Index(fields=['user', '-created'], name='order_user_created_idx'),
+            # All orders, or those in one payment state, newest first (admin changelist)
+            models.Index(fields=['created', 'id'], name='order_created_idx'),
+            models.Index(fields=['status', 'created', 'id'], name='order_status_created_idx'),
+            # Paid orders not yet added to the sales rollups (manage.py rollup_sales)
+            models.Index(fields=['id'], condition=Q(status='paid', rolled_up=False), name='order_rollup_pending_idx'),
+        ]
 
     def __str__(self):
         # String representation showing the order's ID
         return str(self.id)
 
 class OrderItem(models.Model):
-    # Product name for the order item
+    # Product name for the order item, as it was when the order was placed
     product = models.CharField(max_length=250)
+    # The product itself, for reporting (empty if it has since been deleted)
+    catalog_product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True, blank=True,
+                                        related_name='order_items')
     quantity = models.IntegerField()  # Quantity of the product in the order
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='USD Price')
     # Foreign key relation to the Order model
@@ -136,6 +253,71 @@ class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.CharField(max_length=500)  # Content of the review
 
+    class Meta:
+        indexes = [
+            # A product's reviews, newest first, a page at a time (product page)
+            models.Index(fields=['product', '-id'], name='review_product_newest_idx'),
+        ]
+
     def __str__(self):
         # String representation showing the review's content
         return self.content
+
+
+class DailySales(models.Model):
+    # Sales of paid orders per day, maintained by store.sales as orders are paid so that
+    # reports never aggregate the order tables.
+    day = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)  # Units of products sold
+    orders = models.IntegerField(default=0)  # Number of orders
+
+    class Meta:
+        db_table = 'DailySales'  # Custom database table name
+
+
+class DailyProductSales(models.Model):
+    # Sales of one product per day; the product is empty for products since deleted.
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)  # Number of orders including the product
+
+    class Meta:
+        db_table = 'DailyProductSales'  # Custom database table name
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_unique'),
+        ]
+
+
+class DailyCategorySales(models.Model):
+    # Sales of one category's products per day, by the category the product had when the
+    # order was rolled up.
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)  # Number of orders including the category
+
+    class Meta:
+        db_table = 'DailyCategorySales'  # Custom database table name
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='daily_category_sales_unique'),
+        ]
+
+
+class Recommendation(models.Model):
+    # "Customers also bought": the products most often bought in the same orders as a
+    # product, best first. Precomputed by manage.py build_recommendations (store.recommendations).
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()  # 0 for the product bought together most often
+    score = models.IntegerField()  # Number of orders including both products
+
+    class Meta:
+        db_table = 'Recommendation'  # Custom database table name
+        constraints = [
+            # A product's recommendations, in order, are read from this index (product page).
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_unique'),
+        ]
@@ -0,0 +1,102 @@
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+
+from .models import OrderItem
+
+# Columns of the export: one row per order line, with the details of its order repeated.
+# Each name is the OrderItem field (or the order__ lookup) it is read from.
+COLUMNS = [
+    ('order_id', 'order_id'),
+    ('created', 'order__created'),
+    ('status', 'order__status'),
+    ('email', 'order__emailAddress'),
+    ('total', 'order__total'),
+    ('billing_name', 'order__billingName'),
+    ('billing_country', 'order__billingCountry'),
+    ('shipping_name', 'order__shippingName'),
+    ('shipping_address', 'order__shippingAddress1'),
+    ('shipping_city', 'order__shippingCity'),
+    ('shipping_postcode', 'order__shippingPostcode'),
+    ('shipping_country', 'order__shippingCountry'),
+    ('product', 'product'),
+    ('quantity', 'quantity'),
+    ('price', 'price'),
+]
+
+FORMATS = ('csv', 'jsonl')
+
+
+def _midnight(day):
+    # The start of a day in the current time zone.
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+
+
+def order_lines(start=None, end=None, country=None, status=None):
+    """
+    The order lines to export, joined with their orders.
+
+    Args:
+    start (date): First day of the orders to include, in the current time zone.
+    end (date): Last day of the orders to include (inclusive).
+    country (str): Shipping country of the orders to include.
+    status (str): Payment state of the orders to include.
+
+    Returns:
+    QuerySet: Tuples of the values of COLUMNS, oldest order first, following the index on
+    the order date and the one on the lines' order.
+    """
+    lines = OrderItem.objects.all()
+    if start:
+        lines = lines.filter(order__created__gte=_midnight(start))
+    if end:
+        lines = lines.filter(order__created__lt=_midnight(end + datetime.timedelta(days=1)))
+    if country:
+        lines = lines.filter(order__shippingCountry__iexact=country)
+    if status:
+        lines = lines.filter(order__status=status)
+    return lines.order_by('order__created', 'order_id', 'id').values_list(*[lookup for _, lookup in COLUMNS])
+
+
+def export_rows(lines, chunk_size=2000):
+    """
+    Yield the order lines as export rows, streaming them from the database.
+
+    iterator() reads the rows through a server-side cursor on PostgreSQL (and in chunks of
+    fetchmany() elsewhere) without caching them on the queryset, so only one chunk is ever
+    held in memory, however many lines are exported.
+
+    Returns:
+    generator: Dicts of column name to value, with the order date in the current time zone.
+    """
+    names = [name for name, _ in COLUMNS]
+    for values in lines.iterator(chunk_size=chunk_size):
+        row = dict(zip(names, values))
+        row['created'] = timezone.localtime(row['created']).isoformat()
+        yield row
+
+
+class _Line:
+    # A file-like object that hands back what csv.writer writes, rather than buffering it.
+    def write(self, value):
+        return value
+
+
+def render_rows(format, rows):
+    """
+    Render export rows in the given format, one line of text at a time (the CSV header first).
+
+    Used both for a StreamingHttpResponse, which sends each line as it is rendered, and for
+    writing an export to a file.
+    """
+    if format == 'csv':
+        writer = csv.writer(_Line())
+        yield writer.writerow([name for name, _ in COLUMNS])
+        for row in rows:
+            yield writer.writerow(row.values())
+    else:
+        for row in rows:
+            # Prices are written as strings, so they keep their exact decimal value.
+            yield json.dumps(row, default=str, ensure_ascii=False) + '\n'
@@ -0,0 +1,95 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+
+
+def encode_cursor(product):
+    # Opaque, URL-safe token holding the (name, id) sort key of a product.
+    raw = json.dumps([product.name, product.pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    # Returns the (name, id) sort key held by a token, or None if the token is invalid.
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        name, pk = json.loads(raw)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if not isinstance(name, str) or not isinstance(pk, int):
+        return None
+    return name, pk
+
+
+class KeysetPage:
+    """
+    One page of a listing paginated by keyset (seek) rather than by OFFSET.
+
+    Iterating the page yields its products. next_cursor and previous_cursor are the tokens
+    for the 'after' and 'before' query parameters of the neighbouring pages, or None.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_page(queryset, params, per_page):
+    """
+    Return the page of a product queryset selected by the 'after'/'before' cursor parameters.
+
+    Products are ordered by (name, id). Instead of skipping rows with OFFSET, the page is
+    found with a seek predicate on that key, which the database answers from an index in
+    constant time however deep the page is, and no COUNT(*) is run. The predicate leads
+    with a plain range on name (name >= cursor name) so that the index range scan starts
+    at the cursor even on databases that can't seek on an OR of conditions.
+
+    Args:
+    queryset (QuerySet): The products to paginate.
+    params (QueryDict): The request's GET parameters.
+    per_page (int): Number of products per page.
+
+    Returns:
+    KeysetPage: The products of the page and the cursors of its neighbours.
+    """
+    after = decode_cursor(params.get('after', ''))
+    before = decode_cursor(params.get('before', '')) if after is None else None
+
+    if before is not None:
+        # Walking backwards: take the products just before the cursor, in reverse order.
+        name, pk = before
+        rows = list(queryset.filter(Q(name__lte=name) & (Q(name__lt=name) | Q(pk__lt=pk)))
+                    .order_by('-name', '-pk')[:per_page + 1])
+        has_previous = len(rows) > per_page
+        products = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            name, pk = after
+            queryset = queryset.filter(Q(name__gte=name) & (Q(name__gt=name) | Q(pk__gt=pk)))
+        # One extra row tells whether there is a next page.
+        rows = list(queryset.order_by('name', 'pk')[:per_page + 1])
+        has_next = len(rows) > per_page
+        products = rows[:per_page]
+        has_previous = after is not None
+
+    return KeysetPage(
+        products,
+        next_cursor=encode_cursor(products[-1]) if has_next and products else None,
+        previous_cursor=encode_cursor(products[0]) if has_previous and products else None,
+    )
@@ -0,0 +1,114 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+import stripe
+
+from .checkout import release_stock
+from .models import Order
+from .sales import roll_up_after_payment
+
+logger = logging.getLogger(__name__)
+
+# Description for the Stripe charges.
+CHARGE_DESCRIPTION = 'Z-Store - New Order'
+
+
+def _configure_stripe():
+    # Setting Stripe's secret key and API endpoint (which points at a local stand-in in tests).
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+
+
+def create_charge(email, token, total, idempotency_key):
+    """
+    Create the Stripe customer and charge for a checkout.
+
+    Both calls carry an idempotency key derived from the checkout's key, so retrying a
+    checkout (or processing the same pending order twice) never charges the card twice.
+
+    Args:
+    email (str): Customer's email address.
+    token (str): Card token collected by Stripe Checkout.
+    total (Decimal): Amount to charge, in dollars.
+    idempotency_key (str): Key identifying the checkout attempt.
+
+    Returns:
+    stripe.Charge: The created charge.
+    """
+    _configure_stripe()
+    customer = stripe.Customer.create(
+        email=email,
+        source=token,
+        idempotency_key='%s-customer' % idempotency_key
+    )
+    return stripe.Charge.create(
+        # Converting the total amount to cents for Stripe processing.
+        amount=int(total * 100),
+        currency='usd',
+        description=CHARGE_DESCRIPTION,
+        customer=customer.id,
+        idempotency_key='%s-charge' % idempotency_key
+    )
+
+
+def refund_charge(charge_id, idempotency_key):
+    # Give the money of a charge back, e.g. when the order could not be placed after all.
+    _configure_stripe()
+    return stripe.Refund.create(charge=charge_id, idempotency_key='%s-refund' % idempotency_key)
+
+
+def process_order(order_id):
+    """
+    Charge a pending order and record the outcome.
+
+    The order row is locked while it is being charged, and workers skip orders another
+    worker has locked. Card errors fail the order and release its stock; other Stripe
+    errors (network problems, outages) leave it pending so it is retried later.
+
+    Returns:
+    Order or None: The processed order, or None if it was not pending (or is being
+    processed by another worker).
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update(skip_locked=True).filter(
+            pk=order_id, status=Order.PENDING).first()
+        if order is None:
+            return None
+
+        try:
+            charge = create_charge(order.emailAddress, order.token, order.total, order.idempotency_key)
+        except stripe.error.CardError as e:
+            order.status = Order.FAILED
+            order.payment_error = (e.user_message or str(e))[:500]
+            release_stock(order)
+        except stripe.error.StripeError:
+            logger.exception('Payment of order %s failed, will retry', order.pk)
+            return None
+        else:
+            order.status = Order.PAID
+            order.charge_id = charge.id
+
+        # Saved with update() so the order's auto_now 'created' date isn't moved.
+        Order.objects.filter(pk=order.pk).update(
+            status=order.status, charge_id=order.charge_id, payment_error=order.payment_error)
+        if order.status == Order.PAID:
+            roll_up_after_payment(order.pk)
+    return order
+
+
+def process_pending_orders(limit=100):
+    """
+    Process up to 'limit' pending orders, oldest first.
+
+    Returns:
+    dict: Number of orders that were paid and that failed.
+    """
+    processed = {Order.PAID: 0, Order.FAILED: 0}
+    pending = Order.objects.filter(status=Order.PENDING, idempotency_key__isnull=False) \
+        .order_by('id').values_list('id', flat=True)[:limit]
+    for order_id in list(pending):
+        order = process_order(order_id)
+        if order is not None:
+            processed[order.status] += 1
+    return processed
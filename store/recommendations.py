@@ -0,0 +1,159 @@
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cache import RECOMMENDATIONS_TAG, bump_tags
+from .models import Order, OrderItem, Product, Recommendation
+
+
+def load_order_lines(chunk_size=10000):
+    """
+    Read the products of every paid order into two parallel arrays.
+
+    The lines are streamed from the database and appended chunk by chunk, so memory holds
+    the arrays (16 bytes per line) rather than millions of Python tuples.
+
+    Returns:
+    tuple: Arrays of the order IDs and the product IDs, one entry per order line.
+    """
+    lines = OrderItem.objects.filter(order__status=Order.PAID, catalog_product__isnull=False) \
+        .order_by().values_list('order_id', 'catalog_product_id')
+    chunks, chunk = [], []
+    for line in lines.iterator(chunk_size=chunk_size):
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            chunks.append(np.array(chunk, dtype=np.int64))
+            chunk = []
+    if chunk:
+        chunks.append(np.array(chunk, dtype=np.int64))
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    lines = np.concatenate(chunks)
+    return lines[:, 0], lines[:, 1]
+
+
+def co_occurrence(order_ids, product_ids, recommendable_ids, top=8, max_order_size=50):
+    """
+    Count how many orders include each pair of products and keep the top pairs per product.
+
+    Every step is a NumPy array operation, so the cost is a few sorts of arrays as long as
+    the number of pairs, with no Python loop over orders or products:
+
+    1. The order lines are deduplicated into (order, product) keys, sorted by order.
+    2. Each order of n products is expanded into its n * (n - 1) ordered pairs, by
+       repeating each line n times and pairing the copies with the lines of its order.
+    3. Identical pairs are counted with np.unique: a sparse count, of the pairs that occur only.
+    4. The pairs are sorted by product, count (descending) and recommended product, and
+       the first 'top' of each product are kept.
+
+    Args:
+    order_ids (ndarray): Order ID of each order line.
+    product_ids (ndarray): Product ID of each order line.
+    recommendable_ids (ndarray): IDs of the products that may be recommended (e.g. available ones).
+    top (int): Number of recommendations kept per product.
+    max_order_size (int): Orders of more distinct products than this (bulk purchases) are
+        left out; they say little about what goes together and cost n² pairs.
+
+    Returns:
+    tuple: Arrays of the product IDs, recommended product IDs, ranks and counts.
+    """
+    if not len(order_ids):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    # Number the products 0..n-1, so a pair of products fits in one int64 key.
+    products, product_index = np.unique(product_ids, return_inverse=True)
+    n = len(products)
+    keys = np.unique(order_ids * n + product_index)
+    orders, items = keys // n, keys % n
+
+    # The lines of each order are consecutive: the first position and size of its order, per
+    # line. Positions are int32, halving the memory of the pair arrays below.
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]]).astype(np.int32)
+    sizes = np.diff(np.r_[starts, len(orders)]).astype(np.int32)
+    line_start, line_size = np.repeat(starts, sizes), np.repeat(sizes, sizes)
+    del keys, orders, starts, sizes
+
+    # Pair each line with every line of its order (itself included, dropped below).
+    lines = np.flatnonzero((line_size > 1) & (line_size <= max_order_size)).astype(np.int32)
+    partners = line_size[lines]
+    left = np.repeat(lines, partners)
+    right = np.arange(len(left), dtype=np.int32)
+    right -= np.repeat(np.cumsum(partners, dtype=np.int32) - partners, partners)
+    right += np.repeat(line_start[lines], partners)
+    distinct = left != right
+    first, second = items[left[distinct]], items[right[distinct]]
+    del left, right, distinct, lines, partners, line_start, line_size
+
+    # Only recommend products that may be shown.
+    allowed = np.isin(products, recommendable_ids)[second]
+    pair_keys, counts = np.unique(first[allowed] * n + second[allowed], return_counts=True)
+    first, second = pair_keys // n, pair_keys % n
+
+    # Best pairs of each product first; ties go to the lowest product ID.
+    order = np.lexsort((second, -counts, first))
+    first, second, counts = first[order], second[order], counts[order]
+    group_starts = np.flatnonzero(np.r_[True, first[1:] != first[:-1]])
+    ranks = np.arange(len(first)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(first)]))
+    kept = ranks < top
+    return products[first[kept]], products[second[kept]], ranks[kept], counts[kept]
+
+
+def save_recommendations(product_ids, recommended_ids, ranks, scores, batch_size=5000):
+    """
+    Replace the stored recommendations with new ones, a range of products at a time.
+
+    The rows of each range of product IDs are deleted and inserted in one short transaction,
+    so product pages never see a product without recommendations while the table is
+    rewritten, and the write lock is only held for one range at a time.
+
+    Args:
+    product_ids, recommended_ids, ranks, scores (ndarray): The recommendations, sorted by product.
+    batch_size (int): Number of products per range.
+
+    Returns:
+    int: Number of rows written.
+    """
+    last_pk = Product.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    # Rows are inserted with executemany() rather than bulk_create(), whose per-object work
+    # would take most of the build's time at millions of rows.
+    quote_name = connection.ops.quote_name
+    columns = [Recommendation._meta.get_field(name).column for name in ('product', 'recommended', 'rank', 'score')]
+    sql = 'INSERT INTO %s (%s) VALUES (%%s, %%s, %%s, %%s)' % (
+        quote_name(Recommendation._meta.db_table), ', '.join(quote_name(column) for column in columns))
+    # The first row of each range, found by binary search in the sorted product IDs.
+    bounds = list(range(0, last_pk + 1, batch_size)) + [last_pk + 1]
+    positions = np.searchsorted(product_ids, bounds)
+    for start, end, first, last in zip(bounds, bounds[1:], positions, positions[1:]):
+        rows = list(zip(product_ids[first:last].tolist(), recommended_ids[first:last].tolist(),
+                        ranks[first:last].tolist(), scores[first:last].tolist()))
+        with transaction.atomic():
+            Recommendation.objects.filter(product__gte=start, product__lt=end).delete()
+            if rows:
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, rows)
+    return len(product_ids)
+
+
+def build(top=None, max_order_size=None):
+    """
+    Rebuild the "Customers also bought" recommendations from the history of paid orders.
+
+    Args:
+    top (int): Recommendations kept per product (STORE_RECOMMENDATIONS_COUNT by default).
+    max_order_size (int): Larger orders are left out (STORE_RECOMMENDATIONS_MAX_ORDER_SIZE by default).
+
+    Returns:
+    tuple: Number of order lines read and of recommendations written.
+    """
+    top = top or settings.STORE_RECOMMENDATIONS_COUNT
+    max_order_size = max_order_size or settings.STORE_RECOMMENDATIONS_MAX_ORDER_SIZE
+    order_ids, product_ids = load_order_lines()
+    recommendable = np.fromiter(Product.objects.filter(available=True).values_list('pk', flat=True).iterator(),
+                                dtype=np.int64)
+    recommendations = co_occurrence(order_ids, product_ids, recommendable, top, max_order_size)
+    written = save_recommendations(*recommendations)
+    # The product pages show the recommendations: purge their cached copies, in every web
+    # worker, since the tag versions live in the shared cache (see store.checks).
+    bump_tags(RECOMMENDATIONS_TAG)
+    return len(order_ids), written
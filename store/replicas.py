@@ -0,0 +1,134 @@
+import contextlib
+from contextvars import ContextVar
+from functools import wraps
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# App label of the rows of Django's database cache backend.
+CACHE_APP_LABEL = 'django_cache'
+
+# The replica the reads of the current block go to, and the depth of transactions on the
+# primary when the block started (see reading_replicas()); None outside such a block.
+_replica = ContextVar('store_replica', default=None)
+# The request being handled: whether it is pinned to the primary, and whether it wrote.
+_request = ContextVar('store_replica_request', default=None)
+
+
+def _atomic_depth():
+    return len(connections[DEFAULT_DB_ALIAS].atomic_blocks)
+
+
+def is_pinned():
+    # Whether the current request must read from the primary (see ReplicaMiddleware).
+    state = _request.get()
+    return state is not None and state['pinned']
+
+
+@contextlib.contextmanager
+def reading_replicas():
+    """
+    Send the reads made within the block to one of the replicas (STORE_REPLICA_DATABASES).
+
+    One replica is picked for the whole block, so the page it builds is read from a single
+    snapshot. Reads stay on the primary when there are no replicas, when the request is
+    pinned to the primary because it wrote recently, and inside transactions opened within
+    the block, which must see their own writes.
+    """
+    if not settings.STORE_REPLICA_DATABASES or is_pinned() or _replica.get() is not None:
+        yield
+        return
+    token = _replica.set((random.choice(settings.STORE_REPLICA_DATABASES), _atomic_depth()))
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def reading_from_replica():
+    """
+    Return the replica alias the reads made here go to, or None when they go to the primary.
+    """
+    current = _replica.get()
+    if current is None or _atomic_depth() != current[1]:
+        return None
+    return current[0]
+
+
+def use_replica(view):
+    """
+    View decorator reading from a replica for GET and HEAD requests.
+
+    For the read-only catalog views; other methods (e.g. posting a review) read from the
+    primary throughout, like every undecorated view.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with reading_replicas():
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Database router sending the reads made in reading_replicas() to a replica, and all
+    other reads and every write to the primary ('default').
+
+    The replicas are read-only copies of the primary: they are never migrated (the
+    replication copies the schema), and objects read from them may be related to and saved
+    with objects of the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        # The database cache is always read from the primary: a replica's copy of the version
+        # stamps would lag behind the changes they track.
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        return reading_from_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Remember that the request wrote, for ReplicaMiddleware to pin it to the primary.
+        # Storing a page or a menu in the database cache isn't a change the visitor made.
+        state = _request.get()
+        if state is not None and model._meta.app_label != CACHE_APP_LABEL:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.STORE_REPLICA_DATABASES:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Pin a visitor to the primary for STORE_REPLICA_LAG_SECONDS after one of their requests
+    wrote to the database, so they read their own writes (the cart they filled, the review
+    they posted, their new account) rather than a replica that may not have them yet.
+
+    The pin is a short-lived cookie rather than a session value, so it costs no session load
+    and covers visitors without a session too. The middleware comes before SessionMiddleware,
+    so a session saved at the end of the request counts as a write.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = {'pinned': settings.STORE_REPLICA_COOKIE_NAME in request.COOKIES, 'wrote': False}
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        if state['wrote'] and settings.STORE_REPLICA_DATABASES:
+            response.set_cookie(settings.STORE_REPLICA_COOKIE_NAME, '1', max_age=settings.STORE_REPLICA_LAG_SECONDS,
+                                secure=request.is_secure(), httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,125 @@
+import logging
+from decimal import Decimal
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+# The rollup tables, with the columns (besides the day) their rows are keyed by.
+ROLLUPS = [
+    (DailySales, None),
+    (DailyProductSales, 'product'),
+    (DailyCategorySales, 'category'),
+]
+
+
+def roll_up(order_ids):
+    """
+    Add paid orders to the daily sales rollups, each order once.
+
+    The orders are locked while they are added, so an order rolled up at payment time and
+    by the catch-up command at the same moment is only counted once; orders that are not
+    paid, or already rolled up, are left alone. Each order counts on the day it was placed.
+
+    Args:
+    order_ids (list): IDs of the orders to add.
+
+    Returns:
+    int: Number of orders added.
+    """
+    with transaction.atomic():
+        orders = Order.objects.select_for_update() \
+            .filter(pk__in=order_ids, status=Order.PAID, rolled_up=False).values_list('pk', 'created')
+        days = {order_id: timezone.localdate(created) for order_id, created in orders}
+        if not days:
+            return 0
+
+        # Add up the lines of the orders per rollup row: {model: {(day, key): [revenue, units, order IDs]}}.
+        totals = {model: {} for model, _ in ROLLUPS}
+        lines = OrderItem.objects.filter(order__in=list(days)) \
+            .values_list('order_id', 'catalog_product_id', 'catalog_product__category_id', 'quantity', 'price')
+        for order_id, product_id, category_id, quantity, price in lines:
+            day = days[order_id]
+            for model, key in ((DailySales, None), (DailyProductSales, product_id), (DailyCategorySales, category_id)):
+                total = totals[model].setdefault((day, key), [Decimal(0), 0, set()])
+                total[0] += quantity * price
+                total[1] += quantity
+                total[2].add(order_id)
+
+        for model, key_field in ROLLUPS:
+            _add_totals(model, key_field, totals[model])
+        Order.objects.filter(pk__in=list(days)).update(rolled_up=True)
+    return len(days)
+
+
+def _add_totals(model, key_field, totals):
+    # Add the totals to the rows of a rollup table with one INSERT ... ON CONFLICT DO UPDATE:
+    # existing rows are added to and missing ones created without reading any of them, and
+    # the database serializes concurrent roll-ups adding to the same row. (Rows without a
+    # key, for deleted products or categories, never conflict; they are summed like the others.)
+    # bulk_update() would build a CASE expression per row, costing more than the writes.
+    if not totals:
+        return
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in ['day'] + ([key_field] if key_field else [])]
+    value_fields = [model._meta.get_field(name) for name in ('revenue', 'units', 'orders')]
+    table = quote_name(model._meta.db_table)
+    sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s' % (
+        table,
+        ', '.join(quote_name(field.column) for field in fields + value_fields),
+        ', '.join(['%s'] * (len(fields) + len(value_fields))),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join('{0} = {1}.{0} + excluded.{0}'.format(quote_name(field.column), table) for field in value_fields),
+    )
+    rows = []
+    # In a fixed order, so concurrent roll-ups lock the rows they share in the same order.
+    for (day, key), (revenue, units, order_ids) in sorted(totals.items(), key=_row_order):
+        values = [day] + ([key] if key_field else []) + [revenue, units, len(order_ids)]
+        rows.append(tuple(field.get_db_prep_save(value, connection)
+                          for field, value in zip(fields + value_fields, values)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _row_order(item):
+    # Sort key of a rollup row's totals: its day, then its key (empty keys first).
+    (day, key), _ = item
+    return day, key or 0
+
+
+def roll_up_after_payment(order_id):
+    """
+    Add an order to the rollups once the transaction that paid it commits.
+
+    A failure is only logged: the order is left for manage.py rollup_sales, and the
+    checkout goes on.
+    """
+    def run():
+        try:
+            roll_up([order_id])
+        except DatabaseError:
+            logger.exception('Adding order %s to the sales rollups failed; rollup_sales will add it', order_id)
+    transaction.on_commit(run)
+
+
+def catch_up(batch_size=500):
+    """
+    Add the paid orders that are not in the rollups yet, in batches of orders.
+
+    Only those orders are read, through an index of them, however many orders were rolled up
+    before; run it after loading old orders, or to add orders whose roll-up at payment time failed.
+
+    Returns:
+    int: Number of orders added.
+    """
+    added, last_pk = 0, 0
+    pending = Order.objects.filter(status=Order.PAID, rolled_up=False)
+    while True:
+        order_ids = list(pending.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not order_ids:
+            return added
+        added += roll_up(order_ids)
+        last_pk = order_ids[-1]
@@ -0,0 +1,220 @@
+import re
+
+from django.db import connection, connections, router
+
+from .models import Product
+
+# The index tables are created by the 0008_product_search_index migration.
+# SQLite: FTS5 virtual table whose rowid is the product ID.
+SQLITE_TABLE = 'store_product_fts'
+# PostgreSQL: table of tsvector documents keyed by product ID, with a GIN index.
+POSTGRES_TABLE = 'store_product_search'
+
+# Relative weight of matches in the name, description and category name (SQLite bm25).
+SQLITE_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def _terms(query):
+    # Split the query into plain word tokens, dropping any search syntax characters.
+    return re.findall(r'\w+', query.lower())
+
+
+class SqliteBackend:
+    """
+    Product search on SQLite's FTS5 extension, ranked with bm25().
+    """
+
+    def match(self, query):
+        # Every term must match, as a word prefix, so results narrow down as the query grows.
+        return ' '.join('"%s"*' % term for term in _terms(query))
+
+    def count(self, cursor, query):
+        cursor.execute('SELECT COUNT(*) FROM %s WHERE %s MATCH %%s' % (SQLITE_TABLE, SQLITE_TABLE),
+                       [self.match(query)])
+        return cursor.fetchone()[0]
+
+    def ranked_ids(self, cursor, query, offset, limit):
+        cursor.execute(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY bm25(%s, %s, %s, %s), rowid LIMIT %%s OFFSET %%s'
+            % ((SQLITE_TABLE, SQLITE_TABLE, SQLITE_TABLE) + SQLITE_WEIGHTS),
+            [self.match(query), limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def remove(self, cursor, product_ids):
+        cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (SQLITE_TABLE, ', '.join(['%s'] * len(product_ids))),
+                       list(product_ids))
+
+    def index(self, cursor, product_ids):
+        # Replace the entries of the given products with their current text; unavailable
+        # products are left out of the index.
+        self.remove(cursor, product_ids)
+        cursor.execute(
+            'INSERT INTO %s (rowid, name, description, category) '
+            'SELECT p.id, p.name, p.description, c.name FROM store_product p '
+            'INNER JOIN store_category c ON c.id = p.category_id '
+            'WHERE p.available AND p.id IN (%s)' % (SQLITE_TABLE, ', '.join(['%s'] * len(product_ids))),
+            list(product_ids)
+        )
+
+    def rebuild(self, cursor):
+        cursor.execute('DELETE FROM %s' % SQLITE_TABLE)
+        cursor.execute(
+            'INSERT INTO %s (rowid, name, description, category) '
+            'SELECT p.id, p.name, p.description, c.name FROM store_product p '
+            'INNER JOIN store_category c ON c.id = p.category_id WHERE p.available' % SQLITE_TABLE
+        )
+
+
+class PostgresBackend:
+    """
+    Product search on a weighted tsvector column with a GIN index, ranked with ts_rank_cd().
+    """
+
+    # Weighted document: name (A), category name (B) and description (C).
+    DOCUMENT = (
+        "setweight(to_tsvector('english', p.name), 'A') || "
+        "setweight(to_tsvector('english', c.name), 'B') || "
+        "setweight(to_tsvector('english', p.description), 'C')"
+    )
+
+    def tsquery(self, query):
+        # Every term must match, as a word prefix.
+        return ' & '.join('%s:*' % term for term in _terms(query))
+
+    def count(self, cursor, query):
+        cursor.execute("SELECT COUNT(*) FROM %s WHERE document @@ to_tsquery('english', %%s)" % POSTGRES_TABLE,
+                       [self.tsquery(query)])
+        return cursor.fetchone()[0]
+
+    def ranked_ids(self, cursor, query, offset, limit):
+        cursor.execute(
+            "SELECT product_id FROM %s, to_tsquery('english', %%s) query WHERE document @@ query "
+            "ORDER BY ts_rank_cd(document, query) DESC, product_id LIMIT %%s OFFSET %%s" % POSTGRES_TABLE,
+            [self.tsquery(query), limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def remove(self, cursor, product_ids):
+        cursor.execute('DELETE FROM %s WHERE product_id = ANY(%%s)' % POSTGRES_TABLE, [list(product_ids)])
+
+    def index(self, cursor, product_ids):
+        # Upsert the documents of the given products; unavailable products are left out of the index.
+        self.remove(cursor, product_ids)
+        cursor.execute(
+            'INSERT INTO %s (product_id, document) SELECT p.id, %s FROM store_product p '
+            'INNER JOIN store_category c ON c.id = p.category_id '
+            'WHERE p.available AND p.id = ANY(%%s)' % (POSTGRES_TABLE, self.DOCUMENT),
+            [list(product_ids)]
+        )
+
+    def rebuild(self, cursor):
+        cursor.execute('TRUNCATE %s' % POSTGRES_TABLE)
+        cursor.execute(
+            'INSERT INTO %s (product_id, document) SELECT p.id, %s FROM store_product p '
+            'INNER JOIN store_category c ON c.id = p.category_id WHERE p.available'
+            % (POSTGRES_TABLE, self.DOCUMENT)
+        )
+
+
+# Search backend for each database vendor; other databases fall back to a LIKE search.
+BACKENDS = {
+    'sqlite': SqliteBackend(),
+    'postgresql': PostgresBackend(),
+}
+
+
+def get_backend(using=None):
+    return BACKENDS.get((using or connection).vendor)
+
+
+class SearchResults:
+    """
+    Lazily evaluated, relevance-ordered search results.
+
+    Supports len()/count() and slicing, so it can be handed to a Paginator: each page runs
+    one ranked query against the search index for the IDs on that page, plus one query
+    loading those products.
+    """
+
+    def __init__(self, query, backend, using='default'):
+        self.query = query
+        self.backend = backend
+        # The database the index is read from: a replica, within reading_replicas().
+        self.using = using
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            with connections[self.using].cursor() as cursor:
+                self._count = self.backend.count(cursor, self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        offset = key.start or 0
+        limit = (key.stop if key.stop is not None else self.count()) - offset
+        if limit <= 0:
+            return []
+
+        with connections[self.using].cursor() as cursor:
+            ids = self.backend.ranked_ids(cursor, self.query, offset, limit)
+
+        # Load the products of the page and put them back in ranking order.
+        products = Product.objects.using(self.using).select_related('category').in_bulk(ids)
+        return [products[product_id] for product_id in ids if product_id in products]
+
+
+def search_products(query):
+    """
+    Search the available products by name, description and category name.
+
+    Args:
+    query (str): The words searched for; each must match (as a prefix of a word).
+
+    Returns:
+    SearchResults or QuerySet: The matching products, best matches first.
+    """
+    using = router.db_for_read(Product)
+    backend = get_backend(connections[using])
+    if not _terms(query):
+        # Without search terms, list every available product.
+        return Product.objects.filter(available=True).select_related('category')
+    if backend is None:
+        # Databases without a full-text backend fall back to a (slow) substring search.
+        return Product.objects.filter(available=True, name__icontains=query).select_related('category')
+    return SearchResults(query, backend, using)
+
+
+def index_products(product_ids):
+    """
+    Bring the search index entries of the given products up to date.
+    """
+    backend = get_backend()
+    if backend is not None and product_ids:
+        with connection.cursor() as cursor:
+            backend.index(cursor, list(product_ids))
+
+
+def remove_products(product_ids):
+    """
+    Remove the given products from the search index.
+    """
+    backend = get_backend()
+    if backend is not None and product_ids:
+        with connection.cursor() as cursor:
+            backend.remove(cursor, list(product_ids))
+
+
+def rebuild_index():
+    """
+    Rebuild the whole search index from the product table.
+    """
+    backend = get_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.rebuild(cursor)
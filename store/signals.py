@@ -0,0 +1,124 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import search, suggest, thumbnails
+from .cart_storage import persist_cart
+from .cache import MENU_TAG, PRODUCTS_TAG, SUGGESTIONS_TAG, bump_tags, category_tag, product_tag
+from .models import Category, Product, Review
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    # Remember the category and availability an existing product had before this save,
+    # so moving it to another category also purges the old category's pages, and the
+    # menu's product counts are only invalidated when they can actually change.
+    instance._previous_state = None
+    if instance.pk:
+        instance._previous_state = Product.objects.filter(
+            pk=instance.pk).values_list('category_id', 'available').first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def purge_product_pages(sender, instance, **kwargs):
+    # A product change affects its own page, its category listing and the all-products listing.
+    tags = [product_tag(instance.pk), category_tag(instance.category_id), PRODUCTS_TAG]
+    previous_state = getattr(instance, '_previous_state', None)
+    if kwargs['signal'] is post_delete or previous_state != (instance.category_id, instance.available):
+        # New, deleted, moved or (un)published products change the menu's product counts.
+        tags.append(MENU_TAG)
+    if previous_state is not None and previous_state[0] != instance.category_id:
+        tags.append(category_tag(previous_state[0]))
+    bump_tags(*tags)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def purge_category_pages(sender, instance, **kwargs):
+    # Categories appear in the navbar menu of every page, as well as on their own listing;
+    # their slug is part of the URLs of the suggested products.
+    bump_tags(category_tag(instance.pk), MENU_TAG, SUGGESTIONS_TAG)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def update_review_count(sender, instance, **kwargs):
+    # Keep the product's review count up to date with one atomic UPDATE, moving its 'updated'
+    # time on so the ETags of its page and listings change. Reviews are rendered on the product
+    # page, and their count on the listings too.
+    values = {'updated': timezone.now()}
+    if kwargs['signal'] is post_delete:
+        values['review_count'] = Greatest(F('review_count') - 1, 0)
+    elif kwargs['created']:
+        values['review_count'] = F('review_count') + 1
+    Product.objects.filter(pk=instance.product_id).update(**values)
+    category_id = Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True).first()
+    bump_tags(product_tag(instance.product_id), category_tag(category_id), PRODUCTS_TAG)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    # Keep the product's full-text search entry up to date, once the change is committed.
+    transaction.on_commit(lambda: search.index_products([instance.pk]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search.remove_products([instance.pk]))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_suggestions(sender, instance, **kwargs):
+    # Apply the change to this process' type-ahead index without rebuilding it (the other
+    # processes rebuild theirs in the background).
+    deleted = kwargs['signal'] is post_delete
+    transaction.on_commit(lambda: suggest.product_changed(instance, deleted=deleted))
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    # The category name is part of the search entry of each of its products.
+    if not created:
+        product_ids = list(instance.product_set.values_list('pk', flat=True))
+        transaction.on_commit(lambda: search.index_products(product_ids))
+
+
+@receiver(post_save, sender=Product)
+def generate_product_thumbnails(sender, instance, **kwargs):
+    # Resize a newly uploaded image in the background; once its thumbnails exist they are
+    # recorded on the product, and the pages showing it are purged so they offer them.
+    if instance.image.name == instance.thumbnailed_image:
+        return
+    tags = [product_tag(instance.pk), category_tag(instance.category_id), PRODUCTS_TAG]
+    name = instance.image.name
+
+    def done():
+        thumbnails.record_thumbnails(Product, name)
+        bump_tags(*tags)
+    transaction.on_commit(lambda: thumbnails.generate_later(name, instance.image.storage, on_done=done))
+
+
+@receiver(post_save, sender=Category)
+def generate_category_thumbnails(sender, instance, **kwargs):
+    if instance.image.name == instance.thumbnailed_image:
+        return
+    name = instance.image.name
+
+    def done():
+        thumbnails.record_thumbnails(Category, name)
+        bump_tags(category_tag(instance.pk))
+    transaction.on_commit(lambda: thumbnails.generate_later(name, instance.image.storage, on_done=done))
+
+
+@receiver(user_logged_in)
+def persist_guest_cart(sender, request, user, **kwargs):
+    # Carts of signed-in customers are kept in the database: move the cart filled while
+    # browsing anonymously (in a cookie or the cache) there.
+    if request is not None:
+        persist_cart(request)
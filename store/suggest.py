@@ -0,0 +1,173 @@
+from bisect import bisect_left, insort
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .cache import SUGGESTIONS_TAG, bump_tags, tag_versions
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex:
+    """
+    In-memory index answering "names starting with..." queries.
+
+    Names are kept lower-cased in a sorted array, so a prefix query is a binary search
+    followed by a short scan, without touching the database. Entries are (key, product ID)
+    tuples, which keeps names shared by several products apart and lets a product be
+    found again by its ID when it changes.
+    """
+
+    def __init__(self, products=(), max_entries=None):
+        # products: iterable of (product ID, name, URL).
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        for product_id, name, url in products:
+            if max_entries is not None and len(self._entries) >= max_entries:
+                break
+            self._entries[product_id] = (name.lower(), name, url)
+        self._keys = sorted((key, product_id) for product_id, (key, _, _) in self._entries.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self, prefix, limit=10):
+        """
+        Return up to 'limit' (name, URL) pairs whose name starts with the prefix, in name order.
+        """
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        results = []
+        # add() and remove() change the array and the entries in place: a search holds the
+        # lock for its binary search and short scan, so it never sees them half updated.
+        with self._lock:
+            keys, entries = self._keys, self._entries
+            position = bisect_left(keys, (prefix,))
+            while position < len(keys) and len(results) < limit:
+                key, product_id = keys[position]
+                if not key.startswith(prefix):
+                    break
+                _, name, url = entries[product_id]
+                results.append((name, url))
+                position += 1
+        return results
+
+    def add(self, product_id, name, url):
+        # Add or replace the entry of a product.
+        with self._lock:
+            self._remove(product_id)
+            if self.max_entries is not None and len(self._entries) >= self.max_entries:
+                return
+            self._entries[product_id] = (name.lower(), name, url)
+            insort(self._keys, (name.lower(), product_id))
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        entry = self._entries.pop(product_id, None)
+        if entry is not None:
+            position = bisect_left(self._keys, (entry[0], product_id))
+            del self._keys[position]
+
+
+def _product_url(category_slug, product_slug):
+    # Same URL as Product.get_url(), without reversing it for each of 100k+ products.
+    return '/category/%s/%s' % (category_slug, product_slug)
+
+
+def build_index():
+    """
+    Build the suggestion index of the available products' names with a single query.
+    """
+    products = Product.objects.filter(available=True).values_list('pk', 'name', 'slug', 'category__slug')
+    return PrefixIndex(
+        ((pk, name, _product_url(category_slug, slug)) for pk, name, slug, category_slug in products.iterator()),
+        max_entries=settings.STORE_SUGGEST_MAX_NAMES,
+    )
+
+
+# The index held by this process, the SUGGESTIONS_TAG version it reflects, when that was
+# last checked and whether a newer index is being built.
+_state = {'index': None, 'version': None, 'checked': 0.0, 'rebuilding': False}
+_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Return this process' suggestion index, building it on first use.
+
+    Products changed by this process are applied to the index incrementally by the signal
+    handlers in store.signals. Changes made by other processes are noticed through the
+    SUGGESTIONS_TAG version stamp, checked at most every STORE_SUGGEST_CHECK_INTERVAL
+    seconds; the index is then rebuilt by a background thread, and requests keep being
+    answered from the current one until the new one is ready, without a query.
+    """
+    now = time.monotonic()
+    if _state['index'] is not None and now - _state['checked'] < settings.STORE_SUGGEST_CHECK_INTERVAL:
+        return _state['index']
+
+    version = tag_versions([SUGGESTIONS_TAG])[SUGGESTIONS_TAG]
+    with _lock:
+        if _state['index'] is None:
+            # Nothing to answer from in the meantime: build the first index right away.
+            _state['index'] = build_index()
+            _state['version'] = version
+        elif _state['version'] != version and not _state['rebuilding']:
+            _state['rebuilding'] = True
+            threading.Thread(target=_rebuild_in_background, args=(version,), name='suggest-index',
+                             daemon=True).start()
+        _state['checked'] = now
+    return _state['index']
+
+
+def _rebuild(version):
+    # Build a new index from the database and swap it in, as reflecting the given version.
+    try:
+        index = build_index()
+        with _lock:
+            _state['index'] = index
+            _state['version'] = version
+    except DatabaseError:
+        logger.exception('Rebuilding the suggestion index failed; the previous index is still used')
+    finally:
+        _state['rebuilding'] = False
+
+
+def _rebuild_in_background(version):
+    try:
+        _rebuild(version)
+    finally:
+        # The thread's database connection isn't closed by any request cycle.
+        connection.close()
+
+
+def warm_index():
+    """
+    Build the suggestion index ahead of the first request.
+    """
+    return get_index()
+
+
+def product_changed(product, deleted=False):
+    """
+    Apply a product change made by this process to the index, and have other processes
+    rebuild theirs.
+    """
+    bump_tags(SUGGESTIONS_TAG)
+    index = _state['index']
+    if index is None:
+        return
+    if deleted or not product.available:
+        index.remove(product.pk)
+    else:
+        index.add(product.pk, product.name, _product_url(product.category.slug, product.slug))
+    # The change has been applied, so this process' index is current with the new version.
+    _state['version'] = tag_versions([SUGGESTIONS_TAG])[SUGGESTIONS_TAG]
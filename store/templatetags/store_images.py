@@ -0,0 +1,45 @@
+from django import template
+from django.conf import settings
+from django.utils.html import format_html
+
+from store.thumbnails import thumbnail_name
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes='100vw', loading='lazy'):
+    """
+    Render an image field as a <picture> offering its WebP and JPEG thumbnails in every width,
+    so the browser downloads the smallest file that fills the space the image takes.
+
+    Args:
+    image (ImageFieldFile): The image of a product or category, e.g. product.image.
+    alt (str): Alternative text of the image.
+    sizes (str): The 'sizes' attribute: how wide the image is displayed, e.g. '250px'.
+    loading (str): 'lazy' to load the image once scrolled near, 'eager' for the main image of a page.
+
+    Returns:
+    str: The HTML of the image; a plain <img> of the original until its thumbnails exist.
+    """
+    if not image:
+        return ''
+    # Whether the thumbnails exist is recorded on the product or category, so listing pages
+    # don't ask the storage about each of their images.
+    if image.instance.thumbnailed_image != image.name:
+        return format_html('<img src="{}" alt="{}" loading="{}">', image.url, alt, loading)
+
+    widths = sorted(settings.STORE_THUMBNAIL_WIDTHS)
+
+    def srcset(extension):
+        return ', '.join('%s %dw' % (image.storage.url(thumbnail_name(image.name, width, extension)), width)
+                         for width in widths)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="{}">'
+        '</picture>',
+        srcset('webp'), sizes,
+        image.storage.url(thumbnail_name(image.name, widths[-1], 'jpeg')), srcset('jpeg'), sizes, alt, loading,
+    )
@@ -1 +1,1184 @@
-from django.test import TestCase
+import datetime
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from unittest import mock
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, router, transaction
+from django.db.models import Max, Q
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import menu, suggest, thumbnails
+from .admin import DateHierarchyQuerySet
+from .cache import MENU_TAG, SUGGESTIONS_TAG, bump_tags, tag_versions
+from .checks import check_shared_cache
+from .checkout import InsufficientStock, order_token, place_order
+from .fake_stripe import DECLINED_TOKEN, FakeStripeServer
+from .housekeeping import abandoned_carts, purge, purge_in_batches
+from .instrumentation import QueryInstrumentationMiddleware
+from .models import (Cart, CartItem, Category, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem,
+                     Product, Recommendation, Review)
+from .order_export import order_lines
+from .payments import process_order, process_pending_orders
+from .menu import SHARED_MENU_KEY, get_menu
+from .recommendations import build as build_recommendations
+from .replicas import reading_replicas
+from .sales import catch_up
+from .search import BACKENDS, get_backend, search_products
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # Pages are rendered with the plain static file names, without a collectstatic manifest.
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class StoreTestCase(TestCase):
+    """
+    Base class of the store's tests.
+    """
+
+
+class AsyncCheckoutTests(StoreTestCase):
+    """
+    Checkout with the payment processed by the background worker, against a local Stripe stand-in.
+    """
+
+    def setUp(self):
+        self.stripe = FakeStripeServer().start()
+        self.addCleanup(self.stripe.stop)
+        settings_override = override_settings(STRIPE_API_BASE=self.stripe.base_url, STORE_ASYNC_CHECKOUT=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(
+            name='Galaxy', slug='galaxy', category=category, price='10.00', stock=5)
+
+    def checkout(self, token='tok_visa', idempotency_key='checkout-1'):
+        # Put two units in the cart and submit the payment form.
+        self.client.get('/cart/add/%d' % self.product.pk)
+        self.client.get('/cart/add/%d' % self.product.pk)
+        return self.client.post('/cart', {
+            'idempotency_key': idempotency_key,
+            'stripeToken': token,
+            'stripeEmail': 'buyer@example.com',
+            'stripeBillingName': 'Buyer',
+            'stripeBillingAddressLine1': '1 Main St',
+            'stripeBillingAddressCity': 'Springfield',
+            'stripeBillingAddressZip': '12345',
+            'stripeBillingAddressCountryCode': 'US',
+            'stripeShippingName': 'Buyer',
+            'stripeShippingAddressLine1': '1 Main St',
+            'stripeShippingAddressCity': 'Springfield',
+            'stripeShippingAddressZip': '12345',
+            'stripeShippingAddressCountryCode': 'US',
+        })
+
+    def test_checkout_records_pending_order_without_calling_stripe(self):
+        response = self.checkout()
+        order = Order.objects.get()
+        self.assertRedirects(response, '/thankyou/%d?token=%s' % (order.pk, order_token(order.pk)),
+                             fetch_redirect_response=False)
+        self.assertEqual(order.status, Order.PENDING)
+        self.assertEqual(self.stripe.charges, {})
+        # The stock is reserved as soon as the order is recorded.
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_worker_charges_pending_order(self):
+        self.checkout()
+        self.assertEqual(process_pending_orders(), {Order.PAID: 1, Order.FAILED: 0})
+
+        order = Order.objects.get()
+        self.assertEqual(order.status, Order.PAID)
+        charge = self.stripe.charges[order.charge_id]
+        self.assertEqual(charge['amount'], 2000)
+
+        response = self.client.get('/order/%d/status' % order.pk, {'token': order_token(order.pk)})
+        self.assertEqual(response.json()['status'], Order.PAID)
+
+    def test_only_the_customer_who_placed_an_order_can_follow_it(self):
+        response = self.checkout()
+        order = Order.objects.get()
+        self.assertEqual(self.client.get(response['Location']).status_code, 200)
+        for params in ({}, {'token': order_token(order.pk + 1)}):
+            self.assertEqual(self.client.get('/thankyou/%d' % order.pk, params).status_code, 404)
+            self.assertEqual(self.client.get('/order/%d/status' % order.pk, params).status_code, 404)
+        # A customer signed in to the account the order belongs to needs no token.
+        order.user = User.objects.create_user('buyer')
+        order.save()
+        self.client.force_login(order.user)
+        self.assertEqual(self.client.get('/order/%d/status' % order.pk).status_code, 200)
+
+    def test_paid_order_goes_into_the_sales_rollups(self):
+        self.checkout()
+        with self.captureOnCommitCallbacks(execute=True):
+            process_pending_orders()
+
+        day = DailySales.objects.get()
+        self.assertEqual((day.revenue, day.units, day.orders), (Decimal('20.00'), 2, 1))
+        self.assertEqual(DailyProductSales.objects.get(product=self.product).units, 2)
+        self.assertEqual(DailyCategorySales.objects.get(category=self.product.category).orders, 1)
+        self.assertTrue(Order.objects.get().rolled_up)
+
+    def test_declined_payment_fails_order_and_releases_stock(self):
+        self.checkout(token=DECLINED_TOKEN)
+        self.assertEqual(process_pending_orders(), {Order.PAID: 0, Order.FAILED: 1})
+
+        order = Order.objects.get()
+        self.assertEqual(order.status, Order.FAILED)
+        self.assertEqual(order.payment_error, 'Your card was declined.')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_declined_payment_releases_the_stock_of_a_renamed_product(self):
+        self.checkout(token=DECLINED_TOKEN)
+        Product.objects.filter(pk=self.product.pk).update(name='Galaxy S24')
+        process_pending_orders()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_resubmitted_checkout_places_one_order(self):
+        first = self.checkout()
+        second = self.checkout()
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_reprocessing_an_order_does_not_charge_twice(self):
+        self.checkout()
+        order = Order.objects.get()
+        process_order(order.pk)
+
+        # Simulate a worker that crashed after charging but before recording the outcome.
+        Order.objects.filter(pk=order.pk).update(status=Order.PENDING)
+        process_order(order.pk)
+
+        self.assertEqual(len(self.stripe.charges), 1)
+        self.assertEqual(Order.objects.get().status, Order.PAID)
+
+
+@override_settings(STORE_CART_STORAGE='cookie')
+class CookieCartCheckoutTests(AsyncCheckoutTests):
+    """
+    The same checkout, with the anonymous shopper's cart kept in a signed cookie until checkout.
+    """
+
+    def test_filling_the_cart_writes_nothing_to_the_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/cart/add/%d' % self.product.pk)
+            self.client.get('/cart/add/%d' % self.product.pk)
+            self.client.get('/cart/remove/%d' % self.product.pk)
+        # The cache may be the database cache: its table and transactions don't count.
+        cache_table = settings.CACHES['default']['LOCATION']
+        writes = [query['sql'] for query in queries
+                  if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE')) and cache_table not in query['sql']]
+        self.assertEqual(writes, [])
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn('sessionid', self.client.cookies)
+
+    def test_cart_moves_to_the_database_at_sign_in(self):
+        self.client.get('/cart/add/%d' % self.product.pk)
+        User.objects.create_user('buyer', password='secret-password')
+        self.client.post('/account/signin/', {'username': 'buyer', 'password': 'secret-password'})
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+        self.assertEqual(self.client.cookies['cart'].value, '')
+
+
+@override_settings(STORE_CART_STORAGE='cache')
+class CacheCartCheckoutTests(CookieCartCheckoutTests):
+    """
+    The same checkout, with the anonymous shopper's cart kept in the cache until checkout.
+    """
+
+
+class SearchTests(StoreTestCase):
+    """
+    Product search on the full-text index, best matches first, a page at a time.
+    """
+
+    def setUp(self):
+        phones = Category.objects.create(name='Phones', slug='phones')
+        accessories = Category.objects.create(name='Accessories', slug='accessories')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Galaxy Case', slug='galaxy-case', category=accessories, price='5.00',
+                                   stock=5, description='Fits the S23 snugly.')
+            Product.objects.create(name='Galaxy S23', slug='galaxy-s23', category=phones, price='10.00', stock=5)
+            Product.objects.create(name='Charger', slug='charger', category=accessories, price='5.00', stock=5,
+                                   description='Charges a Galaxy in an hour.')
+            Product.objects.create(name='Galaxy Fold', slug='galaxy-fold', category=phones, price='20.00',
+                                   stock=5, available=False)
+
+    def names(self, query, start=0, stop=10):
+        return [product.name for product in search_products(query)[start:stop]]
+
+    def test_name_matches_rank_above_description_matches(self):
+        if get_backend() is None:
+            self.skipTest('No full-text index on %s' % connection.vendor)
+        names = self.names('galaxy')
+        self.assertEqual(names[-1], 'Charger')
+        self.assertEqual(sorted(names[:2]), ['Galaxy Case', 'Galaxy S23'])
+        # Every word must match, as a prefix; the category name is searched too.
+        self.assertEqual(self.names('gal phon'), ['Galaxy S23'])
+
+    def test_results_are_paginated(self):
+        with override_settings(STORE_PAGE_SIZE=2):
+            first = self.client.get('/search/', {'title': 'galaxy'})
+            second = self.client.get('/search/', {'title': 'galaxy', 'page': 2})
+        self.assertEqual(len(first.context['products']), 2)
+        self.assertEqual([product.name for product in second.context['products']], self.names('galaxy', 2, 3))
+        self.assertEqual(first.context['products'].paginator.count, 3)
+
+    def test_databases_without_an_index_fall_back_to_a_substring_search(self):
+        with mock.patch.dict(BACKENDS, clear=True):
+            results = search_products('axy')
+            self.assertEqual(sorted(product.name for product in results), ['Galaxy Case', 'Galaxy S23'])
+
+
+@override_settings(STORE_PAGE_CACHE_ENABLED=False)
+class ListingTests(StoreTestCase):
+    """
+    The product listings of home(), with offset and keyset pagination.
+    """
+
+    def setUp(self):
+        for n in range(3):
+            category = Category.objects.create(name='Category %d' % n, slug='category-%d' % n)
+            for m in range(10):
+                Product.objects.create(name='Product %d-%d' % (n, m), slug='product-%d-%d' % (n, m),
+                                       category=category, price='10.00', stock=5)
+
+    def listing_queries(self, page_size):
+        with override_settings(STORE_PAGE_SIZE=page_size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/')
+        self.assertContains(response, '/category/category-0/product-0-0')
+        return len(queries)
+
+    def assertConstantQueries(self):
+        # The first request also fills the cached menu.
+        self.listing_queries(1)
+        self.assertEqual(self.listing_queries(2), self.listing_queries(24))
+
+    @override_settings(STORE_LISTING_PAGINATION='offset')
+    def test_offset_page_queries_dont_grow_with_the_page_size(self):
+        self.assertConstantQueries()
+
+    @override_settings(STORE_LISTING_PAGINATION='cursor')
+    def test_keyset_page_queries_dont_grow_with_the_page_size(self):
+        self.assertConstantQueries()
+
+
+class MenuTests(StoreTestCase):
+    """
+    The category menu of the navbar, held in each process (store.menu).
+    """
+
+    def setUp(self):
+        cache.clear()
+        menu._menu.update(version=None, links=(), until=None, checked=0.0, local=None)
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=self.category,
+                                              price='10.00', stock=5)
+
+    def menu_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertContains(response, 'href="/category/phones"')
+        return [query['sql'] for query in queries
+                if any(name in query['sql'] for name in ('store:tag:menu', 'store:menu', 'store_category'))]
+
+    def test_warm_render_runs_no_menu_query(self):
+        self.assertTrue(self.menu_queries('/account/signin/'))
+        self.assertEqual(self.menu_queries('/account/signin/'), [])
+        self.assertEqual(self.menu_queries('/cart'), [])
+
+    def test_changes_made_by_this_process_rebuild_the_menu(self):
+        self.assertEqual(get_menu()[0].product_count, 1)
+        version = tag_versions([MENU_TAG])[MENU_TAG]
+        Category.objects.create(name='Laptops', slug='laptops')
+        self.assertGreater(tag_versions([MENU_TAG])[MENU_TAG], version)
+        self.assertEqual([link.name for link in get_menu()], ['Laptops', 'Phones'])
+        self.product.available = False
+        self.product.save()
+        self.assertEqual(get_menu()[1].product_count, 0)
+
+    def test_changes_made_by_other_processes_are_noticed_after_the_interval(self):
+        get_menu()
+        Category.objects.filter(pk=self.category.pk).update(name='Mobiles')
+        # Another process bumps the stamp in the shared cache.
+        cache.set('store:tag:' + MENU_TAG, tag_versions([MENU_TAG])[MENU_TAG] + 1, timeout=None)
+        self.assertEqual(get_menu()[0].name, 'Phones')
+        with override_settings(STORE_MENU_CHECK_INTERVAL=0):
+            self.assertEqual(get_menu()[0].name, 'Mobiles')
+
+    def test_warm_menu_command_fills_the_shared_cache(self):
+        call_command('warm_menu', stdout=io.StringIO())
+        shared = cache.get(SHARED_MENU_KEY)
+        self.assertEqual(shared['version'], tag_versions([MENU_TAG])[MENU_TAG])
+        self.assertEqual([link.slug for link in shared['links']], ['phones'])
+        # Another process starting cold uses the shared copy rather than the database.
+        menu._menu.update(version=None, links=(), until=None, checked=0.0, local=None)
+        with CaptureQueriesContext(connection) as queries:
+            get_menu()
+        self.assertFalse([query for query in queries if 'store_category' in query['sql']])
+
+
+class SuggestTests(StoreTestCase):
+    """
+    Type-ahead suggestions from the in-memory index of product names.
+    """
+
+    def setUp(self):
+        cache.clear()
+        suggest._state.update(index=None, version=None, checked=0.0, rebuilding=False)
+        self.addCleanup(suggest._state.update, index=None, version=None, checked=0.0, rebuilding=False)
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        self.galaxy = Product.objects.create(name='Galaxy S23', slug='galaxy-s23', category=self.category,
+                                             price='10.00', stock=5)
+        for name in ('galaxy Fold', 'Gadget', 'Iphone'):
+            Product.objects.create(name=name, slug=name.lower().replace(' ', '-'), category=self.category,
+                                   price='10.00', stock=5)
+        Product.objects.create(name='Galaxy Tab', slug='galaxy-tab', category=self.category, price='10.00',
+                               stock=5, available=False)
+
+    def test_names_starting_with_the_prefix_in_name_order(self):
+        response = self.client.get('/search/suggest', {'q': 'GAL'})
+        self.assertEqual(response.json()['results'], [
+            {'name': 'galaxy Fold', 'url': '/category/phones/galaxy-fold'},
+            {'name': 'Galaxy S23', 'url': '/category/phones/galaxy-s23'},
+        ])
+        self.assertEqual(suggest.get_index().search('g', limit=2), [
+            ('Gadget', '/category/phones/gadget'), ('galaxy Fold', '/category/phones/galaxy-fold')])
+        self.assertEqual(suggest.get_index().search(''), [])
+
+    def test_product_changes_are_applied_without_a_rebuild(self):
+        index = suggest.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.galaxy.name = 'Galaxy S24'
+            self.galaxy.save()
+        self.assertIs(suggest.get_index(), index)
+        self.assertEqual([name for name, _ in index.search('galaxy s')], ['Galaxy S24'])
+        # Reviews don't change the names: the index stays current.
+        version = suggest._state['version']
+        Review.objects.create(product=self.galaxy, user=User.objects.create_user('buyer'), content='Great')
+        self.assertEqual(tag_versions([SUGGESTIONS_TAG])[SUGGESTIONS_TAG], version)
+
+    def test_search_waits_for_an_update_in_progress(self):
+        index = suggest.PrefixIndex([(1, 'Galaxy', '/galaxy')])
+        results = []
+        with index._lock:
+            # An update is changing the index: a search from another thread waits for it.
+            search = threading.Thread(target=lambda: results.extend(index.search('gal')))
+            search.start()
+            search.join(0.05)
+            self.assertTrue(search.is_alive())
+            index._remove(1)
+        search.join()
+        self.assertEqual(results, [])
+
+    @mock.patch('store.suggest.threading.Thread')
+    def test_index_is_rebuilt_off_the_request_path(self, thread):
+        index = suggest.get_index()
+        # Another process made a product unavailable.
+        Product.objects.filter(pk=self.galaxy.pk).update(available=False)
+        bump_tags(SUGGESTIONS_TAG)
+        suggest._state['checked'] = 0.0
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIs(suggest.get_index(), index)
+        self.assertFalse([query for query in queries if 'store_product' in query['sql']])
+        thread.assert_called_once()
+
+        suggest._rebuild(*thread.call_args.kwargs['args'])
+        self.assertEqual([name for name, _ in suggest.get_index().search('galaxy')], ['galaxy Fold'])
+
+
+class StockReservationTests(StoreTestCase):
+    """
+    Checkout reserving stock with one conditional UPDATE, all or nothing.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.galaxy = Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00', stock=1)
+        self.case = Product.objects.create(name='Case', slug='case', category=category, price='5.00', stock=10)
+
+    def cart(self, cart_id, *lines):
+        cart = Cart.objects.create(cart_id=cart_id)
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+    def test_two_carts_racing_for_the_last_unit_place_one_order(self):
+        first, second = self.cart('first', (self.galaxy, 1)), self.cart('second', (self.galaxy, 1))
+        # Both shoppers saw the last unit in stock before either checked out.
+        first_summary, second_summary = first.summary(), second.summary()
+        place_order(first, first_summary, emailAddress='first@example.com')
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(second, second_summary, emailAddress='second@example.com')
+        self.assertEqual(raised.exception.products, ['Galaxy'])
+        self.assertEqual(Order.objects.get().emailAddress, 'first@example.com')
+        self.galaxy.refresh_from_db()
+        self.assertEqual(self.galaxy.stock, 0)
+
+    def test_failed_checkout_rolls_back_the_order_and_the_stock(self):
+        cart = self.cart('cart', (self.case, 3), (self.galaxy, 2))
+        with self.assertRaises(InsufficientStock):
+            place_order(cart, cart.summary(), emailAddress='buyer@example.com')
+        # No order rows are left behind, the cart is kept, and the case the UPDATE could
+        # reserve got its units back.
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(cart.cartitem_set.count(), 2)
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Galaxy': 1, 'Case': 10})
+
+
+class PageCacheTests(StoreTestCase):
+    """
+    Catalog pages served from the shared cache, and purged when what they show changes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=self.category,
+                                              price='10.00', stock=5)
+
+    def test_repeated_request_is_a_hit_without_queries(self):
+        self.assertEqual(self.client.get('/category/phones/galaxy')['X-Page-Cache'], 'miss')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/category/phones/galaxy')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Galaxy')
+        # Only the cache table is read.
+        self.assertFalse([query for query in queries if 'store_product' in query['sql']])
+
+    def test_saving_a_product_purges_its_pages(self):
+        self.client.get('/category/phones/galaxy')
+        self.client.get('/')
+        self.product.name = 'Galaxy S24'
+        self.product.save()
+        response = self.client.get('/category/phones/galaxy')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Galaxy S24')
+        self.assertEqual(self.client.get('/')['X-Page-Cache'], 'miss')
+
+    def test_saving_a_category_purges_the_pages_showing_the_menu(self):
+        self.client.get('/category/phones/galaxy')
+        self.category.name = 'Smartphones'
+        self.category.save()
+        response = self.client.get('/category/phones/galaxy')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Smartphones')
+
+    def test_visitors_with_a_session_or_a_cart_bypass_the_cache(self):
+        self.client.get('/')
+        for cookie in (settings.SESSION_COOKIE_NAME, settings.STORE_CART_COOKIE_NAME):
+            self.client.cookies.clear()
+            self.client.cookies[cookie] = 'abc'
+            self.assertNotIn('X-Page-Cache', self.client.get('/'))
+
+    def test_a_per_process_cache_is_refused(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['store.E001'])
+            with override_settings(STORE_PAGE_CACHE_ENABLED=False):
+                self.assertEqual(check_shared_cache(None), [])
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class ConditionalPageTests(StoreTestCase):
+    """
+    ETags of the catalog pages, and 304 Not Modified responses to conditional requests.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=self.category,
+                                              price='10.00', stock=5)
+
+    def etag(self, path='/category/phones/galaxy', client=None):
+        response = (client or self.client).get(path)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_repeated_request_with_the_etag_is_not_modified(self):
+        for path in ('/', '/category/phones', '/category/phones/galaxy'):
+            etag = self.etag(path)
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+    def test_etag_changes_when_the_product_is_updated(self):
+        etag, listing_etag = self.etag(), self.etag('/category/phones')
+        self.product.price = '12.00'
+        self.product.save()
+        self.assertNotEqual(self.etag(), etag)
+        self.assertNotEqual(self.etag('/category/phones'), listing_etag)
+
+    def test_etag_changes_when_the_menu_changes(self):
+        etag = self.etag()
+        bump_tags(MENU_TAG)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_etag_changes_when_the_cart_changes(self):
+        etag = self.etag()
+        self.client.get('/cart/add/%d' % self.product.pk)
+        changed = self.etag()
+        self.assertNotEqual(changed, etag)
+        self.assertEqual(self.client.get('/category/phones/galaxy', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.get('/cart/add/%d' % self.product.pk)
+        self.assertNotEqual(self.etag(), changed)
+
+    def test_signed_in_and_anonymous_visitors_dont_share_an_etag(self):
+        anonymous_etag = self.etag()
+        User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        User.objects.create_user('other', 'other@example.com', 'secret')
+        self.client.login(username='buyer', password='secret')
+        # A copy cached while signed out shows the wrong navbar: it is sent again in full.
+        response = self.client.get('/category/phones/galaxy', HTTP_IF_NONE_MATCH=anonymous_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], anonymous_etag)
+        # Nor do two customers.
+        other = self.client_class()
+        other.login(username='other', password='secret')
+        self.assertNotEqual(self.etag(client=other), response['ETag'])
+
+
+class CatalogImportTests(StoreTestCase):
+    """
+    The catalog import command, and the caches it purges once the feed is in.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Phones', slug='phones')
+        Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00', stock=5)
+
+    def import_feed(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as feed:
+            feed.write(content)
+        self.addCleanup(os.remove, feed.name)
+        call_command('import_catalog', 'products', feed.name, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_import_updates_products_and_purges_the_cached_pages(self):
+        self.assertEqual(self.client.get('/')['X-Page-Cache'], 'miss')
+        self.import_feed('slug,name,category,price,stock\ngalaxy,Galaxy S24,phones,12.00,5\n'
+                         'iphone,Iphone,phones,20.00,1\n')
+        self.assertEqual(Product.objects.get(slug='galaxy').price, Decimal('12.00'))
+        response = self.client.get('/')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Galaxy S24')
+        self.assertContains(response, 'Iphone')
+
+    def test_unchanged_feed_keeps_the_cached_pages(self):
+        self.client.get('/')
+        self.import_feed('slug,name,category,price,stock\ngalaxy,Galaxy,phones,10.00,5\n')
+        self.assertEqual(self.client.get('/')['X-Page-Cache'], 'hit')
+
+
+class ThumbnailTests(StoreTestCase):
+    """
+    Product images offered as thumbnails once they are generated, without asking the storage on every page.
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(media_root, 'product'))
+        Image.new('RGB', (1200, 800), 'red').save(os.path.join(media_root, 'product', 'galaxy.png'))
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00',
+                                              stock=5, image='product/galaxy.png')
+
+    def test_command_writes_and_records_the_thumbnails(self):
+        self.assertNotContains(self.client.get('/category/phones/galaxy'), '<picture>')
+        call_command('generate_thumbnails', stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.thumbnailed_image, 'product/galaxy.png')
+        self.assertContains(self.client.get('/category/phones/galaxy'), 'galaxy.250w.webp')
+
+    def test_listing_does_not_ask_the_storage_about_images(self):
+        call_command('generate_thumbnails', stdout=io.StringIO())
+        with mock.patch('django.core.files.storage.FileSystemStorage.exists') as exists:
+            response = self.client.get('/')
+        self.assertContains(response, 'galaxy.250w.webp')
+        self.assertFalse(exists.called)
+
+
+    @mock.patch('store.thumbnails.connection')
+    def test_worker_logs_database_errors_and_closes_its_connection(self, worker_connection):
+        on_done = mock.Mock(side_effect=DatabaseError('database is locked'))
+        with self.assertLogs('store.thumbnails', 'ERROR') as logs:
+            thumbnails._generate('product/galaxy.png', default_storage, on_done)
+        on_done.assert_called_once_with()
+        self.assertIn('Could not record the thumbnails of product/galaxy.png', logs.output[0])
+        worker_connection.close.assert_called_once_with()
+
+
+class SalesRollupTests(StoreTestCase):
+    """
+    Catching up the sales rollups with orders they miss, and the staff dashboard reading them.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00', stock=5)
+        for status in (Order.PAID, Order.PAID, Order.FAILED):
+            order = Order.objects.create(total='30.00', status=status)
+            OrderItem.objects.create(order=order, product='Galaxy', catalog_product=self.product, quantity=3,
+                                     price='10.00')
+
+    def test_catch_up_adds_each_paid_order_once(self):
+        self.assertEqual(catch_up(batch_size=1), 2)
+        self.assertEqual(catch_up(), 0)
+        row = DailyProductSales.objects.get()
+        self.assertEqual((row.revenue, row.units, row.orders), (Decimal('60.00'), 6, 2))
+
+    def test_dashboard_reads_the_rollups_only(self):
+        catch_up()
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/dashboard/sales')
+        self.assertContains(response, 'Galaxy')
+        tables = {table for query in queries for table in re.findall(r'FROM "(\w+)"', query['sql'])}
+        self.assertNotIn('Order', tables)
+        self.assertNotIn('OrderItem', tables)
+
+
+class RecommendationTests(StoreTestCase):
+    """
+    "Customers also bought", precomputed from the products bought together.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.products = [Product.objects.create(name=name, slug=name.lower(), category=category, price='10.00',
+                                                stock=5) for name in ('Galaxy', 'Case', 'Charger', 'Cable')]
+        galaxy, case, charger, cable = self.products
+        for status, products in ((Order.PAID, [galaxy, case, charger]), (Order.PAID, [galaxy, case]),
+                                 (Order.PAID, [galaxy, case, case]), (Order.FAILED, [galaxy, cable])):
+            order = Order.objects.create(total='10.00', status=status)
+            for product in products:
+                OrderItem.objects.create(order=order, product=product.name, catalog_product=product, quantity=1,
+                                         price='10.00')
+
+    def test_products_bought_together_most_often_come_first(self):
+        build_recommendations(top=2)
+        galaxy, case, charger, cable = self.products
+        recommended = Recommendation.objects.filter(product=galaxy).order_by('rank')
+        # The case is in three orders with the phone (once however many units), the charger in
+        # one; the cable only in an order that wasn't paid.
+        self.assertEqual([(r.recommended, r.score) for r in recommended], [(case, 3), (charger, 1)])
+        self.assertEqual(Recommendation.objects.filter(product=charger).count(), 2)
+
+    def test_product_page_shows_recommendations(self):
+        build_recommendations()
+        response = self.client.get('/category/phones/galaxy')
+        self.assertContains(response, 'Customers also bought')
+        self.assertContains(response, '/category/phones/case')
+        self.assertNotContains(response, '/category/phones/cable')
+
+    def test_rebuild_command_purges_the_cached_product_pages(self):
+        cache.clear()
+        self.assertEqual(self.client.get('/category/phones/galaxy')['X-Page-Cache'], 'miss')
+        call_command('build_recommendations', stdout=io.StringIO())
+        response = self.client.get('/category/phones/galaxy')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, '/category/phones/case')
+
+
+class ReviewTests(StoreTestCase):
+    """
+    Reviews shown a page at a time, with their count kept on the product.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00', stock=5)
+        self.reviews = [Review.objects.create(product=self.product, user=User.objects.create_user('user%d' % number),
+                                              content='Review %d' % number) for number in range(15)]
+
+    def test_review_count_follows_added_and_deleted_reviews(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 15)
+        self.reviews[0].delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 14)
+
+    @override_settings(STORE_REVIEWS_PAGE_SIZE=10)
+    def test_product_page_shows_the_newest_reviews_without_a_query_per_review(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/category/phones/galaxy')
+        self.assertContains(response, 'Reviews (15)')
+        self.assertContains(response, 'Review 14')
+        self.assertNotContains(response, 'Review 4<')
+        self.assertContains(response, '?before=%d' % self.reviews[5].id)
+        self.assertEqual(len([query for query in queries if 'auth_user' in query['sql']]), 1)
+
+    @override_settings(STORE_REVIEWS_PAGE_SIZE=10)
+    def test_more_reviews_are_loaded_as_json(self):
+        response = self.client.get('/category/phones/galaxy/reviews', {'before': self.reviews[5].id})
+        data = response.json()
+        self.assertEqual([review['content'] for review in data['reviews']], ['Review %d' % n for n in range(4, -1, -1)])
+        self.assertIsNone(data['next'])
+
+
+@override_settings(STORE_REPLICA_DATABASES=['replica'], STORE_REPLICA_LAG_SECONDS=10)
+class ReplicaTests(StoreTestCase):
+    """
+    Catalog reads sent to a replica, with visitors who just wrote reading from the primary.
+
+    The tests have no replica database: the replica picked is the default database, and
+    whether one was picked tells whether the reads were routed to it.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00', stock=5)
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        with reading_replicas():
+            self.assertEqual(Product.objects.all().db, 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+            # A transaction reads its own writes.
+            with transaction.atomic():
+                self.assertEqual(Product.objects.all().db, 'default')
+        self.assertEqual(Product.objects.all().db, 'default')
+
+    @mock.patch('store.replicas.random.choice', return_value='default')
+    def test_a_visitor_who_wrote_is_pinned_to_the_primary(self, choice):
+        response = self.client.get('/')
+        self.assertTrue(choice.called)
+        self.assertNotIn('store_primary', response.cookies)
+
+        response = self.client.get('/cart/add/%d' % self.product.pk)
+        self.assertEqual(response.cookies['store_primary']['max-age'], 10)
+        choice.reset_mock()
+        self.client.get('/category/phones/galaxy')
+        self.assertFalse(choice.called)
+
+    @mock.patch('store.replicas.random.choice', return_value='default')
+    def test_pages_read_from_the_replica_right_after_a_change_are_not_cached(self, choice):
+        bump_tags(MENU_TAG)
+        self.assertNotIn('X-Page-Cache', self.client.get('/'))
+        # The menu is only kept until the replica has caught up.
+        self.assertIsNotNone(cache.get(SHARED_MENU_KEY)['until'])
+        with override_settings(STORE_REPLICA_LAG_SECONDS=0):
+            self.assertEqual(self.client.get('/')['X-Page-Cache'], 'miss')
+            self.assertEqual(self.client.get('/')['X-Page-Cache'], 'hit')
+
+
+class OrderHistoryTests(StoreTestCase):
+    """
+    The order history of a signed-in customer, a page at a time.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        self.orders = []
+        for n in range(5):
+            order = Order.objects.create(total='10.00', emailAddress='buyer@example.com', user=self.user)
+            for m in range(3):
+                OrderItem.objects.create(order=order, product='Product %d-%d' % (n, m), quantity=1, price='10.00')
+            self.orders.append(order)
+        self.client.login(username='buyer', password='secret')
+
+    @override_settings(STORE_ORDER_HISTORY_PAGE_SIZE=2)
+    def test_orders_are_paginated_newest_first(self):
+        response = self.client.get('/order_history/')
+        self.assertEqual([order.pk for order in response.context['order_details']],
+                         [self.orders[4].pk, self.orders[3].pk])
+        self.assertContains(response, 'Page 1 of 3')
+        self.assertContains(response, '1 x Product 4-2')
+        self.assertEqual(response.context['order_details'][0].item_count, 3)
+        # Page numbers past the end show the last page.
+        response = self.client.get('/order_history/', {'page': 9})
+        self.assertEqual([order.pk for order in response.context['order_details']], [self.orders[0].pk])
+
+    def test_page_queries_dont_grow_with_the_page_size(self):
+        # The first request also fills the cached menu.
+        self.client.get('/order_history/')
+        counts = []
+        for page_size in (1, 5):
+            with override_settings(STORE_ORDER_HISTORY_PAGE_SIZE=page_size):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get('/order_history/')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_orders_placed_before_orders_had_a_customer_stay_visible(self):
+        # Before 0011_order_user, the history listed the orders placed with the account's email
+        # address; that migration links them to the account.
+        earlier = Order.objects.create(total='10.00', emailAddress='buyer@example.com')
+        stranger = Order.objects.create(total='10.00', emailAddress='stranger@example.com')
+        migration = importlib.import_module('store.migrations.0011_order_user')
+        migration.link_orders_to_users(django_apps, None)
+        response = self.client.get('/order_history/', {'page': 1})
+        self.assertIn(earlier, response.context['order_details'])
+        self.assertEqual(self.client.get('/order/%d' % earlier.pk).status_code, 200)
+        stranger.refresh_from_db()
+        self.assertIsNone(stranger.user)
+
+    def test_guest_orders_with_the_same_email_are_not_shown(self):
+        # Anyone can sign up with an email address they don't own, so signing in mustn't
+        # reveal the guest orders placed with it.
+        guest_order = Order.objects.create(total='10.00', emailAddress='thief@example.com')
+        User.objects.create_user('thief', 'thief@example.com', 'secret')
+        self.client.login(username='thief', password='secret')
+        response = self.client.get('/order_history/')
+        self.assertContains(response, 'No orders have been placed yet.')
+        guest_order.refresh_from_db()
+        self.assertIsNone(guest_order.user)
+
+
+class BenchmarkCommandTests(StoreTestCase):
+    """
+    manage.py generate_catalog and manage.py benchmark, on a tiny synthetic catalog.
+    """
+
+    def setUp(self):
+        cache.clear()
+        call_command('generate_catalog', categories=2, products=10, users=3, reviews=7, carts=4, orders=5, lines=3,
+                     batch_size=3, stdout=io.StringIO())
+
+    def test_catalog_is_generated_consistently(self):
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Cart.objects.count(), 4)
+        self.assertEqual(Order.objects.filter(user__isnull=False).count(), 5)
+        # The review counts kept on the products add up the generated reviews.
+        for product in Product.objects.all():
+            self.assertEqual(product.review_count, product.review_set.count())
+        # Order totals are the sum of their lines.
+        for order in Order.objects.all():
+            self.assertEqual(order.total, sum(item.price * item.quantity for item in order.orderitem_set.all()))
+        # The generated products can be searched for.
+        product = Product.objects.filter(available=True).first()
+        self.assertIn(product, list(search_products(product.name)[:10]))
+
+    def test_catalog_is_only_generated_once(self):
+        with self.assertRaisesMessage(CommandError, 'already generated'):
+            call_command('generate_catalog', categories=1, products=1, users=1, stdout=io.StringIO())
+
+    def test_benchmark_reports_each_view(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'report.json')
+            call_command('benchmark', requests=2, warmup=1, views=['home', 'order_history', 'signout'],
+                         output=path, stderr=io.StringIO())
+            with open(path) as report_file:
+                report = json.load(report_file)
+        self.assertEqual(report['products'], 10)
+        self.assertEqual(set(report['views']), {'home', 'order_history'})
+        self.assertEqual(report['skipped'], ['signout'])
+        for view in report['views'].values():
+            self.assertEqual(view['status'], 200)
+            self.assertGreater(view['queries'], 0)
+        with self.assertRaisesMessage(CommandError, 'Unknown URL names: nope'):
+            call_command('benchmark', views=['nope'], stderr=io.StringIO())
+
+
+@override_settings(STORE_PAGE_CACHE_ENABLED=False, STORE_INSTRUMENTATION_DUPLICATE_THRESHOLD=3)
+class InstrumentationTests(StoreTestCase):
+    """
+    The profiles of sampled requests, from QueryInstrumentationMiddleware.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00', stock=5)
+
+    @override_settings(STORE_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_requests_are_not_profiled_when_sampling_is_off(self):
+        with self.assertNoLogs('store.instrumentation'):
+            response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(STORE_INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_sampled_requests_are_profiled(self):
+        with self.assertLogs('store.instrumentation', 'INFO') as logs:
+            response = self.client.get('/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+')
+        profile = json.loads(logs.records[0].getMessage())
+        self.assertEqual(profile['view'], 'home')
+        self.assertGreater(profile['queries'], 0)
+        # The page is rendered by the timing template backend, not a patched Template class.
+        self.assertGreater(profile['template_ms'], 0)
+
+    @override_settings(STORE_INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_repeated_queries_are_reported(self):
+        def view(request):
+            for pk in range(3):
+                Product.objects.filter(pk=pk).first()
+            return HttpResponse()
+
+        middleware = QueryInstrumentationMiddleware(view)
+        with self.assertLogs('store.instrumentation', 'WARNING') as logs:
+            response = middleware(RequestFactory().get('/'))
+        self.assertIn('dupes;desc="3 repeated queries"', response['Server-Timing'])
+        [duplicate] = json.loads(logs.records[0].getMessage())['duplicates']
+        self.assertEqual(duplicate['count'], 3)
+
+
+class HousekeepingTests(StoreTestCase):
+    """
+    The purge of abandoned carts and expired sessions (store.housekeeping).
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Galaxy', slug='galaxy', category=category, price='10.00',
+                                              stock=5)
+
+    def cart(self, cart_id, days_unused=0):
+        cart = Cart.objects.create(cart_id=cart_id)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        Cart.objects.filter(pk=cart.pk).update(updated=timezone.now() - datetime.timedelta(days=days_unused))
+        return cart
+
+    @mock.patch('store.housekeeping.time.sleep')
+    def test_rows_are_deleted_in_batches(self, sleep):
+        for n in range(7):
+            self.cart('old-%d' % n)
+            # Rows no longer matching the queryset when their batch is deleted are kept.
+            self.cart('new-%d' % n)
+        with CaptureQueriesContext(connection) as queries:
+            deleted = purge_in_batches(Cart.objects.filter(cart_id__startswith='old-'), 3, 0.5)
+        self.assertEqual(deleted, {'store.Cart': 7, 'store.CartItem': 7})
+        self.assertEqual(sorted(Cart.objects.values_list('cart_id', flat=True)), ['new-%d' % n for n in range(7)])
+        # Batches of 3, 3 and 1 carts, pausing after each full batch.
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE FROM "Cart"')]), 3)
+        self.assertEqual(sleep.call_args_list, [mock.call(0.5)] * 2)
+
+    @mock.patch('store.housekeeping.time.sleep')
+    def test_exact_number_of_batches(self, sleep):
+        for n in range(6):
+            self.cart('old-%d' % n)
+        self.assertEqual(purge_in_batches(Cart.objects.all(), 3, 0), {'store.Cart': 6, 'store.CartItem': 6})
+        self.assertFalse(Cart.objects.exists())
+
+    def test_carts_unused_for_long_are_abandoned(self):
+        self.cart('unused', days_unused=31)
+        # A cart created long ago but used recently is kept.
+        recent = self.cart('recent', days_unused=2)
+        Cart.objects.filter(pk=recent.pk).update(date_added=datetime.date(2020, 1, 1))
+        # A cart keyed by a session is kept while the session is live.
+        self.cart('live-session', days_unused=31)
+        Session.objects.create(session_key='live-session', session_data='',
+                               expire_date=timezone.now() + datetime.timedelta(days=1))
+        self.cart('expired-session', days_unused=31)
+        Session.objects.create(session_key='expired-session', session_data='',
+                               expire_date=timezone.now() - datetime.timedelta(days=1))
+
+        self.assertEqual(sorted(abandoned_carts(30).values_list('cart_id', flat=True)), ['expired-session', 'unused'])
+        deleted, _ = purge(days=30, batch_size=10, pause=0)
+        self.assertEqual(deleted, {'store.Cart': 2, 'store.CartItem': 2, 'sessions.Session': 1})
+        self.assertEqual(sorted(Cart.objects.values_list('cart_id', flat=True)), ['live-session', 'recent'])
+
+    @override_settings(STORE_CART_STORAGE='database')
+    def test_changing_the_items_records_activity(self):
+        self.client.get('/cart/add/%d' % self.product.pk)
+        long_ago = timezone.now() - datetime.timedelta(days=40)
+        Cart.objects.update(updated=long_ago)
+        self.client.get('/cart/add/%d' % self.product.pk)
+        self.assertGreater(Cart.objects.get().updated, long_ago)
+        Cart.objects.update(updated=long_ago)
+        self.client.get('/cart/remove/%d' % self.product.pk)
+        self.assertGreater(Cart.objects.get().updated, long_ago)
+
+
+class LargeTableAdminTests(StoreTestCase):
+    """
+    The product and order changelists of the admin, built for tables with millions of rows.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        self.products = [
+            Product.objects.create(name=name, slug=name.lower(), category=self.category, price='10.00', stock=5)
+            for name in ('Galaxy', 'Galaxy Fold', 'Iphone', 'Pixel', 'Xperia')
+        ]
+        for n, (year, month) in enumerate([(2023, 11), (2024, 1), (2024, 1), (2024, 3)]):
+            order = Order.objects.create(total='10.00', emailAddress='buyer%d@example.com' % n)
+            Order.objects.filter(pk=order.pk).update(
+                created=timezone.make_aware(datetime.datetime(year, month, 10 + n)))
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+
+    def changelist(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    @override_settings(STORE_ADMIN_EXACT_COUNT_LIMIT=3)
+    def test_large_unfiltered_list_is_counted_from_the_estimate(self):
+        # SQLite estimates from the largest rowid, which still counts the deleted product.
+        self.products[0].delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.changelist('/admin/store/product/').result_count, 5)
+        self.assertFalse([query for query in queries if 'COUNT(*) AS "__count" FROM "store_product"' in query['sql']])
+        # Filtered lists are counted exactly.
+        self.assertEqual(self.changelist('/admin/store/product/', available__exact=1).result_count, 4)
+        self.assertEqual(self.changelist('/admin/store/product/', q='Galaxy').result_count, 1)
+
+    @override_settings(STORE_ADMIN_EXACT_COUNT_LIMIT=100)
+    def test_small_list_is_counted_exactly(self):
+        self.products[-1].delete()
+        self.assertEqual(self.changelist('/admin/store/product/').result_count, 4)
+
+    def test_product_search_by_name_prefix_slug_or_id(self):
+        def found(term):
+            return sorted(product.name for product in self.changelist('/admin/store/product/', q=term).result_list)
+        self.assertEqual(found('Galaxy'), ['Galaxy', 'Galaxy Fold'])
+        self.assertEqual(found('pixel'), ['Pixel'])
+        self.assertEqual(found(str(self.products[2].pk)), ['Iphone'])
+        # Only the beginning of the name matches.
+        self.assertEqual(found('Fold'), [])
+
+    def test_order_search_by_email_or_id(self):
+        order = Order.objects.get(emailAddress='buyer2@example.com')
+        self.assertEqual(list(self.changelist('/admin/store/order/', q='buyer2@example.com').result_list), [order])
+        self.assertEqual(list(self.changelist('/admin/store/order/', q=str(order.pk)).result_list), [order])
+        self.assertEqual(list(self.changelist('/admin/store/order/', q='buyer2').result_list), [])
+
+    def test_date_hierarchy_lists_the_periods_with_orders(self):
+        queryset = DateHierarchyQuerySet(Order)
+        self.assertEqual([date.year for date in queryset.datetimes('created', 'year')], [2023, 2024])
+        months = queryset.filter(created__year=2024).datetimes('created', 'month', order='DESC')
+        self.assertEqual([date.month for date in months], [3, 1])
+        # The changelist drills down with the same periods.
+        response = self.client.get('/admin/store/order/', {'created__year': 2024})
+        self.assertContains(response, 'created__month=1')
+        self.assertContains(response, 'created__month=3')
+        self.assertNotContains(response, 'created__month=2')
+        self.assertEqual(DateHierarchyQuerySet(Order).none().datetimes('created', 'year'), [])
+
+    def test_bulk_action_updates_the_selected_products(self):
+        selected = [self.products[0].pk, self.products[1].pk]
+        response = self.client.post('/admin/store/product/', {
+            'action': 'adjust_stock', 'amount': '-10', '_selected_action': selected,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(Product.objects.values_list('stock', flat=True)), [0, 0, 5, 5, 5])
+
+
+class OrderExportTests(StoreTestCase):
+    """
+    The streamed export of order lines, from the admin.
+    """
+
+    def setUp(self):
+        for country, total in (('US', '10.00'), ('FR', '20.00')):
+            order = Order.objects.create(total=total, emailAddress='buyer@example.com', shippingCountry=country)
+            OrderItem.objects.create(order=order, product='Galaxy', quantity=1, price=total)
+        self.client.force_login(User.objects.create_superuser('admin', password='secret-password'))
+
+    def test_export_streams_the_filtered_lines(self):
+        today = datetime.date.today().isoformat()
+        response = self.client.get('/admin/store/order/export/',
+                                   {'start': today, 'end': today, 'country': 'fr', 'format': 'jsonl'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['shipping_country'], row['price']) for row in rows], [('FR', '20.00')])
+
+    def test_csv_export_has_a_header(self):
+        response = self.client.get('/admin/store/order/export/', {'format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('order_id,created,status'))
+        self.assertEqual(len(lines), 3)
+
+
+class QueryPlanTests(StoreTestCase):
+    """
+    EXPLAIN the hot queries of store.views and fail if any of them falls back to a full table scan.
+    """
+
+    # Plan lines that read a whole table, per database vendor. An SQLite "SCAN ... USING INDEX"
+    # walks an index in order (e.g. under a LIMIT) and is not a full table scan.
+    FULL_SCAN_PATTERNS = {
+        'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING (COVERING )?INDEX)'),
+        'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+    }
+
+    def setUp(self):
+        if connection.vendor not in self.FULL_SCAN_PATTERNS:
+            self.skipTest('No query plan checks for %s' % connection.vendor)
+        if connection.vendor == 'postgresql':
+            # The test tables are tiny, so PostgreSQL would rightly prefer sequential scans;
+            # discourage them so the plan shows whether an index could be used at all.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertNoFullScan(self, queryset):
+        plan = queryset.explain()
+        scanned = self.FULL_SCAN_PATTERNS[connection.vendor].findall(plan)
+        self.assertFalse(scanned, 'Full table scan in query plan:\n%s\n%s' % (queryset.query, plan))
+
+    def assertAggregateNoFullScan(self, queryset, **aggregates):
+        # aggregate() runs at once rather than returning a queryset to EXPLAIN, so capture its SQL.
+        with CaptureQueriesContext(connection) as queries:
+            queryset.aggregate(**aggregates)
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + queries[-1]['sql'])
+            plan = '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+        scanned = self.FULL_SCAN_PATTERNS[connection.vendor].findall(plan)
+        self.assertFalse(scanned, 'Full table scan in query plan:\n%s\n%s' % (queries[-1]['sql'], plan))
+
+    def test_cart_queries(self):
+        # _cart_id() callers, add_cart(), cart_remove() and the cart item count.
+        self.assertNoFullScan(Cart.objects.filter(cart_id='abc'))
+        self.assertNoFullScan(CartItem.objects.filter(product=1, cart=1))
+        self.assertNoFullScan(CartItem.objects.filter(cart__cart_id='abc', active=True))
+        self.assertNoFullScan(CartItem.objects.filter(cart=1, active=True)
+                              .select_related('product', 'product__category').order_by('id'))
+
+    def test_order_queries(self):
+        # orderHistory(), viewOrder() and the admin search by email address.
+        self.assertNoFullScan(Order.objects.filter(user=1).order_by('-created', '-id')[:20])
+        self.assertNoFullScan(Order.objects.filter(id=1, user=1))
+        self.assertNoFullScan(Order.objects.filter(emailAddress='buyer@example.com'))
+        self.assertNoFullScan(OrderItem.objects.filter(order=1))
+        # The order export, over a date range.
+        self.assertNoFullScan(order_lines(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)))
+
+    def test_listing_queries(self):
+        # home(), for a category and for all products, with offset and keyset pagination.
+        seek = Q(name__gte='m') & (Q(name__gt='m') | Q(pk__gt=1))
+        self.assertNoFullScan(Category.objects.filter(slug='phones'))
+        self.assertNoFullScan(Product.objects.filter(category=1, available=True)[:24])
+        self.assertNoFullScan(Product.objects.filter(available=True)[:24])
+        self.assertNoFullScan(Product.objects.filter(available=True).filter(seek).order_by('name', 'pk')[:25])
+        self.assertNoFullScan(Product.objects.filter(category=1, available=True).filter(seek)
+                              .order_by('name', 'pk')[:25])
+        # The ETag validators: latest change to a category's products, or to any product.
+        self.assertAggregateNoFullScan(Product.objects.filter(category=1), last_updated=Max('updated'))
+        self.assertAggregateNoFullScan(Product.objects.all(), last_updated=Max('updated'))
+
+    def test_product_page_queries(self):
+        # productPage().
+        self.assertNoFullScan(Product.objects.filter(category__slug='phones', slug='galaxy'))
+        self.assertNoFullScan(Review.objects.filter(product=1, id__lt=100).select_related('user').order_by('-id')[:11])
+        self.assertNoFullScan(Recommendation.objects.filter(product=1, recommended__available=True)
+                              .select_related('recommended', 'recommended__category').order_by('rank'))
@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Formats of the derivatives: WebP for the browsers that support it, JPEG for the others.
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def thumbnail_name(name, width, extension):
+    """
+    Storage name of a derivative of an image, next to the original.
+
+    For example 'product/Iphone13.png' at 250px in WebP is 'product/Iphone13.250w.webp'.
+    """
+    root, _ = os.path.splitext(name)
+    return '%s.%dw.%s' % (root, width, extension)
+
+
+def thumbnails_ready(name, storage):
+    # The largest WebP derivative is written last, so once it exists they all do.
+    return storage.exists(thumbnail_name(name, max(settings.STORE_THUMBNAIL_WIDTHS), 'webp'))
+
+
+def record_thumbnails(model, name):
+    """
+    Record on the rows showing an image that its thumbnails exist.
+
+    Every row of the model with that image is updated, as many products can share one. The
+    products' 'updated' time moves on too, so the ETags of their pages change with the HTML.
+
+    Args:
+    model (Model): Category or Product.
+    name (str): Storage name of the image.
+
+    Returns:
+    int: Number of rows updated.
+    """
+    values = {'thumbnailed_image': name}
+    if any(field.name == 'updated' for field in model._meta.fields):
+        values['updated'] = timezone.now()
+    return model.objects.filter(image=name).exclude(thumbnailed_image=name).update(**values)
+
+
+def generate_thumbnails(name, storage, force=False):
+    """
+    Write the derivatives of an image: one per width of STORE_THUMBNAIL_WIDTHS and format.
+
+    Images are never scaled up; an original narrower than a width is re-encoded at its own size.
+
+    Args:
+    name (str): Storage name of the original image.
+    storage (Storage): Storage holding the image (that of the image field).
+    force (bool): Write the derivatives again even if they exist already.
+
+    Returns:
+    int: Number of files written.
+    """
+    if not name or not storage.exists(name) or (not force and thumbnails_ready(name, storage)):
+        return 0
+
+    with storage.open(name, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode != 'RGB':
+        # JPEG has no transparency: flatten transparent images onto the white background of the cards.
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+
+    written = 0
+    # Smallest first, so thumbnails_ready() only sees the set complete once the last file is in.
+    for width in sorted(settings.STORE_THUMBNAIL_WIDTHS):
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for extension in ('jpeg', 'webp'):
+            buffer = io.BytesIO()
+            resized.save(buffer, **FORMATS[extension])
+            derivative = thumbnail_name(name, width, extension)
+            # Storages pick another name rather than overwrite, so replace the file explicitly.
+            if storage.exists(derivative):
+                storage.delete(derivative)
+            storage.save(derivative, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+# Thumbnails are generated by a small pool of background threads, off the request path.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.STORE_THUMBNAIL_WORKERS,
+                                           thread_name_prefix='thumbnails')
+        return _executor
+
+
+def _generate(name, storage, on_done):
+    try:
+        generate_thumbnails(name, storage)
+        if on_done is not None and thumbnails_ready(name, storage):
+            on_done()
+    except (OSError, UnidentifiedImageError):
+        logger.exception('Could not generate the thumbnails of %s', name)
+    except DatabaseError:
+        logger.exception('Could not record the thumbnails of %s', name)
+    finally:
+        # The worker thread's database connection isn't closed by any request cycle.
+        connection.close()
+
+
+def generate_later(name, storage, on_done=None):
+    """
+    Generate the thumbnails of an image in the background, unless they exist already.
+
+    Args:
+    name (str): Storage name of the original image.
+    storage (Storage): Storage holding the image.
+    on_done (callable): Called once the thumbnails exist (right away if they already do),
+        e.g. to record them and purge cached pages.
+    """
+    if name:
+        _get_executor().submit(_generate, name, storage, on_done)
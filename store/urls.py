@@ -18,6 +18,11 @@ urlpatterns = [
     path('category/<slug:category_slug>/<slug:product_slug>',
          views.productPage, name='product_detail'),
 
+    # Product reviews URL pattern.
+    # Returns a page of a product's reviews as JSON; the product page loads more reviews from it.
+    path('category/<slug:category_slug>/<slug:product_slug>/reviews',
+         views.product_reviews, name='product_reviews'),
+
     # Add to cart URL pattern.
     # Matches URLs like '/cart/add/5' and calls the 'add_cart' view.
     # Captures the product ID as an integer to identify which product to add to the cart.
@@ -40,6 +45,10 @@ urlpatterns = [
     # Called after a successful order placement. Shows a thank you message with the order ID.
     path('thankyou/<int:order_id>', views.thanks_page, name='thanks_page'),
 
+    # Order status URL pattern.
+    # Returns the payment status of an order as JSON; polled by the thank you page.
+    path('order/<int:order_id>/status', views.order_status, name='order_status'),
+
     # Account creation/signup URL pattern.
     # When '/account/create/' is requested, it calls the 'signupView' for new user registration.
     path('account/create/', views.signupView, name='signup'),
@@ -60,7 +69,15 @@ urlpatterns = [
     # Shows the details of a specific order. Captures the order ID in the URL.
     path('order/<int:order_id>', views.viewOrder, name='order_detail'),
 
+    # Sales dashboard URL pattern.
+    # Shows staff the daily sales and the best-selling products and categories, from the rollups.
+    path('dashboard/sales', views.sales_dashboard, name='sales_dashboard'),
+
     # Search functionality URL pattern.
     # Used for searching products. Calls the 'search' view.
     path('search/', views.search, name='search'),
+
+    # Search suggestion URL pattern.
+    # Returns product names starting with the 'q' parameter as JSON, for the search box's type-ahead.
+    path('search/suggest', views.search_suggest, name='search_suggest'),
 ]
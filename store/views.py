@@ -1,6 +1,6 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Category, Product, Cart, CartItem, Order, OrderItem, Review
-from django.core.exceptions import ObjectDoesNotExist
+from .models import (Category, Product, Order, OrderItem, Review, DailySales, DailyProductSales, DailyCategorySales,
+                     Recommendation)
 import stripe
 from django.conf import settings
 from django.contrib.auth.models import Group, User
@@ -8,14 +8,34 @@ from .forms import SignUpForm
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.template.loader import get_template
+from django.db import IntegrityError
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+import datetime
+import uuid
+from .checkout import InsufficientStock, may_view_order, order_token, place_order
+from .payments import CHARGE_DESCRIPTION, create_charge, refund_charge
+from .pagination import keyset_page
+from .search import search_products
+from .suggest import get_index as get_suggestion_index
+from .cart_storage import get_cart, persist_cart
+from .replicas import use_replica
+from .cache import (MENU_TAG, PRODUCTS_TAG, RECOMMENDATIONS_TAG, cache_catalog_page, category_tag, conditional_page,
+                    product_tag, tag_page, tag_versions)
 
 
 from django.shortcuts import render, get_object_or_404
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from .models import Category, Product
 
+@use_replica
+@cache_catalog_page
 def home(request, category_slug=None):
     # Initialize variables for category and product list
     category_page = None
@@ -27,28 +47,53 @@ def home(request, category_slug=None):
         # If not found, it returns a 404 response
         category_page = get_object_or_404(Category, slug=category_slug)
 
+        # The page depends on the menu and on this category's products (for the page cache).
+        tag_page(request, MENU_TAG, category_tag(category_page.pk))
+
         # Retrieve all products in the specified category that are marked as available
         products_list = Product.objects.filter(category=category_page, available=True)
+        changed_products = Product.objects.filter(category=category_page)
     else:
+        # The page depends on the menu and on products from every category (for the page cache).
+        tag_page(request, MENU_TAG, PRODUCTS_TAG)
+
         # If no category_slug is provided, retrieve all available products
         products_list = Product.objects.all().filter(available=True)
+        changed_products = Product.objects.all()
+
+    # Each card links to its product's URL, which includes the category slug: fetch the
+    # categories with the products (for either pagination) rather than one query per card.
+    products_list = products_list.select_related('category')
+
+    # Answer conditional requests before building the page. Any change to a listed product
+    # (including it being unpublished) moves the latest 'updated' time, found with a single
+    # index lookup; removed products and new categories change the menu version instead.
+    last_updated = changed_products.aggregate(last_updated=Max('updated'))['last_updated']
+    not_modified = conditional_page(request, last_updated, _viewer_state(request))
+    if not_modified is not None:
+        return not_modified
+
+    if settings.STORE_LISTING_PAGINATION == 'cursor':
+        # Keyset pagination: seek to the page with the 'after'/'before' cursors instead of
+        # counting the products and skipping the earlier pages with OFFSET.
+        products = keyset_page(products_list, request.GET, settings.STORE_PAGE_SIZE)
+    else:
+        # Paginator is used to divide the list of products into pages
+        paginator = Paginator(products_list, settings.STORE_PAGE_SIZE)
 
-    # Paginator is used to divide the list of products into pages
-    paginator = Paginator(products_list, 4)  # Show 4 products per page
-
-    try:
-        # Try to get the page number from the request GET parameters (querystring)
-        page = int(request.GET.get('page', '1'))  # Default to page 1 if not provided
-    except ValueError:
-        # If the page number in the querystring is not an integer, default to page 1
-        page = 1
+        try:
+            # Try to get the page number from the request GET parameters (querystring)
+            page = int(request.GET.get('page', '1'))  # Default to page 1 if not provided
+        except ValueError:
+            # If the page number in the querystring is not an integer, default to page 1
+            page = 1
 
-    try:
-        # Get the products for the current page
-        products = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        # If the page number is invalid (e.g., too high), show the last page
-        products = paginator.page(paginator.num_pages)
+        try:
+            # Get the products for the current page
+            products = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            # If the page number is invalid (e.g., too high), show the last page
+            products = paginator.page(paginator.num_pages)
 
     # Render and return the response using the 'home.html' template
     # Pass the selected category and products for the current page to the template
@@ -56,16 +101,30 @@ def home(request, category_slug=None):
 
 
 
+@use_replica
+@cache_catalog_page
 def productPage(request, category_slug, product_slug):
 
     # Try-except block to handle retrieval of a single product based on category and product slugs.
     try:
         # Fetching the product from the database using both the category slug and product slug.
+        # Its number of reviews is kept on the product itself (see store.signals).
         product = Product.objects.get(category__slug=category_slug, slug=product_slug)
     except Exception as e:
         # If there is any exception (e.g., Product.DoesNotExist), it is raised further.
         raise e
 
+    # The page depends on the menu, the product and its reviews, and the recommendations (for the page cache).
+    tag_page(request, MENU_TAG, product_tag(product.pk), RECOMMENDATIONS_TAG)
+
+    # Answer conditional requests before loading the reviews and rendering the page. Adding or
+    # deleting a review moves the product's 'updated' time on.
+    not_modified = conditional_page(request, product.pk, product.updated, product.review_count,
+                                    request.GET.get('before', ''), tag_versions([RECOMMENDATIONS_TAG]),
+                                    _viewer_state(request))
+    if not_modified is not None:
+        return not_modified
+
     # Check if the request is a POST request, the user is authenticated, and the content is not empty.
     if request.method == 'POST' and request.user.is_authenticated and request.POST['content'].strip() != '':
         # Create a new Review object and save it to the database.
@@ -74,28 +133,54 @@ def productPage(request, category_slug, product_slug):
             user=request.user,  # Associate the review with the currently logged-in user.
             content=request.POST['content']  # The content of the review from the POST data.
         )
+        product.review_count += 1
 
-    # Retrieve all reviews associated with the product.
-    reviews = Review.objects.filter(product=product)
+    # Retrieve the newest page of reviews (or the page before the 'before' review), with their authors.
+    reviews, more_reviews = _review_page(product, request.GET.get('before'))
 
-    # Render and return the 'product.html' template.
-    # The context includes the product object and its associated reviews.
-    return render(request, 'product.html', {'product': product, 'reviews': reviews})
-
-
-def _cart_id(request):
+    # "Customers also bought": the precomputed recommendations, read with their products from
+    # the (product, rank) index in one query. Products made unavailable since are skipped.
+    recommendations = Recommendation.objects.filter(product=product, recommended__available=True) \
+        .select_related('recommended', 'recommended__category').order_by('rank')
 
-    # Attempt to retrieve the session key (cart ID) from the current session.
-    cart = request.session.session_key
+    # Render and return the 'product.html' template.
+    # The context includes the product object, its associated reviews and its recommendations.
+    return render(request, 'product.html', {'product': product, 'reviews': reviews, 'more_reviews': more_reviews,
+                                            'recommendations': recommendations})
+
+
+def _review_page(product, before=None):
+    # A page of a product's reviews, newest first, read from the (product, -id) index with the
+    # authors joined in the same query; reviews older than the 'before' review ID if given.
+    # Returns the reviews and the ID to pass as 'before' for the next page, or None.
+    reviews = Review.objects.filter(product=product).select_related('user').order_by('-id')
+    if before and before.isdigit():
+        reviews = reviews.filter(id__lt=int(before))
+    reviews = list(reviews[:settings.STORE_REVIEWS_PAGE_SIZE + 1])
+    if len(reviews) > settings.STORE_REVIEWS_PAGE_SIZE:
+        reviews = reviews[:settings.STORE_REVIEWS_PAGE_SIZE]
+        return reviews, reviews[-1].id
+    return reviews, None
+
+
+@use_replica
+def product_reviews(request, category_slug, product_slug):
+
+    # Return a page of the product's reviews as JSON, for the product page to load more of
+    # them without reloading: the page older than the 'before' review ID, newest first.
+    product = get_object_or_404(Product.objects.only('pk'), category__slug=category_slug, slug=product_slug)
+    reviews, more_reviews = _review_page(product, request.GET.get('before'))
+    return JsonResponse({
+        'reviews': [{'id': review.id, 'user': review.user.username, 'content': review.content}
+                    for review in reviews],
+        'next': more_reviews,
+    })
 
-    # Check if the cart variable is empty, indicating that there is no session key.
-    if not cart:
-        # Since there is no session key, create a new session.
-        # This will generate a new session key.
-        cart = request.session.create()
 
-    # Return the session key (cart ID), which is either retrieved or newly created.
-    return cart
+def _viewer_state(request):
+    # What the navbar shows about the visitor: whether (and as whom) they are signed in, and
+    # the number of items in their cart. Part of the ETag of the catalog pages.
+    return request.user.pk, get_cart(request).count()
 
 
 def add_cart(request, product_id):
@@ -103,130 +188,100 @@ def add_cart(request, product_id):
     # Retrieve the product from the database based on the provided product ID.
     product = Product.objects.get(id=product_id)
 
-    try:
-        # Attempt to retrieve the cart using the current session's cart ID.
-        cart = Cart.objects.get(cart_id=_cart_id(request))
-    except Cart.DoesNotExist:
-        # If the cart does not exist, create a new cart with the current session's cart ID.
-        cart = Cart.objects.create(cart_id=_cart_id(request))
-        cart.save()
-
-    try:
-        # Attempt to retrieve the cart item for the current product and cart.
-        cart_item = CartItem.objects.get(product=product, cart=cart)
-
-        # Check if adding another product does not exceed the stock.
-        if cart_item.quantity < cart_item.product.stock:
-            # Increment the quantity of the product in the cart.
-            cart_item.quantity += 1
-        cart_item.save()
-    except CartItem.DoesNotExist:
-        # If the cart item does not exist, create a new cart item with the product, a quantity of 1, and the cart.
-        cart_item = CartItem.objects.create(
-            product=product,
-            quantity=1,
-            cart=cart
-        )
-        cart_item.save()
+    # Add one unit of the product to the visitor's cart, wherever it is kept (see store.cart_storage).
+    get_cart(request).add(product)
 
     # Redirect to the 'cart_detail' view after adding the product to the cart.
     return redirect('cart_detail')
 
 
-def cart_detail(request, total=0, counter=0, cart_items=None):
+def cart_detail(request):
+
+    # Key identifying this checkout attempt; it travels with the payment form so that a
+    # resubmitted form maps onto the order (and the Stripe charge) it already created.
+    idempotency_key = request.POST.get('idempotency_key') or uuid.uuid4().hex
+
+    # A checkout that was already placed (e.g. the form was submitted twice) isn't placed again.
+    if request.method == 'POST':
+        existing_order = Order.objects.filter(idempotency_key=idempotency_key).first()
+        if existing_order is not None:
+            return _thanks_redirect(existing_order.id)
+
+    # Retrieve the visitor's cart, without creating a session for visitors who have no cart yet.
+    # Orders are placed from the database, so a cart kept in a cookie or the cache moves there
+    # at checkout.
+    cart = persist_cart(request) if request.method == 'POST' else get_cart(request)
+
+    # Fetch all items in the cart with their products, and the total price and item count.
+    summary = cart.summary()
+    cart_items, total, counter = summary.items, summary.total, summary.count
 
-    try:
-        # Retrieve the cart using the session's cart ID.
-        cart = Cart.objects.get(cart_id=_cart_id(request))
-        # Fetch all active items in the cart.
-        cart_items = CartItem.objects.filter(cart=cart, active=True)
-
-        # Calculate the total price and item count in the cart.
-        for cart_item in cart_items:
-            total += (cart_item.product.price * cart_item.quantity)
-            counter += cart_item.quantity
-    except ObjectDoesNotExist:
-        # If the cart does not exist, do nothing (cart remains empty).
-        pass
-
-    # Setting Stripe's secret key for payment processing.
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     # Converting the total amount to cents for Stripe processing.
     stripe_total = int(total * 100)
     # Description for the Stripe charge.
-    description = 'Z-Store - New Order'
+    description = CHARGE_DESCRIPTION
     # Stripe publishable key for the frontend.
     data_key = settings.STRIPE_PUBLISHABLE_KEY
 
+    # Error to show above the cart if the payment or the order fails.
+    error = None
+
     # Check if the request is a POST request, indicating a form submission for payment.
-    if request.method == 'POST':
+    if request.method == 'POST' and cart_items:
         try:
             # Retrieving Stripe token and billing/shipping details from the form.
-            token = request.POST['stripeToken']
-            email = request.POST['stripeEmail']
-            billingName = request.POST['stripeBillingName']
-            billingAddress1 = request.POST['stripeBillingAddressLine1']
-            billingCity = request.POST['stripeBillingAddressCity']
-            billingPostcode = request.POST['stripeBillingAddressZip']
-            billingCountry = request.POST['stripeBillingAddressCountryCode']
-            shippingName = request.POST['stripeShippingName']
-            shippingAddress1 = request.POST['stripeShippingAddressLine1']
-            shippingCity = request.POST['stripeShippingAddressCity']
-            shippingPostcode = request.POST['stripeShippingAddressZip']
-            shippingCountry = request.POST['stripeShippingAddressCountryCode']
-
-            # Creating Stripe customer and charge.
-            customer = stripe.Customer.create(email=email, source=token)
-            charge = stripe.Charge.create(
-                amount=stripe_total,
-                currency='usd',
-                description=description,
-                customer=customer.id
+            order_fields = dict(
+                token=request.POST['stripeToken'],
+                emailAddress=request.POST['stripeEmail'],
+                billingName=request.POST['stripeBillingName'],
+                billingAddress1=request.POST['stripeBillingAddressLine1'],
+                billingCity=request.POST['stripeBillingAddressCity'],
+                billingPostcode=request.POST['stripeBillingAddressZip'],
+                billingCountry=request.POST['stripeBillingAddressCountryCode'],
+                shippingName=request.POST['stripeShippingName'],
+                shippingAddress1=request.POST['stripeShippingAddressLine1'],
+                shippingCity=request.POST['stripeShippingAddressCity'],
+                shippingPostcode=request.POST['stripeShippingAddressZip'],
+                shippingCountry=request.POST['stripeShippingAddressCountryCode'],
+                idempotency_key=idempotency_key,
+                # Orders placed while signed in belong to the customer's account.
+                user=request.user if request.user.is_authenticated else None,
             )
 
+            if settings.STORE_ASYNC_CHECKOUT:
+                # Asynchronous checkout: record the order as pending (reserving its stock) and
+                # leave the Stripe calls to the payment worker (manage.py process_payments).
+                charge = None
+                order_fields['status'] = Order.PENDING
+            else:
+                # Creating Stripe customer and charge.
+                charge = create_charge(order_fields['emailAddress'], order_fields['token'], total, idempotency_key)
+                order_fields['status'] = Order.PAID
+                order_fields['charge_id'] = charge.id
+
             try:
-                # Creating an order in the database.
-                order_details = Order.objects.create(
-                    token=token,
-                    total=total,
-                    emailAddress=email,
-                    billingName=billingName,
-                    billingAddress1=billingAddress1,
-                    billingCity=billingCity,
-                    billingPostcode=billingPostcode,
-                    billingCountry=billingCountry,
-                    shippingName=shippingName,
-                    shippingAddress1=shippingAddress1,
-                    shippingCity=shippingCity,
-                    shippingPostcode=shippingPostcode,
-                    shippingCountry=shippingCountry
-                )
-
-                # Creating order items and updating stock.
-                for order_item in cart_items:
-                    OrderItem.objects.create(
-                        product=order_item.product.name,
-                        quantity=order_item.quantity,
-                        price=order_item.product.price,
-                        order=order_details
-                    )
-
-                    # Reduce the stock of the ordered product.
-                    product = Product.objects.get(id=order_item.product.id)
-                    product.stock = int(product.stock - order_item.quantity)
-                    product.save()
-
-                    # Deleting the item from the cart after adding to the order.
-                    order_item.delete()
+                # Creating the order and its items, reducing the stock and clearing the cart,
+                # all in a single transaction.
+                order_details = place_order(cart.db_cart(), summary, **order_fields)
+            except InsufficientStock as e:
+                # Another customer bought the last units while this one was paying:
+                # nothing was written, so give the money back and show the cart again.
+                if charge is not None:
+                    refund_charge(charge.id, idempotency_key)
+                error = str(e)
+            except IntegrityError:
+                # A concurrent submission of the same form placed the order first.
+                return _thanks_redirect(Order.objects.get(idempotency_key=idempotency_key).id)
+            else:
+                # The cart is now empty.
+                cart.set_count(0)
 
                 # Redirect to the thank you page after successful order placement.
-                return redirect('thanks_page', order_details.id)
-            except ObjectDoesNotExist:
-                pass
+                return _thanks_redirect(order_details.id)
 
         except stripe.error.CardError as e:
             # Handling Stripe card error.
-            return False, e
+            error = e.user_message or str(e)
 
     # Rendering the 'cart.html' template with the cart details.
     return render(request, 'cart.html', {
@@ -235,45 +290,54 @@ def cart_detail(request, total=0, counter=0, cart_items=None):
         'counter': counter,
         'data_key': data_key,
         'stripe_total': stripe_total,
-        'description': description
+        'description': description,
+        'idempotency_key': idempotency_key,
+        'error': error
     })
 
 def cart_remove(request, product_id):
 
-    # Retrieve the cart using the session's cart ID.
-    cart = Cart.objects.get(cart_id=_cart_id(request))
-
     # Fetch the product based on the provided product ID or return a 404 error if not found.
     product = get_object_or_404(Product, id=product_id)
 
-    # Retrieve the specific cart item for the given product in the user's cart.
-    cart_item = CartItem.objects.get(product=product, cart=cart)
-
-    # Check if the cart item's quantity is greater than one.
-    if cart_item.quantity > 1:
-        # If so, decrease the quantity by one.
-        cart_item.quantity -= 1
-        cart_item.save()
-    else:
-        # If the quantity is one, remove the cart item entirely.
-        cart_item.delete()
+    # Take one unit of the product out of the visitor's cart, removing it at the last one.
+    get_cart(request).remove(product)
 
     # After modifying the cart, redirect the user to the cart detail page.
     return redirect('cart_detail')
 
 
 def cart_remove_product(request, product_id):
-    cart = Cart.objects.get(cart_id=_cart_id(request))
     product = get_object_or_404(Product, id=product_id)
-    cart_item = CartItem.objects.get(product=product, cart=cart)
-    cart_item.delete()
+    get_cart(request).remove_product(product)
     return redirect('cart_detail')
 
 
+def _thanks_redirect(order_id):
+    # Redirect to the thank you page of an order just placed, with the token showing it to the guest who placed it.
+    return redirect('%s?token=%s' % (reverse('thanks_page', args=[order_id]), order_token(order_id)))
+
+
 def thanks_page(request, order_id):
-    if order_id:
-        customer_order = get_object_or_404(Order, id=order_id)
-    return render(request, 'thankyou.html', {'customer_order': customer_order})
+    customer_order = get_object_or_404(Order, id=order_id)
+    # Only the customer who placed the order may see it.
+    if not may_view_order(request, customer_order):
+        raise Http404
+    return render(request, 'thankyou.html', {'customer_order': customer_order,
+                                             'order_token': order_token(customer_order.pk)})
+
+
+def order_status(request, order_id):
+    # Payment status of an order, polled by the thank you page while the order is pending.
+    order = get_object_or_404(Order, id=order_id)
+    # Only the customer who placed the order may follow it; others can't tell it exists.
+    if not may_view_order(request, order):
+        raise Http404
+    return JsonResponse({
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'error': order.payment_error,
+    })
 
 
 def signupView(request):
@@ -358,51 +422,121 @@ def signoutView(request):
 @login_required(redirect_field_name='next', login_url='signin')
 def orderHistory(request):
 
-    # Check if the current user is authenticated. This is technically redundant due to
-    # the @login_required decorator but serves as an additional layer of verification.
-    if request.user.is_authenticated:
-        # Retrieve the user's email address.
-        email = str(request.user.email)
+    # Query the user's orders, newest first, with the number of items in each order. Their
+    # items are loaded for the whole page with one extra query, so a page costs the same
+    # handful of queries however many orders the customer has placed.
+    # A subquery rather than a join, so the paginator's COUNT(*) doesn't have to join the items.
+    order_quantities = OrderItem.objects.filter(order=OuterRef('pk')).order_by() \
+        .values('order').annotate(total=Sum('quantity')).values('total')
+    orders = Order.objects.filter(user=request.user) \
+        .annotate(item_count=Coalesce(Subquery(order_quantities), 0)) \
+        .prefetch_related('orderitem_set') \
+        .order_by('-created', '-id')
+
+    # Paginator is used to divide the orders into pages
+    paginator = Paginator(orders, settings.STORE_ORDER_HISTORY_PAGE_SIZE)
 
-        # Query the Order model for orders that match the user's email address.
-        order_details = Order.objects.filter(emailAddress=email)
+    try:
+        # Try to get the page number from the request GET parameters (querystring)
+        page = int(request.GET.get('page', '1'))  # Default to page 1 if not provided
+    except ValueError:
+        # If the page number in the querystring is not an integer, default to page 1
+        page = 1
 
-        # Printing the email and order details to the console (useful for debugging purposes).
-        print(email)
-        print(order_details)
+    try:
+        # Get the orders for the current page
+        order_details = paginator.page(page)
+    except (EmptyPage, InvalidPage):
+        # If the page number is invalid (e.g., too high), show the last page
+        order_details = paginator.page(paginator.num_pages)
 
     # Render and return the 'orders_list.html' template.
-    # Pass the retrieved order details to the template.
+    # Pass the orders of the current page to the template.
     return render(request, 'orders_list.html', {'order_details': order_details})
 
 
 @login_required(redirect_field_name='next', login_url='signin')
 def viewOrder(request, order_id):
 
-    # Check if the current user is authenticated. This check is technically redundant due to
-    # the @login_required decorator but acts as an additional layer of verification.
-    if request.user.is_authenticated:
-        # Retrieve the user's email address.
-        email = str(request.user.email)
-
-        # Fetch the specific order by its ID and the user's email address. This ensures that
-        # users can only access their own orders.
-        order = Order.objects.get(id=order_id, emailAddress=email)
+    # Fetch the specific order by its ID and the user's account. This ensures that
+    # users can only access their own orders.
+    order = get_object_or_404(Order, id=order_id, user=request.user)
 
-        # Retrieve all items associated with the order.
-        order_items = OrderItem.objects.filter(order=order)
+    # Retrieve all items associated with the order.
+    order_items = order.orderitem_set.all()
 
     # Render and return the 'order_detail.html' template.
     # Pass the order and its associated items to the template for display.
     return render(request, 'order_detail.html', {'order': order, 'order_items': order_items})
 
+@staff_member_required
+def sales_dashboard(request):
+
+    # Sales of the last 'days' days (including today), read from the daily rollups only: a
+    # few hundred rows at most, however many orders were placed (see store.sales).
+    try:
+        days = min(max(int(request.GET.get('days', settings.STORE_SALES_DASHBOARD_DAYS)), 1), 366)
+    except ValueError:
+        days = settings.STORE_SALES_DASHBOARD_DAYS
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+
+    sums = dict(revenue=Sum('revenue'), units=Sum('units'), orders=Sum('orders'))
+    daily = DailySales.objects.filter(day__gte=since).order_by('-day')
+    totals = daily.aggregate(**sums)
+    top_products = DailyProductSales.objects.filter(day__gte=since) \
+        .values('product', 'product__name').annotate(**sums).order_by('-revenue')[:settings.STORE_SALES_DASHBOARD_TOP]
+    categories = DailyCategorySales.objects.filter(day__gte=since) \
+        .values('category', 'category__name').annotate(**sums).order_by('-revenue')
+
+    return render(request, 'sales_dashboard.html', {
+        'days': days,
+        'since': since,
+        'daily': daily,
+        'totals': totals,
+        'top_products': top_products,
+        'categories': categories,
+    })
+
+@use_replica
 def search(request):
 
     # Retrieve the search query from the request's GET parameters.
     search_query = request.GET.get('title', '')
 
-    # Filter the Product objects based on the search query.
-    products = Product.objects.filter(name__icontains=search_query)
+    # Search the full-text index of product names, descriptions and categories,
+    # best matches first.
+    results = search_products(search_query)
+
+    # Paginate the results like the product listings.
+    paginator = Paginator(results, settings.STORE_PAGE_SIZE)
+
+    try:
+        # Get the page number from the querystring, defaulting to page 1.
+        page = int(request.GET.get('page', '1'))
+    except ValueError:
+        page = 1
+
+    try:
+        # Get the products for the current page
+        products = paginator.page(page)
+    except (EmptyPage, InvalidPage):
+        # If the page number is invalid (e.g., too high), show the last page
+        products = paginator.page(paginator.num_pages)
 
     # Render and return the 'home.html' template.
-    return render(request, 'home.html', {'products': products})
+    return render(request, 'home.html', {'products': products, 'search_query': search_query})
+
+
+def search_suggest(request):
+
+    # Retrieve the prefix typed so far from the request's GET parameters.
+    prefix = request.GET.get('q', '').strip()
+
+    # Answer from the in-memory index of product names; no database query is made.
+    results = get_suggestion_index().search(prefix, limit=settings.STORE_SUGGEST_LIMIT)
+
+    # Return the matching product names and their URLs as JSON.
+    return JsonResponse({
+        'query': prefix,
+        'results': [{'name': name, 'url': url} for name, url in results],
+    })